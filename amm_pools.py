@@ -0,0 +1,343 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from block_stream import pool_source, watch_pool
+from multicall import multicall
+from price_snapshot import PriceSnapshot, publish
+from web3_provider import PROVIDER_ENDPOINT, get_contract
+
+class Pool(NamedTuple):
+    """
+    An AMM pool: "v2" for constant-product pairs, "v3" for concentrated-liquidity pools.
+    fee is the swap fee as a fraction of the input amount; tick_spacing only applies to V3 pools.
+    """
+    address: str
+    kind: str
+    token0: str
+    token1: str
+    decimals0: int
+    decimals1: int
+    fee: float
+    tick_spacing: int = 0
+
+# Define the Polygon pools read for local pricing (token0 sorts below token1 by address)
+POOLS = [
+    Pool("0x6e7a5fafcec6bb1e78bae2a1f0b612012bf14827", "v2", "MATIC", "USDC", 18, 6, 0.003),   # QuickSwap WMATIC/USDC
+    Pool("0xadbf1854e5883eb8aa7baf50705338739e558e5b", "v2", "MATIC", "WETH", 18, 18, 0.003),  # QuickSwap WMATIC/WETH
+    Pool("0x853ee4b2a13f8a742d64c8f088be7ba2131f670d", "v2", "USDC", "WETH", 6, 18, 0.003),    # QuickSwap USDC/WETH
+    Pool("0x2cf7252e74036d1da831d11089d326296e64a728", "v2", "USDC", "USDT", 6, 6, 0.003),     # QuickSwap USDC/USDT
+    Pool("0xf04adbf75cdfc5ed26eea4bbbb991db002036bdd", "v2", "USDC", "DAI", 6, 18, 0.003),     # QuickSwap USDC/DAI
+    Pool("0x45dda9cb7c25131df268515131f647d726f50608", "v3", "USDC", "WETH", 6, 18, 0.0005, 10)    # Uniswap V3 USDC/WETH 0.05%
+]
+
+# Define the contract ABIs for reading pool state
+V2_PAIR_ABI = [
+    {
+        "inputs": [],
+        "name": "getReserves",
+        "outputs": [
+            {"internalType": "uint112", "name": "reserve0", "type": "uint112"},
+            {"internalType": "uint112", "name": "reserve1", "type": "uint112"},
+            {"internalType": "uint32", "name": "blockTimestampLast", "type": "uint32"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+V3_POOL_ABI = [
+    {
+        "inputs": [],
+        "name": "slot0",
+        "outputs": [
+            {"internalType": "uint160", "name": "sqrtPriceX96", "type": "uint160"},
+            {"internalType": "int24", "name": "tick", "type": "int24"},
+            {"internalType": "uint16", "name": "observationIndex", "type": "uint16"},
+            {"internalType": "uint16", "name": "observationCardinality", "type": "uint16"},
+            {"internalType": "uint16", "name": "observationCardinalityNext", "type": "uint16"},
+            {"internalType": "uint8", "name": "feeProtocol", "type": "uint8"},
+            {"internalType": "bool", "name": "unlocked", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "liquidity",
+        "outputs": [{"internalType": "uint128", "name": "", "type": "uint128"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "int24", "name": "tick", "type": "int24"}],
+        "name": "ticks",
+        "outputs": [
+            {"internalType": "uint128", "name": "liquidityGross", "type": "uint128"},
+            {"internalType": "int128", "name": "liquidityNet", "type": "int128"},
+            {"internalType": "uint256", "name": "feeGrowthOutside0X128", "type": "uint256"},
+            {"internalType": "uint256", "name": "feeGrowthOutside1X128", "type": "uint256"},
+            {"internalType": "int56", "name": "tickCumulativeOutside", "type": "int56"},
+            {"internalType": "uint160", "name": "secondsPerLiquidityOutsideX128", "type": "uint160"},
+            {"internalType": "uint32", "name": "secondsOutside", "type": "uint32"},
+            {"internalType": "bool", "name": "initialized", "type": "bool"}
+        ],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+# Define how many tick spacings either side of the current tick read_ticks scans
+TICK_SPAN = 100
+
+# Define the last pool state read, keyed by pool address
+POOL_STATE: Dict[str, dict] = {}
+
+# Define the worker that reloads V3 ticks off the block stream's thread, and the pools it is reloading
+_tick_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tick-loader")
+_ticks_loading = set()
+
+Q96 = 2 ** 96
+
+for _pool in POOLS:
+    watch_pool(_pool.address, _pool.kind, _pool.token0, _pool.token1, _pool.decimals0, _pool.decimals1)
+
+def find_pools(token_a: str, token_b: str, pools: List[Pool] = None) -> List[Pool]:
+    """
+    Returns the pools that trade token_a against token_b, in either order.
+    """
+    return [pool for pool in (POOLS if pools is None else pools) if {pool.token0, pool.token1} == {token_a, token_b}]
+
+def read_pools(pools: List[Pool] = None, block_identifier="latest") -> Dict[str, dict]:
+    """
+    Reads getReserves for every V2 pool and slot0 plus liquidity for every V3 pool in one Multicall3 RPC.
+    Stores and returns the state of each pool that answered, keyed by pool address.
+    """
+    if pools is None:
+        pools = POOLS
+
+    requests = []
+    for pool in pools:
+        if pool.kind == "v2":
+            requests.append((get_contract(pool.address, V2_PAIR_ABI, PROVIDER_ENDPOINT), "getReserves", []))
+        else:
+            contract = get_contract(pool.address, V3_POOL_ABI, PROVIDER_ENDPOINT)
+            requests.append((contract, "slot0", []))
+            requests.append((contract, "liquidity", []))
+
+    results = iter(multicall(requests, PROVIDER_ENDPOINT, block_identifier))
+    states = {}
+    for pool in pools:
+        if pool.kind == "v2":
+            reserves = next(results)
+            if reserves is not None:
+                states[pool.address] = {"reserve0": reserves[0], "reserve1": reserves[1]}
+        else:
+            slot0, liquidity = next(results), next(results)
+            if slot0 is not None and liquidity is not None:
+                states[pool.address] = {"sqrt_price_x96": slot0[0], "tick": slot0[1], "liquidity": liquidity[0]}
+
+    for address, state in states.items():
+        update_pool_state(address, state)
+    return states
+
+def update_pool_state(address: str, state: dict):
+    """
+    Merges a pool's latest state, e.g. decoded from its Sync or Swap log by a BlockStream, into POOL_STATE.
+    The entry is replaced rather than modified, so readers never see half an update.
+    """
+    address = address.lower()
+    POOL_STATE[address] = dict(POOL_STATE.get(address, {}), **state)
+
+def read_ticks(pool: Pool, span: int = TICK_SPAN, block_identifier="latest") -> List[tuple]:
+    """
+    Reads the initialized ticks within span tick spacings of a V3 pool's current tick in one Multicall3 RPC.
+    Stores them in the pool's state, with the spacing-aligned tick they were read around as ticks_center,
+    and returns them as (tick, liquidity_net) pairs in ascending order. Call read_pools first so the current tick is known.
+    """
+    state = POOL_STATE[pool.address]
+    contract = get_contract(pool.address, V3_POOL_ABI, PROVIDER_ENDPOINT)
+    current = state["tick"] // pool.tick_spacing * pool.tick_spacing
+    indices = [current + i * pool.tick_spacing for i in range(-span, span + 1)]
+
+    results = multicall([(contract, "ticks", [tick]) for tick in indices], PROVIDER_ENDPOINT, block_identifier)
+    ticks = [
+        (tick, result[1])
+        for tick, result in zip(indices, results)
+        if result is not None and result[0] > 0
+    ]
+    update_pool_state(pool.address, {"ticks": ticks, "ticks_center": current})
+    return ticks
+
+def load_pool_state(pools: List[Pool] = None) -> Dict[str, dict]:
+    """
+    Reads the state of every pool with read_pools, then the ticks of every V3 pool that answered.
+    Returns POOL_STATE.
+    """
+    if pools is None:
+        pools = POOLS
+    states = read_pools(pools)
+    for pool in pools:
+        if pool.kind == "v3" and pool.address in states:
+            try:
+                read_ticks(pool)
+            except Exception as e:
+                print(f"Error reading ticks of pool {pool.address}: {e!r}")
+    return POOL_STATE
+
+def _reload_ticks(pool: Pool):
+    try:
+        read_ticks(pool)
+    except Exception as e:
+        print(f"Error reloading ticks of pool {pool.address}: {e!r}")
+    finally:
+        _ticks_loading.discard(pool.address)
+
+def on_pool_state(address: str, state: dict):
+    """
+    Merges a pool's state decoded from its logs by a BlockStream, and reloads a V3 pool's ticks in the
+    background once a Swap moves its tick across a tick spacing, so tick crossings are quoted from current liquidity.
+    """
+    update_pool_state(address, state)
+    pool = next((pool for pool in POOLS if pool.address == address.lower()), None)
+    if pool is None or pool.kind != "v3" or "tick" not in state or pool.address in _ticks_loading:
+        return
+    if state["tick"] // pool.tick_spacing * pool.tick_spacing != POOL_STATE[pool.address].get("ticks_center"):
+        _ticks_loading.add(pool.address)
+        _tick_loader.submit(_reload_ticks, pool)
+
+def tick_to_sqrt_price(tick) -> np.ndarray:
+    """
+    Returns sqrt(1.0001 ** tick), the raw square-root price at a tick boundary.
+    """
+    return np.power(1.0001, np.asarray(tick, dtype=np.float64) / 2)
+
+def v2_amount_out(amount_in, reserve_in, reserve_out, fee: float):
+    """
+    Constant-product output for a raw input amount. Works element-wise on arrays of amounts.
+    """
+    amount_in_after_fee = np.asarray(amount_in, dtype=np.float64) * (1 - fee)
+    return amount_in_after_fee * reserve_out / (reserve_in + amount_in_after_fee)
+
+def v3_amount_out(amount_in, sqrt_price_x96: int, liquidity: int, zero_for_one: bool, fee: float):
+    """
+    Concentrated-liquidity output for a raw input amount, assuming the swap stays inside the current
+    tick range. Works element-wise on arrays of amounts.
+    """
+    amount_in_after_fee = np.asarray(amount_in, dtype=np.float64) * (1 - fee)
+    sqrt_price = sqrt_price_x96 / Q96
+    liquidity = float(liquidity)
+    if zero_for_one:
+        next_sqrt_price = liquidity * sqrt_price / (liquidity + amount_in_after_fee * sqrt_price)
+        return liquidity * (sqrt_price - next_sqrt_price)
+    next_sqrt_price = sqrt_price + amount_in_after_fee / liquidity
+    return liquidity * (next_sqrt_price - sqrt_price) / (sqrt_price * next_sqrt_price)
+
+def v3_amount_out_with_ticks(amount_in, sqrt_price_x96: int, liquidity: int, ticks: List[tuple], zero_for_one: bool, fee: float):
+    """
+    Concentrated-liquidity output for raw input amounts, crossing the initialized (tick, liquidity_net)
+    boundaries on the way. The piecewise segments are built once and every amount is then placed in its
+    segment with a binary search, so it works element-wise on arrays of amounts.
+    Input beyond the last known boundary is filled at the liquidity left after crossing it.
+    """
+    amount_in_after_fee = np.asarray(amount_in, dtype=np.float64) * (1 - fee)
+    sqrt_price = sqrt_price_x96 / Q96
+    liquidity = float(liquidity)
+
+    # Collect the boundaries the price crosses in swap direction, and the liquidity after each crossing
+    if zero_for_one:
+        crossed = sorted((tick for tick in ticks if tick_to_sqrt_price(tick[0]) < sqrt_price), reverse=True)
+    else:
+        crossed = sorted(tick for tick in ticks if tick_to_sqrt_price(tick[0]) > sqrt_price)
+
+    starts = [sqrt_price]
+    liquidities = [liquidity]
+    for tick, liquidity_net in crossed:
+        starts.append(float(tick_to_sqrt_price(tick)))
+        liquidity = liquidity - liquidity_net if zero_for_one else liquidity + liquidity_net
+        liquidities.append(max(liquidity, 0.0))
+    starts = np.array(starts)
+    liquidities = np.array(liquidities)
+
+    # Input needed and output produced by running each segment to its end
+    upper, lower = starts[:-1], starts[1:]
+    segment_liquidity = liquidities[:-1]
+    if zero_for_one:
+        segment_in = segment_liquidity * (1 / lower - 1 / upper)
+        segment_out = segment_liquidity * (upper - lower)
+    else:
+        segment_in = segment_liquidity * (lower - upper)
+        segment_out = segment_liquidity * (1 / upper - 1 / lower)
+    cumulative_in = np.concatenate(([0.0], np.cumsum(segment_in)))
+    cumulative_out = np.concatenate(([0.0], np.cumsum(segment_out)))
+
+    # Finish each amount inside the segment it ends in
+    segment = np.searchsorted(cumulative_in, amount_in_after_fee, side="right") - 1
+    remaining = amount_in_after_fee - cumulative_in[segment]
+    start = starts[segment]
+    current_liquidity = liquidities[segment]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if zero_for_one:
+            end = current_liquidity * start / (current_liquidity + remaining * start)
+            partial = current_liquidity * (start - end)
+        else:
+            end = start + remaining / current_liquidity
+            partial = current_liquidity * (end - start) / (start * end)
+    partial = np.where(current_liquidity > 0, partial, 0.0)
+    return cumulative_out[segment] + partial
+
+def quote(pool: Pool, token_in: str, amount_in, state: dict = None):
+    """
+    Returns the output amount, in whole tokens, for selling amount_in whole tokens of token_in into pool.
+    Uses the last state read by read_pools unless one is given, crossing ticks when read_ticks has loaded them.
+    """
+    if state is None:
+        state = POOL_STATE[pool.address]
+
+    zero_for_one = token_in == pool.token0
+    decimals_in, decimals_out = (pool.decimals0, pool.decimals1) if zero_for_one else (pool.decimals1, pool.decimals0)
+    raw_in = np.asarray(amount_in, dtype=np.float64) * 10 ** decimals_in
+
+    if pool.kind == "v2":
+        reserve_in, reserve_out = (state["reserve0"], state["reserve1"]) if zero_for_one else (state["reserve1"], state["reserve0"])
+        raw_out = v2_amount_out(raw_in, float(reserve_in), float(reserve_out), pool.fee)
+    elif state.get("ticks"):
+        raw_out = v3_amount_out_with_ticks(raw_in, state["sqrt_price_x96"], state["liquidity"], state["ticks"], zero_for_one, pool.fee)
+    else:
+        raw_out = v3_amount_out(raw_in, state["sqrt_price_x96"], state["liquidity"], zero_for_one, pool.fee)
+
+    return raw_out / 10 ** decimals_out
+
+def mid_price(pool: Pool, state: dict = None) -> Optional[float]:
+    """
+    Returns the marginal price of token0 in token1 before fees, or None for an empty pool.
+    """
+    if state is None:
+        state = POOL_STATE.get(pool.address)
+    if not state:
+        return None
+
+    scale = 10 ** (pool.decimals0 - pool.decimals1)
+    if pool.kind == "v2":
+        if not state["reserve0"] or not state["reserve1"]:
+            return None
+        return state["reserve1"] / state["reserve0"] * scale
+    return (state["sqrt_price_x96"] / Q96) ** 2 * scale or None
+
+def fetch_onchain_prices(pools: List[Pool] = None) -> PriceSnapshot:
+    """
+    Reads every pool in one batched call and publishes their mid prices, in both directions, each under its pool's source.
+    """
+    if pools is None:
+        pools = POOLS
+
+    states = read_pools(pools)
+    entries = {}
+    for pool in pools:
+        price = mid_price(pool, states.get(pool.address))
+        if price:
+            entries[(pool_source(pool.address), pool.token0, pool.token1)] = price
+            entries[(pool_source(pool.address), pool.token1, pool.token0)] = 1 / price
+
+    return publish(entries, replace_sources=[pool_source(pool.address) for pool in pools])
@@ -1,11 +1,24 @@
 import time
 import os
 from typing import List
+import numpy as np
 from web3 import Web3
 from dotenv import load_dotenv
-from price import fetch_prices, get_price
+from prices import TOKEN_CONTRACTS, fetch_prices, get_price, token_address
+from price_matrix import PriceMatrix
+from amm_pools import load_pool_state, on_pool_state
+from balances import BALANCE_TABLE
+from block_stream import BlockStream
+from gas_costs import ONEINCH_EXCHANGE_ADDRESS, PARASWAP_EXCHANGE_ADDRESS, record_simulations, route_gas_cost, swap_hops
+from gas_oracle import GAS_ORACLE
+from multicall import multicall
+from reserve_cache import MISSING, BlockCache
+from execution import EXECUTOR_CONTRACT_ADDRESS, TransactionTemplate, route_shape
+from simulation import FORK_UPSTREAM_ENDPOINT, SIMULATION_DEADLINE, RouteSimulator, SimulationResult, SwapCall
+from slippage import get_slippages
+from web3_provider import PROVIDER_ENDPOINT, get_contract, get_web3
 from tweet_sentiment import scrape_tweets
-from findarbitrage import find_arbitrage_sequence
+from findarbitrage import WALLET_ALLOCATOR, find_arbitrage_sequence
 
 # Load environment variables
 load_dotenv()
@@ -21,11 +34,9 @@ TRADING_PAIRS = [
 ]
 
 # Define the slippage percentage to use when checking for arbitrage opportunities
+# (check_arbitrage_matrix can instead derive it per pair from pool reserves for a given trade size)
 SLIPPAGE = 0.005
 
-# Define the gas price to use when submitting transactions
-GAS_PRICE = Web3.toWei("50", "gwei")
-
 # Define the duration of the arbitrage trades (in seconds)
 TRADE_DURATION = 3600  # 1 hour
 
@@ -39,6 +50,28 @@ LENDING_RATES = {
 # Define the minimum expected profit to proceed with arbitrage (in USD)
 MIN_PROFIT = 10
 
+# Define the hops of a pair arbitrage, as (venue, swap_type), for gas costing
+PAIR_ARBITRAGE_HOPS = swap_hops([PARASWAP_EXCHANGE_ADDRESS, ONEINCH_EXCHANGE_ADDRESS])
+
+# Define the token gas is paid in
+NATIVE_TOKEN = "MATIC"
+
+# Define the reason codes reported by check_arbitrage_batch, in the order the filters are applied
+REASON_OPPORTUNITY = 0
+REASON_MISSING_PRICE = 1
+REASON_YIELD = 2
+REASON_SENTIMENT = 3
+REASON_PARASWAP_SPREAD = 4
+REASON_CMC_SPREAD = 5
+REASON_MIN_PROFIT = 6
+
+# Define the row layout of the check_arbitrage_batch result
+ARBITRAGE_RESULT_DTYPE = np.dtype([
+    ("expected_profit", np.float64),
+    ("arbitrage_opportunity", np.bool_),
+    ("reason", np.uint8)
+])
+
 # Define the wallet addresses to use for trading
 WALLET_ADDRESS_1 = os.environ.get("WALLET_ADDRESS_1")
 WALLET_ADDRESS_2 = os.environ.get("WALLET_ADDRESS_2")
@@ -47,9 +80,8 @@ WALLET_ADDRESS_2 = os.environ.get("WALLET_ADDRESS_2")
 WALLET_PRIVATE_KEY_1 = os.environ.get("WALLET_PRIVATE_KEY_1")
 WALLET_PRIVATE_KEY_2 = os.environ.get("WALLET_PRIVATE_KEY_2")
 
-# Define the Ethereum network and provider endpoint
+# Define the Ethereum network (the provider endpoint comes from web3_provider)
 NETWORK = "polygon"
-PROVIDER_ENDPOINT = "https://rpc-mainnet.maticvigil.com"
 
 # Define the contract addresses for the lending protocols
 AAVE_LENDING_POOL_ADDRESSES = {
@@ -64,9 +96,12 @@ COMPOUND_LENDING_POOL_ADDRESSES = {
     "DAI": "0x8f3cf7ad23cd3cadbd9735aff958023239c6a063"
 }
 
-# Define the contract addresses for the decentralized exchanges
-PARASWAP_EXCHANGE_ADDRESS = "0x90249ed4d69D70E709fFCd8beE2c5bD8d4D0c0Be"
-ONEINCH_EXCHANGE_ADDRESS = "0x11111112542d85b3ef69ae05771c2dccff4faa26"
+# Define the cache of lending reserve data, valid for one block
+RESERVE_CACHE = BlockCache()
+
+# Define the simulator used to pre-validate routes, started on first use, and the transaction templates of the routes it simulates
+_route_simulator = None
+_route_templates = {}
 
 # Define the contract ABI for the lending protocols
 LENDING_POOL_ABI = [
@@ -131,62 +166,52 @@ LENDING_POOL_ABI = [
     }
 ]
 
-# Define the contract ABI for the decentralized exchanges
-EXCHANGE_ABI = [
-    {
-        "inputs": [
-            {
-                "internalType": "address",
-                "name": "tokenIn",
-                "type": "address"
-            },
-            {
-                "internalType": "address",
-                "name": "tokenOut",
-                "type": "address"
-            },
-            {
-                "internalType": "uint256",
-                "name": "amountIn",
-                "type": "uint256"
-            },
-            {
-                "internalType": "uint256",
-                "name": "amountOutMin",
-                "type": "uint256"
-            },
-            {
-                "internalType": "address[]",
-                "name": "path",
-                "type": "address[]"
-            },
-            {
-                "internalType": "address",
-                "name": "to",
-                "type": "address"
-            },
-            {
-                "internalType": "uint256",
-                "name": "deadline",
-                "type": "uint256"
-            }
-        ],
-        "name": "swap",
-        "outputs": [
-            {
-                "internalType": "uint256",
-                "name": "amountOut",
-                "type": "uint256"
-            }
-        ],
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
+def get_lending_pool_address(asset: str) -> str:
+    """
+    Returns the Aave lending pool for an asset, falling back to Compound, or None if neither lists it.
+    """
+    return AAVE_LENDING_POOL_ADDRESSES.get(asset) or COMPOUND_LENDING_POOL_ADDRESSES.get(asset)
+
+def fetch_reserve_data(pairs: List[str]) -> dict:
+    """
+    Fetches getReserveData for every pair whose quote asset can be lent.
+    Serves pairs already queried in the current block from RESERVE_CACHE and fetches the rest in a single Multicall3 RPC.
+    Returns a dictionary mapping each pair to its reserve data, or to None if the query reverted.
+    Pairs whose base asset has no known contract are left out.
+    """
+    block_number = RESERVE_CACHE.current_block(get_web3(PROVIDER_ENDPOINT))
+    reserves = {}
+    queries = []
+    for pair in pairs:
+        base_asset, quote_asset = pair.split("/")
+        lending_pool_address = get_lending_pool_address(quote_asset)
+        if not (LENDING_RATES.get(quote_asset) and lending_pool_address):
+            continue
+
+        asset_address = token_address(base_asset)
+        if asset_address is None:
+            continue  # no contract known for the asset, so no reserve data
+        asset_address = Web3.toChecksumAddress(asset_address)
+        reserve_data = RESERVE_CACHE.get(lending_pool_address, asset_address, block_number)
+        if reserve_data is not MISSING:
+            reserves[pair] = reserve_data
+            continue
+
+        lending_pool_contract = get_contract(lending_pool_address, LENDING_POOL_ABI, PROVIDER_ENDPOINT)
+        queries.append((pair, lending_pool_address, asset_address, (lending_pool_contract, "getReserveData", [asset_address])))
+
+    if queries:
+        results = multicall([query for _, _, _, query in queries], PROVIDER_ENDPOINT, block_number)
+        for (pair, lending_pool_address, asset_address, _), reserve_data in zip(queries, results):
+            RESERVE_CACHE.put(lending_pool_address, asset_address, block_number, reserve_data)
+            reserves[pair] = reserve_data
 
-def check_yield_vs_profit(pair: str, paraswap_price: float, oneinch_price: float, cmc_price: float, coinlib_price: float) -> bool:
+    return reserves
+
+def check_yield_vs_profit(pair: str, paraswap_price: float, oneinch_price: float, cmc_price: float, coinlib_price: float, reserve_data: tuple = None) -> bool:
     """
     Checks if the potential yield for lending assets over the duration of arbitrage trades outweighs expected profit.
+    Uses reserve_data when it was prefetched by fetch_reserve_data, otherwise fetches it through the block cache.
     Returns True if the potential yield outweighs the expected profit, False otherwise.
     """
     base_asset, quote_asset = pair.split("/")
@@ -196,15 +221,14 @@ def check_yield_vs_profit(pair: str, paraswap_price: float, oneinch_price: float
         return False  # cannot lend quote asset
 
     # Calculate the potential yield for lending assets over the duration of arbitrage trades
-    lending_pool_address = AAVE_LENDING_POOL_ADDRESSES.get(quote_asset)
+    lending_pool_address = get_lending_pool_address(quote_asset)
     if not lending_pool_address:
-        lending_pool_address = COMPOUND_LENDING_POOL_ADDRESSES.get(quote_asset)
-        if not lending_pool_address:
-            return False  # lending pool not found
+        return False  # lending pool not found
 
-    web3 = Web3(Web3.HTTPProvider(PROVIDER_ENDPOINT))
-    lending_pool_contract = web3.eth.contract(address=lending_pool_address, abi=LENDING_POOL_ABI)
-    reserve_data = lending_pool_contract.functions.getReserveData(Web3.toChecksumAddress(base_asset)).call()
+    if reserve_data is None:
+        reserve_data = fetch_reserve_data([pair]).get(pair)
+        if reserve_data is None:
+            return False  # reserve data unavailable
     available_liquidity = reserve_data[0]
     lending_duration_in_years = TRADE_DURATION / (365 * 24 * 60 * 60)
     potential_yield = available_liquidity * (1 + lending_rate) ** lending_duration_in_years - available_liquidity
@@ -220,44 +244,36 @@ def check_yield_vs_profit(pair: str, paraswap_price: float, oneinch_price: float
 
     return False  # expected profit outweighs potential yield
 
-def check_arbitrage(pair: str, paraswap_price: float, oneinch_price: float, cmc_price: float, coinlib_price: float, sentiment: dict) -> dict:
+def check_yield_vs_profit_batch(pairs: List[str], paraswap_prices: np.ndarray, oneinch_prices: np.ndarray, cmc_prices: np.ndarray, coinlib_prices: np.ndarray) -> np.ndarray:
     """
-    Checks for arbitrage opportunities for the given trading pair and prices.
-    Returns a dictionary containing the trading pair, prices, and whether an arbitrage opportunity exists.
+    Runs check_yield_vs_profit for every pair against reserve data fetched in at most one batched RPC.
+    Returns a boolean array for the yield_outweighs_profit argument of check_arbitrage_batch.
     """
-    base_asset, quote_asset = pair.split("/")
-    paraswap_fee = paraswap_price * SLIPPAGE
-    oneinch_fee = oneinch_price * SLIPPAGE
+    reserves = fetch_reserve_data(pairs)
+    return np.array([
+        pair in reserves and reserves[pair] is not None
+        and check_yield_vs_profit(pair, paraswap_prices[i], oneinch_prices[i], cmc_prices[i], coinlib_prices[i], reserves[pair])
+        for i, pair in enumerate(pairs)
+    ], dtype=bool)
 
-    # Check if potential yield for lending assets outweighs expected profit
-    if check_yield_vs_profit(pair, paraswap_price, oneinch_price, cmc_price, coinlib_price):
-        print(f"Not proceeding with arbitrage for {pair}: potential yield for lending assets outweighs expected profit")
-        return {
-            "pair": pair,
-            "paraswap_price": paraswap_price,
-            "oneinch_price": oneinch_price,
-            "cmc_price ": cmc_price,
-            "coinlib_price": coinlib_price,
-"sentiment": sentiment,
-"arbitrage_opportunity": False
-}
+def start_block_stream(endpoint: str = None) -> BlockStream:
+    """
+    Starts streaming block headers and pool events in the background.
+    New headers invalidate RESERVE_CACHE and wake GAS_ORACLE and BALANCE_TABLE, pool events are published into the price snapshot
+    and keep POOL_STATE current after it is loaded once here (V3 ticks are reloaded as swaps move the tick), and transfers in and out of our wallets update WALLET_ALLOCATOR's balances.
+    """
+    try:
+        load_pool_state()
+    except Exception as e:
+        print(f"Error loading pool state, waiting for pool events instead: {e!r}")
 
-# Check if the sentiment for the base asset is positive
-if sentiment.get(base_asset, 0) < 0:
-    print(f"Not proceeding with arbitrage for {pair}: negative sentiment for {base_asset}")
-    return {
-        "pair": pair,
-        "paraswap_price": paraswap_price,
-        "oneinch_price": oneinch_price,
-        "cmc_price": cmc_price,
-        "coinlib_price": coinlib_price,
-        "sentiment": sentiment,
-        "arbitrage_opportunity": False
-    }
+    kwargs = {"endpoint": endpoint} if endpoint else {}
+    return BlockStream(on_block=[RESERVE_CACHE.on_new_block, GAS_ORACLE.on_new_block, BALANCE_TABLE.on_new_block], log_handlers=WALLET_ALLOCATOR.log_handlers(), on_pool_state=on_pool_state, **kwargs).start()
 
-# Check if the prices on Paraswap and 1inch differ enough to allow for arbitrage
-if paraswap_price * (1 + SLIPPAGE) >= oneinch_price:
-    print(f"Not proceeding with arbitrage for {pair}: Paraswap price not lower than 1inch price")
+def _arbitrage_result(pair: str, paraswap_price: float, oneinch_price: float, cmc_price: float, coinlib_price: float, sentiment: dict, arbitrage_opportunity: bool) -> dict:
+    """
+    Builds the result dictionary returned by check_arbitrage.
+    """
     return {
         "pair": pair,
         "paraswap_price": paraswap_price,
@@ -265,47 +281,178 @@ if paraswap_price * (1 + SLIPPAGE) >= oneinch_price:
         "cmc_price": cmc_price,
         "coinlib_price": coinlib_price,
         "sentiment": sentiment,
-        "arbitrage_opportunity": False
+        "arbitrage_opportunity": arbitrage_opportunity
     }
 
-# Check if the prices on CoinMarketCap and CoinLib differ enough to allow for arbitrage
-if cmc_price * (1 + SLIPPAGE) <= coinlib_price:
-    print(f"Not proceeding with arbitrage for {pair}: CoinMarketCap price not higher than CoinLib price")
-    return {
-        "pair": pair,
-        "paraswap_price": paraswap_price,
-        "oneinch_price": oneinch_price,
-        "cmc_price": cmc_price,
-        "coinlib_price": coinlib_price,
-        "sentiment": sentiment,
-        "arbitrage_opportunity": False
-    }
+def check_arbitrage(pair: str, paraswap_price: float, oneinch_price: float, cmc_price: float, coinlib_price: float, sentiment: dict, gas_cost: float = 0.0) -> dict:
+    """
+    Checks for arbitrage opportunities for the given trading pair and prices.
+    gas_cost, in the quote asset, is subtracted from the expected profit.
+    Returns a dictionary containing the trading pair, prices, and whether an arbitrage opportunity exists.
+    """
+    base_asset, quote_asset = pair.split("/")
 
-# Check if the expected profit from arbitrage trades exceeds the minimum required profit
-paraswap_profit = paraswap_price / oneinch_price * cmc_price * (1 - SLIPPAGE) - cmc_price * (1 + SLIPPAGE)
-oneinch_profit = oneinch_price / paraswap_price * cmc_price * (1 - SLIPPAGE) - cmc_price * (1 + SLIPPAGE)
-expected_profit = max(paraswap_profit, oneinch_profit)
+    def result(arbitrage_opportunity: bool) -> dict:
+        return _arbitrage_result(pair, paraswap_price, oneinch_price, cmc_price, coinlib_price, sentiment, arbitrage_opportunity)
 
-if expected_profit < MIN_PROFIT:
-    print(f"Not proceeding with arbitrage for {pair}: expected profit below minimum required profit")
-    return {
-        "pair": pair,
-        "paraswap_price": paraswap_price,
-        "oneinch_price": oneinch_price,
-        "cmc_price": cmc_price,
-        "coinlib_price": coinlib_price,
-        "sentiment": sentiment,
-        "arbitrage_opportunity": False
-    }
+    # Check if potential yield for lending assets outweighs expected profit
+    if check_yield_vs_profit(pair, paraswap_price, oneinch_price, cmc_price, coinlib_price):
+        print(f"Not proceeding with arbitrage for {pair}: potential yield for lending assets outweighs expected profit")
+        return result(False)
+
+    # Check if the sentiment for the base asset is positive
+    if sentiment.get(base_asset, 0) < 0:
+        print(f"Not proceeding with arbitrage for {pair}: negative sentiment for {base_asset}")
+        return result(False)
+
+    # Check if the prices on Paraswap and 1inch differ enough to allow for arbitrage
+    if paraswap_price * (1 + SLIPPAGE) >= oneinch_price:
+        print(f"Not proceeding with arbitrage for {pair}: Paraswap price not lower than 1inch price")
+        return result(False)
+
+    # Check if the prices on CoinMarketCap and CoinLib differ enough to allow for arbitrage
+    if cmc_price * (1 + SLIPPAGE) <= coinlib_price:
+        print(f"Not proceeding with arbitrage for {pair}: CoinMarketCap price not higher than CoinLib price")
+        return result(False)
+
+    # Check if the expected profit from arbitrage trades exceeds the minimum required profit
+    paraswap_profit = paraswap_price / oneinch_price * cmc_price * (1 - SLIPPAGE) - cmc_price * (1 + SLIPPAGE)
+    oneinch_profit = oneinch_price / paraswap_price * cmc_price * (1 - SLIPPAGE) - cmc_price * (1 + SLIPPAGE)
+    expected_profit = max(paraswap_profit, oneinch_profit) - gas_cost
+
+    if expected_profit < MIN_PROFIT:
+        print(f"Not proceeding with arbitrage for {pair}: expected profit below minimum required profit")
+        return result(False)
+
+    # Arbitrage opportunity found
+    print(f"Arbitrage opportunity found for {pair}: expected profit of {expected_profit:.2f} USD")
+    return result(True)
+
+def check_arbitrage_batch(pairs: List[str], paraswap_prices: np.ndarray, oneinch_prices: np.ndarray, cmc_prices: np.ndarray, coinlib_prices: np.ndarray, sentiment: dict, yield_outweighs_profit: np.ndarray = None, slippage=SLIPPAGE, gas_cost=0.0) -> np.ndarray:
+    """
+    Applies the check_arbitrage filters to every pair at once.
+    Takes one price per pair from each source, an optional per-pair result of the lending yield check,
+    and a slippage and a gas cost (in each pair's quote asset) that are either scalars or one value per pair.
+    Returns a structured array with one row per pair holding the expected profit, whether an
+    arbitrage opportunity exists and the REASON_* code of the first filter that rejected the pair.
+    """
+    paraswap_prices = np.asarray(paraswap_prices, dtype=np.float64)
+    oneinch_prices = np.asarray(oneinch_prices, dtype=np.float64)
+    cmc_prices = np.asarray(cmc_prices, dtype=np.float64)
+    coinlib_prices = np.asarray(coinlib_prices, dtype=np.float64)
+    slippage = np.asarray(slippage, dtype=np.float64)
+    gas_cost = np.asarray(gas_cost, dtype=np.float64)
+
+    if isinstance(sentiment, dict):
+        sentiment = np.array([sentiment.get(pair.split("/")[0], 0) for pair in pairs], dtype=np.float64)
+    if yield_outweighs_profit is None:
+        yield_outweighs_profit = np.zeros(len(pairs), dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        paraswap_profit = paraswap_prices / oneinch_prices * cmc_prices * (1 - slippage) - cmc_prices * (1 + slippage)
+        oneinch_profit = oneinch_prices / paraswap_prices * cmc_prices * (1 - slippage) - cmc_prices * (1 + slippage)
+    expected_profit = np.maximum(paraswap_profit, oneinch_profit) - gas_cost
+
+    # Filters are listed in the same order check_arbitrage applies them, so the first failing one wins
+    missing_price = ~(np.isfinite(paraswap_prices) & np.isfinite(oneinch_prices) & np.isfinite(cmc_prices) & np.isfinite(coinlib_prices))
+    reason = np.select(
+        [
+            missing_price,
+            yield_outweighs_profit,
+            sentiment < 0,
+            paraswap_prices * (1 + slippage) >= oneinch_prices,
+            cmc_prices * (1 + slippage) <= coinlib_prices,
+            ~(expected_profit >= MIN_PROFIT)
+        ],
+        [REASON_MISSING_PRICE, REASON_YIELD, REASON_SENTIMENT, REASON_PARASWAP_SPREAD, REASON_CMC_SPREAD, REASON_MIN_PROFIT],
+        default=REASON_OPPORTUNITY
+    )
+
+    result = np.empty(len(pairs), dtype=ARBITRAGE_RESULT_DTYPE)
+    result["expected_profit"] = expected_profit
+    result["arbitrage_opportunity"] = reason == REASON_OPPORTUNITY
+    result["reason"] = reason
+    return result
+
+def pair_gas_costs(matrix: PriceMatrix, pairs: List[str]) -> np.ndarray:
+    """
+    Returns the gas cost of a pair arbitrage in each pair's quote asset, valuing NATIVE_TOKEN at the
+    highest price any source quotes for it. Pairs whose quote asset has no NATIVE_TOKEN price cost nothing.
+    """
+    native_pairs = [f"{NATIVE_TOKEN}/{pair.split('/')[1]}" for pair in pairs]
+    native_prices = np.fmax.reduce(matrix.pair_prices(native_pairs), axis=0)
+    return np.nan_to_num(route_gas_cost(PAIR_ARBITRAGE_HOPS) * native_prices)
+
+def check_arbitrage_matrix(matrix: PriceMatrix, sentiment: dict, pairs: List[str] = None, yield_outweighs_profit: np.ndarray = None, trade_amount: float = None, gas_cost=None) -> np.ndarray:
+    """
+    Runs check_arbitrage_batch over the given pairs, TRADING_PAIRS by default, using prices from a PriceMatrix.
+    With trade_amount, slippage is computed per pair from pool reserves for that size instead of SLIPPAGE.
+    Gas is costed from the gas table at the oracle's gas price unless gas_cost is given.
+    """
+    if pairs is None:
+        pairs = TRADING_PAIRS
+    if gas_cost is None:
+        gas_cost = pair_gas_costs(matrix, pairs)
+
+    pair_prices = matrix.pair_prices(pairs)
+    return check_arbitrage_batch(
+        pairs,
+        pair_prices[matrix.source_index["paraswap"]],
+        pair_prices[matrix.source_index["oneinch"]],
+        pair_prices[matrix.source_index["coinmarketcap"]],
+        pair_prices[matrix.source_index["coinlib"]],
+        sentiment,
+        yield_outweighs_profit,
+        SLIPPAGE if trade_amount is None else get_slippages(pairs, trade_amount),
+        gas_cost
+    )
+
+def pair_arbitrage_route(pair: str, amount_in: int) -> List[SwapCall]:
+    """
+    Builds the swap calls of a pair arbitrage: buy the base asset with amount_in of the quote asset
+    on Paraswap, then sell all of it back on 1inch. amount_in is in raw units of the quote asset.
+    Raises ValueError if either asset has no known contract.
+    """
+    base_asset, quote_asset = pair.split("/")
+    base_address, quote_address = token_address(base_asset), token_address(quote_asset)
+    if base_address is None or quote_address is None:
+        raise ValueError(f"No contract known for {base_asset if base_address is None else quote_asset}")
+    return [
+        SwapCall(PARASWAP_EXCHANGE_ADDRESS, quote_address, base_address, amount_in),
+        SwapCall(ONEINCH_EXCHANGE_ADDRESS, base_address, quote_address)
+    ]
+
+def simulate_pair_arbitrage(pairs: List[str], amounts_in: List[int], block_number: int = None) -> List[SimulationResult]:
+    """
+    Simulates the pair arbitrage of each pair on local forks of the current block before anything is
+    submitted: the same flash-loan transaction the executor fires, sent from WALLET_ADDRESS_1 with no
+    minimum outputs. Returns the exact outputs, gas used and revert reason per pair; pairs whose route
+    cannot be built fail without being simulated. The measured gas of each hop is recorded in GAS_TABLE.
+    """
+    global _route_simulator
+
+    if EXECUTOR_CONTRACT_ADDRESS is None:
+        raise RuntimeError("EXECUTOR_CONTRACT_ADDRESS must be set to simulate routes")
+    if _route_simulator is None:
+        _route_simulator = RouteSimulator()
+    if block_number is None:
+        block_number = get_web3(FORK_UPSTREAM_ENDPOINT).eth.block_number
+
+    results = [None] * len(pairs)
+    transactions = []
+    for i, (pair, amount_in) in enumerate(zip(pairs, amounts_in)):
+        try:
+            route = pair_arbitrage_route(pair, amount_in)
+        except ValueError as e:
+            results[i] = SimulationResult(False, [], 0, f"simulation failed: {e}", block_number)
+            continue
+        shape = route_shape(route)
+        if shape not in _route_templates:
+            _route_templates[shape] = TransactionTemplate(route, EXECUTOR_CONTRACT_ADDRESS)
+        transactions.append((i, _route_templates[shape].route_transaction(amount_in, [0] * len(route), SIMULATION_DEADLINE)))
 
-# Arbitrage opportunity found
-print(f"Arbitrage opportunity found for {pair}: expected profit of {expected_profit:.2f} USD")
-return {
-    "pair": pair,
-    "paraswap_price": paraswap_price,
-    "oneinch_price": oneinch_price,
-    "cmc_price": cmc_price,
-    "coinlib_price": coinlib_price,
-    "sentiment": sentiment,
-    "arbitrage_opportunity": True
-}
\ No newline at end of file
+    simulated = _route_simulator.simulate([transaction for _, transaction in transactions], WALLET_ADDRESS_1, block_number)
+    for (i, _), result in zip(transactions, simulated):
+        results[i] = result
+    record_simulations([(transaction.exchanges, result) for (_, transaction), result in zip(transactions, simulated)])
+    return results
@@ -0,0 +1,307 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from amm_pools import POOLS, Pool
+from block_stream import ONCHAIN_SOURCE, source_pool
+from price_matrix import PriceMatrix
+
+# Define the sources whose quotes can actually be traded against ("onchain" stands for every pool source)
+TRADABLE_SOURCES = ("paraswap", "oneinch", "onchain")
+
+# Define the fee charged per trade on each source (as a fraction of the traded amount);
+# pool sources are charged their pool's fee tier, and the onchain fee only applies to pools missing from POOLS
+VENUE_FEES = {
+    "paraswap": 0.0,
+    "oneinch": 0.0,
+    "onchain": 0.003
+}
+
+# Define the slippage assumed on every trade (as a fraction of the traded amount)
+TRADE_SLIPPAGE = 0.005
+
+# Define the maximum number of trades in an arbitrage cycle
+MAX_HOPS = 4
+
+# Define the largest (starts x tokens x tokens) block relaxed at once, to bound memory use
+RELAX_BLOCK_SIZE = 4_000_000
+
+class TokenGraph:
+    """
+    A dense token graph whose edge weights are -log(effective rate), so that a cycle
+    with negative total weight is a sequence of trades that ends with more than it started.
+    weights[i, j] is +inf where no tradable quote exists; venues[i, j] names the source used.
+    """
+
+    def __init__(self, tokens: Sequence[str], weights: np.ndarray, venues: np.ndarray, rates: np.ndarray):
+        self.tokens = tuple(tokens)
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+        self.weights = weights
+        self.venues = venues
+        self.rates = rates
+
+    @classmethod
+    def from_matrix(cls, matrix: PriceMatrix, sources: Sequence[str] = TRADABLE_SOURCES, slippage: float = TRADE_SLIPPAGE, infer_reverse: bool = True, pools: Sequence[Pool] = None) -> "TokenGraph":
+        """
+        Builds the graph from a PriceMatrix, keeping the best rate after fees and slippage across sources.
+        Each pool source is a venue of its own and pays its pool's fee tier (see source_fee).
+        With infer_reverse, a venue that only quotes A/B is also assumed to trade B/A at 1 / price.
+        """
+        sources = [
+            source for source in matrix.sources
+            if source in sources or (ONCHAIN_SOURCE in sources and source_pool(source) is not None)
+        ]
+        rates = np.full((len(sources),) + matrix.values.shape[1:], np.nan, dtype=np.float64)
+
+        for s, source in enumerate(sources):
+            quoted = matrix.values[matrix.source_index[source]]
+            if infer_reverse:
+                with np.errstate(divide="ignore"):
+                    quoted = np.where(np.isnan(quoted), 1 / quoted.T, quoted)
+            rates[s] = quoted * (1 - source_fee(source, pools)) * (1 - slippage)
+
+        best_rates = np.fmax.reduce(rates, axis=0) if len(sources) else np.full(matrix.values.shape[1:], np.nan)
+        venue_indices = np.argmax(np.where(np.isnan(rates), -np.inf, rates), axis=0) if len(sources) else np.zeros(best_rates.shape, dtype=np.intp)
+        venues = np.array(sources or [""], dtype=object)[venue_indices]
+
+        return cls(matrix.tokens, rates_to_weights(best_rates), venues, best_rates)
+
+    def trades(self, path: Sequence[int]) -> List[Dict[str, object]]:
+        """
+        Describes a path of token indices as a list of trades.
+        """
+        return [
+            {
+                "from_token": self.tokens[u],
+                "to_token": self.tokens[v],
+                "source": self.venues[u, v],
+                "rate": float(self.rates[u, v])
+            }
+            for u, v in zip(path, path[1:])
+        ]
+
+def source_fee(source: str, pools: Sequence[Pool] = None) -> float:
+    """
+    Returns the fee charged per trade on a source: the fee tier of its pool for a pool source,
+    VENUE_FEES otherwise.
+    """
+    address = source_pool(source)
+    if address is None:
+        return VENUE_FEES.get(source, 0.0)
+    for pool in (POOLS if pools is None else pools):
+        if pool.address.lower() == address:
+            return pool.fee
+    return VENUE_FEES[ONCHAIN_SOURCE]
+
+def rates_to_weights(rates: np.ndarray) -> np.ndarray:
+    """
+    Converts effective rates to edge weights -log(rate). Missing, non-positive and self edges become +inf.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = -np.log(rates)
+    weights[~(rates > 0)] = np.inf
+    np.fill_diagonal(weights, np.inf)
+    return weights
+
+def relax(weights: np.ndarray, starts: np.ndarray, max_hops: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Hop-limited Bellman-Ford from every start node at once.
+    Returns one (dist, pred) pair per hop count k = 1..max_hops, where dist[a, v] is the lightest
+    walk of exactly k edges from starts[a] to v and pred[a, v] is the node before v on that walk.
+    """
+    dist = weights[starts]
+    layers = [(dist, np.broadcast_to(starts[:, None], dist.shape))]
+
+    for _ in range(2, max_hops + 1):
+        candidates = dist[:, :, None] + weights[None, :, :]
+        pred = np.argmin(candidates, axis=1)
+        dist = np.take_along_axis(candidates, pred[:, None, :], axis=1)[:, 0, :]
+        layers.append((dist, pred))
+
+    return layers
+
+def closing_bounds(weights: np.ndarray, starts: np.ndarray, max_hops: int) -> List[np.ndarray]:
+    """
+    Returns, for h = 1..max_hops, a (starts, tokens) array whose [a, v] entry is the lightest walk of at most
+    h edges from v back to starts[a]. No simple path can close a cycle more cheaply, so it bounds the search.
+    """
+    bounds = []
+    bound = np.full((len(starts), len(weights)), np.inf)
+    for dist, _ in relax(weights.T, starts, max_hops):
+        bound = np.minimum(bound, dist)
+        bounds.append(bound)
+    return bounds
+
+def simple_cycles_from(weights: np.ndarray, start: int, bounds: List[np.ndarray], row: int, max_hops: int, threshold: float) -> Dict[Tuple[int, ...], float]:
+    """
+    Enumerates the simple cycles of 2..max_hops edges whose smallest node is start and whose weight is below
+    threshold, extending all paths one edge at a time. A path is dropped as soon as even the lightest walk
+    back to start (from bounds, see closing_bounds) cannot bring it below threshold.
+    """
+    paths = np.array([[start]], dtype=np.intp)
+    path_weights = np.zeros(1)
+    cycles = {}
+
+    for hops in range(1, max_hops + 1):
+        candidates = path_weights[:, None] + weights[paths[:, -1]]
+        if hops >= 2:
+            for i in np.nonzero(candidates[:, start] < threshold)[0]:
+                cycles[tuple(paths[i].tolist()) + (start,)] = float(candidates[i, start])
+        if hops == max_hops:
+            break
+
+        # Only extend to unvisited nodes above start, so each cycle is found once, from its smallest node
+        extend = np.isfinite(candidates)
+        extend[:, :start + 1] = False
+        extend[np.arange(len(paths))[:, None], paths] = False
+        extend &= candidates + bounds[max_hops - hops - 1][row] < threshold
+        rows, nodes = np.nonzero(extend)
+        if len(rows) == 0:
+            break
+        paths = np.column_stack([paths[rows], nodes])
+        path_weights = candidates[rows, nodes]
+
+    return cycles
+
+def _opportunity(graph: TokenGraph, path: Tuple[int, ...], weight: float) -> Dict[str, object]:
+    return {
+        "path": [graph.tokens[i] for i in path],
+        "profit_percent": float(np.expm1(-weight) * 100),
+        "hops": len(path) - 1,
+        "trades": graph.trades(path)
+    }
+
+def _rank(graph: TokenGraph, cycles: Dict[Tuple[int, ...], float]) -> List[Dict[str, object]]:
+    ranked = sorted(cycles.items(), key=lambda item: item[1])
+    return [_opportunity(graph, path, weight) for path, weight in ranked]
+
+def search_cycles(graph: TokenGraph, max_hops: int = MAX_HOPS, min_profit_percent: float = 0.0, start_nodes: np.ndarray = None) -> Dict[Tuple[int, ...], float]:
+    """
+    Finds every simple cycle of at most max_hops trades whose compounded rate beats min_profit_percent.
+    A hop-limited Bellman-Ford first keeps only the start nodes with a closed walk below the threshold;
+    each of those is then searched exhaustively over simple paths, so a profitable walk that revisits a
+    token cannot hide a simple cycle. Cycles are found from their smallest node, so with start_nodes only
+    the cycles whose smallest node is in start_nodes are found. Returns a dict mapping each cycle, as a closed path
+    of token indices starting at its smallest node, to its total weight.
+    """
+    n = len(graph.tokens)
+    if n < 2 or max_hops < 2:
+        return {}
+
+    if start_nodes is None:
+        start_nodes = np.arange(n)
+    threshold = -np.log1p(min_profit_percent / 100)
+    cycles = {}
+    block = max(1, RELAX_BLOCK_SIZE // (n * n))
+
+    for offset in range(0, len(start_nodes), block):
+        starts = np.asarray(start_nodes[offset:offset + block], dtype=np.intp)
+        rows = np.arange(len(starts))
+        closing = np.min([dist[rows, starts] for dist, _ in relax(graph.weights, starts, max_hops)[1:]], axis=0)
+        candidates = np.nonzero(closing < threshold)[0]
+        if len(candidates) == 0:
+            continue
+
+        bounds = closing_bounds(graph.weights, starts[candidates], max_hops - 1)
+        for row, start in enumerate(starts[candidates]):
+            cycles.update(simple_cycles_from(graph.weights, int(start), bounds, row, max_hops, threshold))
+
+    return cycles
+
+def find_negative_cycles(graph: TokenGraph, max_hops: int = MAX_HOPS, min_profit_percent: float = 0.0) -> List[Dict[str, object]]:
+    """
+    Finds simple cycles of at most max_hops trades whose compounded rate beats min_profit_percent.
+    Returns them ranked by profit, each as a dict with the token path, profit_percent, hop count
+    and the list of trades that executes it.
+    """
+    return _rank(graph, search_cycles(graph, max_hops, min_profit_percent))
+
+class IncrementalTokenGraph:
+    """
+    A token graph that keeps its negative cycles between price ticks.
+    Each update diffs the new edge weights against the previous ones and drops the cycles that used a
+    changed edge. It then re-runs the search only from the affected region: the nodes that lie on some
+    closed walk of at most max_hops edges through a changed edge. Every cycle through a changed edge has
+    its smallest node in that region and every other cycle is unchanged, so the cached cycles match what
+    a full search would find.
+    """
+
+    def __init__(self, max_hops: int = MAX_HOPS, min_profit_percent: float = 0.0, tolerance: float = 1e-12):
+        self.max_hops = max_hops
+        self.min_profit_percent = min_profit_percent
+        self.tolerance = tolerance
+        self.graph = None
+        self.cycles = {}
+        self.last_tick = {}
+
+    def update_from_matrix(self, matrix: PriceMatrix, **kwargs) -> Dict[str, int]:
+        """
+        Applies a price refresh. Keyword arguments are passed to TokenGraph.from_matrix.
+        """
+        return self.update(TokenGraph.from_matrix(matrix, **kwargs))
+
+    def update(self, graph: TokenGraph) -> Dict[str, int]:
+        """
+        Replaces the edge weights with those of graph and re-runs detection where they changed.
+        Returns and stores in last_tick how many edges changed, nodes were touched and cycles were
+        dropped and found.
+        """
+        previous = self.graph
+        self.graph = graph
+        n = len(graph.tokens)
+
+        if previous is None or previous.tokens != graph.tokens:
+            dropped = len(self.cycles)
+            self.cycles = search_cycles(graph, self.max_hops, self.min_profit_percent)
+            return self._record(n * n, n, dropped, len(self.cycles))
+
+        old, new = previous.weights, graph.weights
+        with np.errstate(invalid="ignore"):
+            changed = ~((old == new) | (np.abs(old - new) <= self.tolerance))
+        tails, heads = np.nonzero(changed)
+        if len(tails) == 0:
+            return self._record(0, 0, 0, 0)
+
+        changed_edges = set(zip(tails.tolist(), heads.tolist()))
+        stale = [path for path in self.cycles if any(edge in changed_edges for edge in zip(path, path[1:]))]
+        for path in stale:
+            del self.cycles[path]
+
+        region = self._region(new, heads, tails)
+        found = 0
+        for path, weight in search_cycles(graph, self.max_hops, self.min_profit_percent, region).items():
+            if path not in self.cycles:
+                self.cycles[path] = weight
+                found += 1
+        return self._record(len(changed_edges), len(region), len(stale), found)
+
+    def _region(self, weights: np.ndarray, heads: np.ndarray, tails: np.ndarray) -> np.ndarray:
+        """
+        Returns the nodes reachable from a changed edge's head and able to reach a changed edge's tail
+        within max_hops - 1 edges. Only these nodes can start a closed walk through a changed edge.
+        """
+        finite = np.isfinite(weights)
+        forward = np.zeros(len(weights), dtype=bool)
+        backward = np.zeros(len(weights), dtype=bool)
+        forward[heads] = True
+        backward[tails] = True
+        for _ in range(self.max_hops - 1):
+            forward |= finite[forward].any(axis=0)
+            backward |= finite[:, backward].any(axis=1)
+        return np.nonzero(forward & backward)[0]
+
+    def _record(self, edges_changed: int, nodes_touched: int, cycles_dropped: int, cycles_found: int) -> Dict[str, int]:
+        self.last_tick = {
+            "edges_changed": edges_changed,
+            "nodes_touched": nodes_touched,
+            "cycles_dropped": cycles_dropped,
+            "cycles_found": cycles_found,
+            "cycles_total": len(self.cycles)
+        }
+        return self.last_tick
+
+    def opportunities(self) -> List[Dict[str, object]]:
+        """
+        Returns the cached cycles ranked by profit, in the same shape as find_negative_cycles.
+        """
+        return _rank(self.graph, self.cycles)
@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from web3 import Web3
+
+from execution import EXECUTOR_CONTRACT_ADDRESS
+from multicall import multicall
+from prices import POLYGON_BASE_TOKENS, TOKEN_CONTRACTS
+from web3_provider import PROVIDER_ENDPOINT, get_contract, get_web3
+
+# Define the wallets that can execute trades
+WALLET_ADDRESSES = [address for address in (os.environ.get("WALLET_ADDRESS_1"), os.environ.get("WALLET_ADDRESS_2")) if address]
+
+# Define the tokens whose balances are tracked: the base tokens we hold collateral in
+TRACKED_TOKENS = [TOKEN_CONTRACTS[symbol] for symbol in POLYGON_BASE_TOKENS]
+
+# Define the contract our collateral is spent by, whose allowances are tracked (unset means allowances are not checked)
+ALLOWANCE_SPENDER = os.environ.get("ALLOWANCE_SPENDER", EXECUTOR_CONTRACT_ADDRESS)
+
+# Define how often balances are refreshed when no new block wakes the refresher (in seconds)
+BALANCE_REFRESH_INTERVAL = float(os.environ.get("BALANCE_REFRESH_INTERVAL", 2.0))
+
+# Define the minimal ERC-20 ABI needed to read balances and allowances
+ERC20_ABI = [
+    {
+        "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "address", "name": "owner", "type": "address"},
+            {"internalType": "address", "name": "spender", "type": "address"}
+        ],
+        "name": "allowance",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [],
+        "name": "decimals",
+        "outputs": [{"internalType": "uint8", "name": "", "type": "uint8"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+class BalanceSnapshot(NamedTuple):
+    """
+    The balances and allowances of every tracked (wallet, token) at one block, as (wallets, tokens)
+    arrays in whole tokens. Allowances are infinite when no spender is tracked. Never modified once published.
+    """
+    block_number: int
+    balances: np.ndarray
+    allowances: np.ndarray
+    updated_at: float
+
+    def spendable(self) -> np.ndarray:
+        """
+        Returns what each wallet can put up of each token: its balance, capped by its allowance.
+        """
+        return np.minimum(self.balances, self.allowances)
+
+class BalanceTable:
+    """
+    Keeps balanceOf and allowance of every tracked token for every wallet, fetched in a single multicall
+    per block on a background thread. Readers take the latest snapshot, so they never wait on the network,
+    and check collateral with array comparisons.
+    """
+
+    def __init__(self, wallets: Sequence[str] = WALLET_ADDRESSES, tokens: Sequence[str] = TRACKED_TOKENS, spender: Optional[str] = ALLOWANCE_SPENDER, endpoint: str = PROVIDER_ENDPOINT, interval: float = BALANCE_REFRESH_INTERVAL):
+        self.wallets = [Web3.toChecksumAddress(wallet) for wallet in wallets]
+        self.tokens = list(dict.fromkeys(token.lower() for token in tokens))
+        self.wallet_index = {wallet: i for i, wallet in enumerate(self.wallets)}
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+        self.spender = Web3.toChecksumAddress(spender) if spender else None
+        self.endpoint = endpoint
+        self.interval = interval
+        self.decimals: Optional[np.ndarray] = None
+        self.snapshot: Optional[BalanceSnapshot] = None
+        self._subscribers: List[Callable[[BalanceSnapshot], None]] = []
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def refresh(self, block_number: int = None) -> BalanceSnapshot:
+        """
+        Fetches every balance and allowance at block_number (the latest block by default) in one multicall,
+        publishes the snapshot and passes it to the subscribers. Reverted balance and allowance calls read as
+        zero, and a token whose decimals cannot be read is taken to have 18.
+        """
+        if block_number is None:
+            block_number = get_web3(self.endpoint).eth.block_number
+        contracts = [get_contract(token, ERC20_ABI, self.endpoint) for token in self.tokens]
+
+        requests = [] if self.decimals is not None else [(contract, "decimals", []) for contract in contracts]
+        requests += [(contract, "balanceOf", [wallet]) for wallet in self.wallets for contract in contracts]
+        if self.spender is not None:
+            requests += [(contract, "allowance", [wallet, self.spender]) for wallet in self.wallets for contract in contracts]
+        results = multicall(requests, self.endpoint, block_number)
+
+        if self.decimals is None:
+            self.decimals = np.array([result[0] if result is not None else 18 for result in results[:len(self.tokens)]], dtype=np.float64)
+            results = results[len(self.tokens):]
+        results = [result[0] if result is not None else 0 for result in results]
+
+        shape = (len(self.wallets), len(self.tokens))
+        size = shape[0] * shape[1]
+        scale = 10.0 ** self.decimals
+        balances = np.array(results[:size], dtype=np.float64).reshape(shape) / scale
+        if self.spender is not None:
+            allowances = np.array(results[size:], dtype=np.float64).reshape(shape) / scale
+        else:
+            allowances = np.full(shape, np.inf)
+
+        snapshot = self.snapshot = BalanceSnapshot(block_number, balances, allowances, time.time())
+        for callback in self._subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Error in balance subscriber: {e!r}")
+        return snapshot
+
+    def subscribe(self, callback: Callable[[BalanceSnapshot], None]):
+        """
+        Registers a callback run with every new snapshot, on the refreshing thread.
+        """
+        self._subscribers.append(callback)
+
+    def collateral_matrix(self, collaterals: Sequence[Dict[str, float]]) -> np.ndarray:
+        """
+        Turns {token address: amount} collateral requirements into a (requirements, tokens) array.
+        A requirement on an untracked token is infinite, so it can never be funded.
+        """
+        required = np.zeros((len(collaterals), len(self.tokens)))
+        for row, collateral in enumerate(collaterals):
+            for token, amount in collateral.items():
+                column = self.token_index.get(token.lower())
+                if column is None:
+                    required[row, :] = np.inf
+                    break
+                required[row, column] += amount
+        return required
+
+    def fundable(self, required: np.ndarray, spendable: np.ndarray = None) -> np.ndarray:
+        """
+        Returns a (requirements, wallets) boolean array of which wallet can cover which requirement,
+        from the latest snapshot unless a spendable (wallets, tokens) array is given.
+        """
+        if spendable is None:
+            if self.snapshot is None:
+                return np.zeros((len(required), len(self.wallets)), dtype=bool)
+            spendable = self.snapshot.spendable()
+        return (spendable[np.newaxis, :, :] >= required[:, np.newaxis, :]).all(axis=2)
+
+    def on_new_block(self, block_number: int):
+        """
+        Wakes the refresher for a new block header, e.g. from a BlockStream.
+        """
+        if self.snapshot is None or block_number > self.snapshot.block_number:
+            self._wake.set()
+
+    def run(self):
+        """
+        Refreshes until stop() is called.
+        """
+        while not self._stopping:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing balances: {e!r}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self) -> "BalanceTable":
+        """
+        Runs the refresher on a background thread.
+        """
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name="balance-table", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the refresher after its current refresh.
+        """
+        self._stopping = True
+        self._wake.set()
+
+# Define the shared balance table of our wallets
+BALANCE_TABLE = BalanceTable()
+
+def start_balance_table() -> BalanceTable:
+    """
+    Starts refreshing BALANCE_TABLE in the background.
+    """
+    return BALANCE_TABLE.start()
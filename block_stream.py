@@ -0,0 +1,309 @@
+import asyncio
+import itertools
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import websockets
+from web3 import Web3
+
+from price_snapshot import publish
+
+# Define the WebSocket endpoint used for eth_subscribe
+WS_PROVIDER_ENDPOINT = os.environ.get("WS_PROVIDER_ENDPOINT", "ws://127.0.0.1:8546")
+
+# Define the snapshot source name for prices derived from on-chain pool events (each pool publishes as "onchain:<address>")
+ONCHAIN_SOURCE = "onchain"
+
+# Define the reconnect backoff bounds (in seconds)
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+# Define the timeout for JSON-RPC requests sent over the socket (in seconds)
+WS_REQUEST_TIMEOUT = 10.0
+
+# Define the most blocks fetched in one eth_getLogs call while backfilling
+BACKFILL_BLOCK_RANGE = 1000
+
+# Define the event topics of Uniswap-V2-style Sync and Uniswap-V3-style Swap logs
+SYNC_TOPIC = Web3.keccak(text="Sync(uint112,uint112)").hex()
+SWAP_V3_TOPIC = Web3.keccak(text="Swap(address,address,int256,int256,uint160,uint128,int24)").hex()
+
+# Define the pools to watch, keyed by lowercase address:
+# {"kind": "v2" or "v3", "token0": symbol, "token1": symbol, "decimals0": int, "decimals1": int}
+WATCHED_POOLS: Dict[str, dict] = {}
+
+def watch_pool(address: str, kind: str, token0: str, token1: str, decimals0: int, decimals1: int):
+    """
+    Adds a pool to WATCHED_POOLS. Streams started afterwards subscribe to its events.
+    """
+    WATCHED_POOLS[address.lower()] = {
+        "kind": kind,
+        "token0": token0,
+        "token1": token1,
+        "decimals0": decimals0,
+        "decimals1": decimals1
+    }
+
+def pool_source(address: str) -> str:
+    """
+    Returns the snapshot source a pool's prices are published under, so pools trading the same pair
+    never overwrite each other's quotes.
+    """
+    return f"{ONCHAIN_SOURCE}:{address.lower()}"
+
+def source_pool(source: str) -> Optional[str]:
+    """
+    Returns the pool address of a pool_source name, or None for any other source.
+    """
+    prefix = ONCHAIN_SOURCE + ":"
+    return source[len(prefix):] if source.startswith(prefix) else None
+
+def _words(data: str) -> List[int]:
+    raw = bytes.fromhex(data[2:] if data.startswith("0x") else data)
+    return [int.from_bytes(raw[i:i + 32], "big") for i in range(0, len(raw), 32)]
+
+def log_position(log: dict) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (block number, log index) a log was emitted at, or None for a log not yet mined.
+    """
+    if log.get("blockNumber") is None or log.get("logIndex") is None:
+        return None
+    return int(log["blockNumber"], 16), int(log["logIndex"], 16)
+
+def _signed(word: int, bits: int = 256) -> int:
+    return word - (1 << bits) if word >> (bits - 1) else word
+
+def decode_pool_state(log: dict, pools: Dict[str, dict] = WATCHED_POOLS) -> dict:
+    """
+    Returns the pool state a Sync or V3 Swap log leaves behind, in the layout of amm_pools.read_pools:
+    both reserves for a V2 pool, sqrt_price_x96, liquidity and tick for a V3 pool.
+    Returns an empty dict for other logs.
+    """
+    pool = pools.get(log.get("address", "").lower())
+    topics = log.get("topics") or []
+    if pool is None or not topics or log.get("removed"):
+        return {}
+
+    words = _words(log["data"])
+    if topics[0] == SYNC_TOPIC and len(words) >= 2:
+        return {"reserve0": words[0], "reserve1": words[1]}
+    if topics[0] == SWAP_V3_TOPIC and len(words) >= 5:
+        return {"sqrt_price_x96": words[2], "liquidity": words[3], "tick": _signed(words[4])}
+    return {}
+
+def decode_pool_log(log: dict, pools: Dict[str, dict] = WATCHED_POOLS) -> Dict[tuple, float]:
+    """
+    Turns a Sync or V3 Swap log from a watched pool into snapshot entries for both directions of the pair,
+    under the pool's own source.
+    Returns an empty dict for logs it cannot price.
+    """
+    pool = pools.get(log.get("address", "").lower())
+    topics = log.get("topics") or []
+    if pool is None or not topics or log.get("removed"):
+        return {}
+
+    words = _words(log["data"])
+    scale = 10 ** (pool["decimals0"] - pool["decimals1"])
+    if topics[0] == SYNC_TOPIC and len(words) >= 2:
+        reserve0, reserve1 = words[0], words[1]
+        if reserve0 == 0 or reserve1 == 0:
+            return {}
+        price = reserve1 / reserve0 * scale
+    elif topics[0] == SWAP_V3_TOPIC and len(words) >= 3:
+        price = (words[2] / 2 ** 96) ** 2 * scale
+        if price == 0:
+            return {}
+    else:
+        return {}
+
+    source = pool_source(log["address"])
+    return {
+        (source, pool["token0"], pool["token1"]): price,
+        (source, pool["token1"], pool["token0"]): 1 / price
+    }
+
+class BlockStream:
+    """
+    Subscribes to newHeads and to the Sync/Swap logs of the watched pools over a WebSocket.
+    New block numbers are passed to the on_block callbacks and pool prices are published into the
+    price snapshot as they arrive. Each (log filter, callback) in log_handlers gets its own logs
+    subscription. Reconnects with backoff, and on reconnect backfills the logs of any blocks missed
+    while disconnected. A pool log older than the last one applied for its pool, e.g. a backfilled log
+    arriving after a live one, is skipped so it cannot overwrite a newer price.
+    The pool state each log carries (reserves, or price, liquidity and tick) is passed to on_pool_state.
+    """
+
+    def __init__(self, endpoint: str = WS_PROVIDER_ENDPOINT, pools: Dict[str, dict] = None, on_block: List[Callable[[int], None]] = None, log_handlers: List[Tuple[dict, Callable[[List[dict]], None]]] = None, on_pool_state: Callable[[str, dict], None] = None):
+        self.endpoint = endpoint
+        self.pools = pools if pools is not None else WATCHED_POOLS
+        self.on_block = list(on_block or [])
+        self.log_handlers = list(log_handlers or [])
+        self.on_pool_state = on_pool_state
+        self.last_block: Optional[int] = None
+        self.reconnects = 0
+        self.pool_positions: Dict[str, Tuple[int, int]] = {}
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._subscriptions: Dict[str, Callable] = {}
+        self._ws = None
+        self._stopping = False
+        self._loop = None
+        self._thread = None
+
+    def _log_filter(self) -> dict:
+        return {"address": [Web3.toChecksumAddress(address) for address in self.pools], "topics": [[SYNC_TOPIC, SWAP_V3_TOPIC]]}
+
+    def _log_subscriptions(self) -> List[Tuple[dict, Callable[[List[dict]], None]]]:
+        pool_subscription = [(self._log_filter(), self._handle_logs)] if self.pools else []
+        return pool_subscription + self.log_handlers
+
+    async def _request(self, method: str, params: list):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        await self._ws.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}))
+        try:
+            response = await asyncio.wait_for(future, WS_REQUEST_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in response:
+            raise RuntimeError(f"{method} failed: {response['error']}")
+        return response.get("result")
+
+    async def _read(self):
+        try:
+            async for message in self._ws:
+                try:
+                    self._handle_message(json.loads(message))
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    print(f"Skipping malformed message from {self.endpoint}: {e!r}")
+        finally:
+            # Fail any request still waiting on a reply, so the session can reconnect straight away
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("WebSocket closed"))
+
+    def _handle_message(self, payload: dict):
+        if "id" in payload:
+            future = self._pending.get(payload["id"])
+            if future is not None and not future.done():
+                future.set_result(payload)
+        elif payload.get("method") == "eth_subscription":
+            params = payload["params"]
+            handler = self._subscriptions.get(params["subscription"])
+            if handler == self._handle_block:
+                self._handle_block(int(params["result"]["number"], 16))
+            elif handler is not None:
+                self._dispatch_logs(handler, [params["result"]])
+
+    def _handle_block(self, block_number: int):
+        if self.last_block is not None and block_number <= self.last_block:
+            return
+        self.last_block = block_number
+        for callback in self.on_block:
+            try:
+                callback(block_number)
+            except Exception as e:
+                print(f"Error in block callback for block {block_number}: {e!r}")
+
+    def _dispatch_logs(self, handler: Callable[[List[dict]], None], logs: List[dict]):
+        try:
+            handler(logs)
+        except Exception as e:
+            print(f"Error in log callback: {e!r}")
+
+    def _handle_logs(self, logs: List[dict]):
+        entries = {}
+        for log in logs:
+            address = log.get("address", "").lower()
+            position = log_position(log)
+            if log.get("removed"):
+                # A reorg rolls the pool back, so the logs replacing this one must not be skipped
+                self.pool_positions.pop(address, None)
+                continue
+            if position is not None:
+                if address in self.pool_positions and position <= self.pool_positions[address]:
+                    continue
+                self.pool_positions[address] = position
+            entries.update(decode_pool_log(log, self.pools))
+
+            state = decode_pool_state(log, self.pools)
+            if state and self.on_pool_state is not None:
+                try:
+                    self.on_pool_state(address, state)
+                except Exception as e:
+                    print(f"Error in pool state callback for {address}: {e!r}")
+        if entries:
+            publish(entries)
+
+    async def _backfill(self, resume_from: Optional[int], latest: int):
+        """
+        Replays the subscribed logs of the blocks after resume_from up to latest.
+        """
+        subscriptions = self._log_subscriptions()
+        if resume_from is None or latest <= resume_from or not subscriptions:
+            return
+
+        first_block = resume_from + 1
+        for from_block in range(first_block, latest + 1, BACKFILL_BLOCK_RANGE):
+            to_block = min(latest, from_block + BACKFILL_BLOCK_RANGE - 1)
+            for log_filter, handler in subscriptions:
+                logs = await self._request("eth_getLogs", [dict(log_filter, fromBlock=hex(from_block), toBlock=hex(to_block))])
+                self._dispatch_logs(handler, logs)
+        print(f"Backfilled blocks {first_block} to {latest}")
+
+    async def _session(self):
+        async with websockets.connect(self.endpoint, max_size=None) as ws:
+            self._ws = ws
+            resume_from = self.last_block
+            reader = asyncio.ensure_future(self._read())
+            try:
+                self._subscriptions = {}
+                self._subscriptions[await self._request("eth_subscribe", ["newHeads"])] = self._handle_block
+                for log_filter, handler in self._log_subscriptions():
+                    self._subscriptions[await self._request("eth_subscribe", ["logs", log_filter])] = handler
+
+                latest = int(await self._request("eth_blockNumber", []), 16)
+                await self._backfill(resume_from, latest)
+                self._handle_block(latest)
+                await reader
+            finally:
+                reader.cancel()
+                self._ws = None
+
+    async def run(self):
+        """
+        Streams until stop() is called, reconnecting with exponential backoff.
+        """
+        delay = RECONNECT_DELAY
+        while not self._stopping:
+            try:
+                await self._session()
+                delay = RECONNECT_DELAY
+            except (OSError, asyncio.TimeoutError, RuntimeError, websockets.exceptions.WebSocketException) as e:
+                print(f"Block stream to {self.endpoint} disconnected: {e!r}")
+            if self._stopping:
+                break
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def start(self) -> "BlockStream":
+        """
+        Runs the stream on a background thread.
+        """
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_until_complete, args=(self.run(),), name="block-stream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Closes the socket and stops reconnecting.
+        """
+        self._stopping = True
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
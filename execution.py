@@ -0,0 +1,298 @@
+import os
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import rlp
+from eth_keys import keys
+from eth_utils import keccak
+from web3 import Web3
+
+from gas_costs import GAS_TABLE, TX_BASE_GAS, swap_hops
+from gas_oracle import GAS_ORACLE, current_gas_price
+from nonce_manager import NONCE_MANAGER, STUCK_TRANSACTION_SECONDS, NonceManager, PendingTransaction, bumped_fees
+from relays import RELAY_ROUTER, RelayRouter, Submission
+from simulation import EXCHANGE_ABI, RouteTransaction, SwapCall
+from web3_provider import PROVIDER_ENDPOINT, get_contract
+
+# Define the chain transactions are signed for (Polygon mainnet)
+CHAIN_ID = int(os.environ.get("CHAIN_ID", 137))
+
+# Define the Aave V3 pool that lends the flash loan, and our contract that receives it and runs the swaps
+AAVE_POOL_ADDRESS = os.environ.get("AAVE_POOL_ADDRESS", "0x794a61358D6845594F94dc1DB02A252b5b4814aD")
+EXECUTOR_CONTRACT_ADDRESS = os.environ.get("EXECUTOR_CONTRACT_ADDRESS")
+
+# Define how long a fired transaction stays valid (in seconds)
+DEADLINE_SECONDS = 60
+
+# Define the margin added to the gas table estimate for the gas limit
+GAS_LIMIT_MARGIN = 1.25
+
+# Define the priority fee percentile bid when firing
+PRIORITY_FEE_PERCENTILE = 90
+
+# Define the amountIn that has the executor contract swap its whole balance of the hop's input token (type(uint256).max)
+CONTRACT_BALANCE = 2 ** 256 - 1
+
+# Define the sentinel word marking a patchable field in a template: a fixed tag in the high bytes and the slot number in the low ones
+SENTINEL_TAG = 0x5E171E1 << 224
+
+# Define the flashLoanSimple entry point of the Aave V3 pool
+FLASH_LOAN_ABI = [
+    {
+        "inputs": [
+            {"internalType": "address", "name": "receiverAddress", "type": "address"},
+            {"internalType": "address", "name": "asset", "type": "address"},
+            {"internalType": "uint256", "name": "amount", "type": "uint256"},
+            {"internalType": "bytes", "name": "params", "type": "bytes"},
+            {"internalType": "uint16", "name": "referralCode", "type": "uint16"}
+        ],
+        "name": "flashLoanSimple",
+        "outputs": [],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+def _sentinel(slot: int) -> int:
+    return SENTINEL_TAG | (slot + 1)
+
+def route_shape(route: Sequence[SwapCall]) -> tuple:
+    """
+    Returns the part of a route that is fixed per template: exchanges, tokens and paths, but no amounts.
+    """
+    return tuple((swap.exchange.lower(), swap.token_in.lower(), swap.token_out.lower(), tuple(swap.path or ())) for swap in route)
+
+class TransactionTemplate:
+    """
+    The calldata of a flash-loan-funded route with every amount and deadline left as a sentinel word,
+    plus the byte offsets of those words, so firing it only patches a few 32-byte slices.
+    Slot 0 is the loan amount, then per hop: amountIn, amountOutMin and deadline.
+    """
+
+    def __init__(self, route: Sequence[SwapCall], executor_address: str, endpoint: str = PROVIDER_ENDPOINT):
+        self.shape = route_shape(route)
+        self.exchanges = [Web3.toChecksumAddress(swap.exchange) for swap in route]
+        self.to = bytes.fromhex(Web3.toChecksumAddress(AAVE_POOL_ADDRESS)[2:])
+        self.gas_limit = int(GAS_TABLE.route_gas(swap_hops(swap.exchange for swap in route), flash_loan=True) * GAS_LIMIT_MARGIN)
+
+        executor_address = Web3.toChecksumAddress(executor_address)
+        swap_calls = []
+        for i, swap in enumerate(route):
+            exchange = get_contract(swap.exchange, EXCHANGE_ABI, endpoint)
+            path = [Web3.toChecksumAddress(token) for token in (swap.path or [swap.token_in, swap.token_out])]
+            swap_calls.append(bytes.fromhex(exchange.encodeABI(fn_name="swap", args=[
+                Web3.toChecksumAddress(swap.token_in),
+                Web3.toChecksumAddress(swap.token_out),
+                _sentinel(1 + 3 * i),
+                _sentinel(2 + 3 * i),
+                path,
+                executor_address,
+                _sentinel(3 + 3 * i)
+            ])[2:]))
+
+        # The executor contract decodes params as (address[] exchanges, bytes[] calls) and runs the calls in order,
+        # first replacing an amountIn of CONTRACT_BALANCE with its balance of the hop's input token
+        params = Web3().codec.encode_abi(
+            ["address[]", "bytes[]"],
+            [[Web3.toChecksumAddress(swap.exchange) for swap in route], swap_calls]
+        )
+        pool = get_contract(AAVE_POOL_ADDRESS, FLASH_LOAN_ABI, endpoint)
+        self.data = bytes.fromhex(pool.encodeABI(fn_name="flashLoanSimple", args=[
+            executor_address,
+            Web3.toChecksumAddress(route[0].token_in),
+            _sentinel(0),
+            params,
+            0
+        ])[2:])
+
+        self.offsets: List[int] = []
+        for slot in range(1 + 3 * len(route)):
+            word = _sentinel(slot).to_bytes(32, "big")
+            offset = self.data.find(word)
+            if offset < 0 or self.data.find(word, offset + 1) >= 0:
+                raise ValueError(f"Sentinel for slot {slot} not found exactly once in the template calldata")
+            self.offsets.append(offset)
+
+    def fill(self, amount_in: int, min_amounts_out: Sequence[int], deadline: int) -> bytes:
+        """
+        Returns the calldata for borrowing amount_in and running the route. Each hop after the first
+        spends the contract's whole balance of its input token, i.e. everything the previous hop returned,
+        and every hop reverts below its own minimum output.
+        """
+        if len(min_amounts_out) * 3 + 1 != len(self.offsets):
+            raise ValueError(f"Expected {len(self.offsets) // 3} minimum outputs, got {len(min_amounts_out)}")
+
+        data = bytearray(self.data)
+        deadline_word = deadline.to_bytes(32, "big")
+        data[self.offsets[0]:self.offsets[0] + 32] = amount_in.to_bytes(32, "big")
+        hop_amount_in = amount_in
+        for i, min_amount_out in enumerate(min_amounts_out):
+            amount_in_offset, min_out_offset, deadline_offset = self.offsets[1 + 3 * i:4 + 3 * i]
+            data[amount_in_offset:amount_in_offset + 32] = hop_amount_in.to_bytes(32, "big")
+            data[min_out_offset:min_out_offset + 32] = min_amount_out.to_bytes(32, "big")
+            data[deadline_offset:deadline_offset + 32] = deadline_word
+            hop_amount_in = CONTRACT_BALANCE
+        return bytes(data)
+
+    def route_transaction(self, amount_in: int, min_amounts_out: Sequence[int], deadline: int) -> RouteTransaction:
+        """
+        Returns the filled transaction as fired, e.g. to simulate it before firing.
+        """
+        return RouteTransaction("0x" + self.to.hex(), self.fill(amount_in, min_amounts_out, deadline), self.exchanges, self.gas_limit)
+
+def sign_transaction(private_key: keys.PrivateKey, nonce: int, max_priority_fee: int, max_fee: int, gas_limit: int, to: bytes, data: bytes, chain_id: int = CHAIN_ID) -> Tuple[bytes, bytes]:
+    """
+    Signs an EIP-1559 transaction from raw fields, skipping the dict validation of eth_account.
+    Returns (raw transaction, transaction hash). Signing is fast when coincurve is installed.
+    """
+    fields = [chain_id, nonce, max_priority_fee, max_fee, gas_limit, to, 0, data, []]
+    signature = private_key.sign_msg_hash(keccak(b"\x02" + rlp.encode(fields)))
+    raw_transaction = b"\x02" + rlp.encode(fields + [signature.v, signature.r, signature.s])
+    return raw_transaction, keccak(raw_transaction)
+
+class Executor:
+    """
+    Fires flash-loan arbitrage routes from one wallet. Templates are built once per route shape and
+    nonces come from the shared nonce manager, so firing is a few byte patches, a signature and one parallel
+    fan-out to the relays.
+    """
+
+    def __init__(self, wallet_address: str, private_key: str, executor_address: str = EXECUTOR_CONTRACT_ADDRESS, endpoint: str = PROVIDER_ENDPOINT, nonces: NonceManager = NONCE_MANAGER, relays: RelayRouter = RELAY_ROUTER):
+        self.wallet_address = Web3.toChecksumAddress(wallet_address)
+        self.private_key = keys.PrivateKey(bytes.fromhex(private_key[2:] if private_key.startswith("0x") else private_key))
+        self.executor_address = executor_address
+        self.endpoint = endpoint
+        self.templates: Dict[tuple, TransactionTemplate] = {}
+        self.nonces = nonces
+        self.relays = relays
+
+    def template(self, route: Sequence[SwapCall]) -> TransactionTemplate:
+        """
+        Returns the template for the route's shape, building it on first use. Call ahead of time to warm it.
+        """
+        shape = route_shape(route)
+        template = self.templates.get(shape)
+        if template is None:
+            template = self.templates[shape] = TransactionTemplate(route, self.executor_address, self.endpoint)
+        return template
+
+    def _sign(self, nonce: int, max_priority_fee: int, max_fee: int, gas_limit: int, to: bytes, data: bytes) -> Tuple[bytes, PendingTransaction]:
+        raw_transaction, transaction_hash = sign_transaction(self.private_key, nonce, max_priority_fee, max_fee, gas_limit, to, data)
+        return raw_transaction, PendingTransaction(nonce, "0x" + transaction_hash.hex(), "0x" + to.hex(), "0x" + data.hex(), gas_limit, max_priority_fee, max_fee, time.time())
+
+    def _current_fees(self) -> Tuple[int, int]:
+        max_priority_fee = GAS_ORACLE.priority_fee(PRIORITY_FEE_PERCENTILE) or 0
+        estimate = GAS_ORACLE.estimate
+        max_fee = 2 * estimate.next_base_fee + max_priority_fee if estimate else current_gas_price()
+        return max_priority_fee, max_fee
+
+    def build(self, route: Sequence[SwapCall], amount_in: int, min_amounts_out: Sequence[int], deadline: int = None) -> Tuple[bytes, PendingTransaction]:
+        """
+        Patches and signs the route's transaction at the oracle's current fees, with a nonce reserved from the nonce manager.
+        Returns (raw transaction, pending transaction record). The nonce must be recorded or released by the caller.
+        """
+        template = self.template(route)
+        if deadline is None:
+            deadline = int(time.time()) + DEADLINE_SECONDS
+        data = template.fill(amount_in, min_amounts_out, deadline)
+        max_priority_fee, max_fee = self._current_fees()
+
+        nonce = self.nonces.next_nonce(self.wallet_address)
+        try:
+            return self._sign(nonce, max_priority_fee, max_fee, template.gas_limit, template.to, data)
+        except Exception:
+            self.nonces.release(self.wallet_address, nonce)
+            raise
+
+    def _send(self, raw_transaction: bytes, transaction: PendingTransaction) -> Submission:
+        try:
+            submission = self.relays.submit([raw_transaction])
+        except RuntimeError as e:
+            raise RuntimeError(f"Submission failed for nonce {transaction.nonce}: {e}")
+        self.nonces.record_sent(self.wallet_address, transaction)
+        return submission
+
+    def fire(self, route: Sequence[SwapCall], amount_in: int, min_amounts_out: Sequence[int], deadline: int = None) -> Submission:
+        """
+        Builds the route's transaction and fans it out through the relay router. Returns the relay submission,
+        whose inclusion future resolves once the transaction is included or given up on.
+        A rejected submission gives its nonce back and resyncs the wallet before raising.
+        """
+        raw_transaction, transaction = self.build(route, amount_in, min_amounts_out, deadline)
+        try:
+            return self._send(raw_transaction, transaction)
+        except Exception:
+            self.nonces.release(self.wallet_address, transaction.nonce)
+            self.nonces.resync(self.wallet_address)
+            raise
+
+    def replace(self, nonce: int, cancel: bool = False) -> str:
+        """
+        Re-sends the pending transaction at nonce with fees bumped past the replacement threshold, or at
+        least the oracle's current fees. With cancel, the replacement is an empty transfer to ourselves,
+        so the nonce is used up without running the route. Returns the replacement's hash.
+        """
+        transaction = self.nonces.pending_transaction(self.wallet_address, nonce)
+        if transaction is None:
+            raise ValueError(f"No pending transaction at nonce {nonce} of {self.wallet_address}")
+        max_priority_fee, max_fee = bumped_fees(transaction, *self._current_fees())
+        if cancel:
+            to, data, gas_limit = bytes.fromhex(self.wallet_address[2:]), b"", TX_BASE_GAS
+        else:
+            to, data, gas_limit = bytes.fromhex(transaction.to[2:]), bytes.fromhex(transaction.data[2:]), transaction.gas_limit
+        return self._send(*self._sign(nonce, max_priority_fee, max_fee, gas_limit, to, data)).transaction_hashes[0]
+
+    def fill_gaps(self) -> List[str]:
+        """
+        Resyncs the wallet and cancels every gap below a pending transaction with an empty transfer, so the
+        transactions queued behind it can be mined. Returns the hashes of the filling transactions.
+        """
+        hashes = []
+        max_priority_fee, max_fee = self._current_fees()
+        to = bytes.fromhex(self.wallet_address[2:])
+        for gap in self.nonces.resync(self.wallet_address):
+            nonce = self.nonces.next_nonce(self.wallet_address)
+            if nonce != gap:
+                # Another send already took this gap
+                self.nonces.release(self.wallet_address, nonce)
+                continue
+            try:
+                hashes.append(self._send(*self._sign(nonce, max_priority_fee, max_fee, TX_BASE_GAS, to, b"")).transaction_hashes[0])
+            except Exception as e:
+                self.nonces.release(self.wallet_address, nonce)
+                print(f"Failed to fill nonce {nonce} of {self.wallet_address}: {e}")
+        return hashes
+
+    def unstick(self, max_age: float = STUCK_TRANSACTION_SECONDS, cancel: bool = False) -> List[str]:
+        """
+        Fills nonce gaps, then speeds up (or cancels) every transaction pending for longer than max_age.
+        Meant to be called periodically. Returns the hashes of the transactions sent.
+        """
+        hashes = self.fill_gaps()
+        for transaction in self.nonces.stuck(self.wallet_address, max_age):
+            try:
+                hashes.append(self.replace(transaction.nonce, cancel))
+            except RuntimeError as e:
+                print(f"Failed to replace nonce {transaction.nonce} of {self.wallet_address}: {e}")
+        return hashes
+
+# Define the wallets we trade from, as (address, private key) pairs
+WALLETS = [
+    (os.environ.get(f"WALLET_ADDRESS_{i}"), os.environ.get(f"WALLET_PRIVATE_KEY_{i}"))
+    for i in (1, 2)
+    if os.environ.get(f"WALLET_ADDRESS_{i}") and os.environ.get(f"WALLET_PRIVATE_KEY_{i}")
+]
+
+_executors: Dict[str, Executor] = {}
+
+def get_executor(wallet_address: str) -> Executor:
+    """
+    Returns the executor of one of the configured WALLETS, creating it on first use.
+    """
+    executor = _executors.get(wallet_address)
+    if executor is None:
+        private_key = dict(WALLETS).get(wallet_address)
+        if private_key is None:
+            raise KeyError(f"No private key configured for {wallet_address}")
+        executor = _executors.setdefault(wallet_address, Executor(wallet_address, private_key))
+    return executor
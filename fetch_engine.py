@@ -0,0 +1,99 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Dict, Hashable, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from http_pool import get_async_client
+
+# Define the maximum number of in-flight requests allowed against a single host
+MAX_REQUESTS_PER_HOST = 8
+
+# Define the deadline for a single request, connect to last byte (in seconds)
+REQUEST_TIMEOUT = 5.0
+
+_loop = None
+_loop_lock = threading.Lock()
+
+class FetchRequest(NamedTuple):
+    """
+    A single GET request to issue, tagged with a caller-defined key.
+    """
+    key: Hashable
+    url: str
+    headers: Optional[Dict[str, str]] = None
+
+class FetchResult(NamedTuple):
+    """
+    The outcome of a FetchRequest: the decoded JSON body on success, an error message otherwise.
+    """
+    key: Hashable
+    status_code: Optional[int]
+    data: Optional[object]
+    error: Optional[str]
+
+async def _fetch_one(semaphore: asyncio.Semaphore, request: FetchRequest, timeout: float) -> FetchResult:
+    """
+    Issues one request over the host's pooled connection, under its concurrency cap and deadline.
+    Never raises: any failure is returned as the result's error, so one bad request cannot fail the others.
+    """
+    async with semaphore:
+        try:
+            client = get_async_client(request.url)
+            response = await asyncio.wait_for(client.get(request.url, headers=request.headers), timeout)
+        except asyncio.TimeoutError:
+            return FetchResult(request.key, None, None, f"Timed out after {timeout}s")
+        except Exception as e:
+            return FetchResult(request.key, None, None, f"Request failed: {e!r}")
+
+    if response.status_code != 200:
+        return FetchResult(request.key, response.status_code, None, f"Status code: {response.status_code}")
+
+    try:
+        data = response.json()
+    except Exception:
+        return FetchResult(request.key, response.status_code, None, "Invalid JSON in response body")
+
+    return FetchResult(request.key, response.status_code, data, None)
+
+async def fetch_all(requests: List[FetchRequest], max_per_host: int = MAX_REQUESTS_PER_HOST, timeout: float = REQUEST_TIMEOUT) -> List[FetchResult]:
+    """
+    Sends all requests concurrently, with at most max_per_host in flight per host.
+    Returns one FetchResult per request, in the same order as the requests.
+    """
+    semaphores = {}
+    for request in requests:
+        host = urlsplit(request.url).netloc
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(max_per_host)
+
+    return await asyncio.gather(*(
+        _fetch_one(semaphores[urlsplit(request.url).netloc], request, timeout)
+        for request in requests
+    ))
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the background event loop, starting it on first use.
+    Keeping one long-lived loop lets the pooled async connections survive between calls.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="fetch-engine", daemon=True).start()
+    return _loop
+
+def run_coroutine(coroutine) -> concurrent.futures.Future:
+    """
+    Schedules a coroutine on the background event loop, where the pooled async clients live.
+    Returns a future that synchronous callers can wait on.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+def run_fetches(requests: List[FetchRequest], max_per_host: int = MAX_REQUESTS_PER_HOST, timeout: float = REQUEST_TIMEOUT) -> List[FetchResult]:
+    """
+    Blocking wrapper around fetch_all for synchronous callers.
+    """
+    return run_coroutine(fetch_all(requests, max_per_host=max_per_host, timeout=timeout)).result()
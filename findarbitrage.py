@@ -1,46 +1,182 @@
+from typing import Dict, List, Optional
+import numpy as np
+from web3 import Web3
+from arbitrage_graph import MAX_HOPS, IncrementalTokenGraph
+from balances import BALANCE_TABLE
+from block_stream import source_pool
+from execution import get_executor
+from gas_oracle import GAS_ORACLE
+from price_matrix import PriceMatrix
+from price_snapshot import current_snapshot
+from prices import POLYGON_BASE_TOKENS, TOKEN_CONTRACTS
+from relays import Submission
+from simulation import SwapCall
+from trade_size import optimal_trade_size, route_from_path
+from wallet_allocator import WalletAllocator
+from web3_provider import get_web3
+
+# Define the base tokens we hold collateral in
+BASE_TOKENS = [{"symbol": symbol, "address": TOKEN_CONTRACTS[symbol]} for symbol in POLYGON_BASE_TOKENS]
+
+# Define the allocator that assigns each trade to one of our wallets, tracking the base token balances backing them
+WALLET_ALLOCATOR = WalletAllocator(BALANCE_TABLE)
+
+# Define the minimum compounded profit of a trade cycle (in percent)
+MIN_PROFIT_PERCENT = 0.5
+
+# Define the highest gas price we are willing to trade at
+MAX_GAS_PRICE = Web3.toWei("100", "gwei")
+
+# Define the amount of the starting token put through each cycle that cannot be sized from pool state (in whole tokens)
+TRADE_AMOUNT = 1.0
+
+# Define the token graph kept up to date across price ticks
+TOKEN_GRAPH = IncrementalTokenGraph(max_hops=MAX_HOPS)
+_token_graph_version = None
+
+def check_network_conditions() -> bool:
+    """
+    Returns True if the current gas price is at or below MAX_GAS_PRICE.
+    Reads the gas oracle's estimate, and only asks the node while the oracle has none.
+    """
+    gas_price = GAS_ORACLE.gas_price(fallback=None)
+    if gas_price is None:
+        gas_price = get_web3().eth.gas_price
+    return gas_price <= MAX_GAS_PRICE
+
+def update_token_graph() -> Dict[str, int]:
+    """
+    Feeds the latest price snapshot into TOKEN_GRAPH if it has changed since the last update.
+    Returns how many edges and nodes the update touched.
+    """
+    global _token_graph_version
+
+    snapshot = current_snapshot()
+    if snapshot.version == _token_graph_version:
+        return TOKEN_GRAPH.last_tick
+
+    _token_graph_version = snapshot.version
+    return TOKEN_GRAPH.update_from_matrix(PriceMatrix.from_snapshot(snapshot))
+
+def size_opportunity(opportunity: Dict[str, any]) -> float:
+    """
+    Returns the profit-maximizing input amount for a cycle routed entirely through on-chain pools,
+    or TRADE_AMOUNT for cycles through aggregators or pools without loaded state.
+    """
+    pools = [source_pool(trade["source"]) for trade in opportunity["trades"]]
+    if None in pools:
+        return TRADE_AMOUNT
+
+    route = route_from_path(opportunity["path"], pools)
+    if route is None:
+        return TRADE_AMOUNT
+    amount_in, _ = optimal_trade_size(*route)
+    return amount_in
+
+def find_arbitrage_opportunities(min_profit_percent: float) -> List[Dict[str, any]]:
+    """
+    Finds trade cycles in the latest price snapshot, ranked by profit.
+    Each opportunity holds the token path, profit_percent, the trades, the input amount and the collateral it needs.
+    """
+    update_token_graph()
+    opportunities = [
+        opportunity for opportunity in TOKEN_GRAPH.opportunities()
+        if opportunity["profit_percent"] >= min_profit_percent
+    ]
+
+    for opportunity in opportunities:
+        start_address = TOKEN_CONTRACTS[opportunity["path"][0]]
+        opportunity["amount_in"] = size_opportunity(opportunity)
+        opportunity["collateral"] = {start_address: opportunity["amount_in"]}
+
+    return [opportunity for opportunity in opportunities if opportunity["amount_in"] > 0]
+
+def find_trade_sequence(opportunity: Dict[str, any]) -> List[Dict[str, any]]:
+    """
+    Returns the sequence of trades for an opportunity, sized to its input amount.
+    """
+    amount = opportunity.get("amount_in", TRADE_AMOUNT)
+    sequence = []
+    for trade in opportunity["trades"]:
+        amount_out = amount * trade["rate"]
+        sequence.append(dict(trade, amount_in=amount, amount_out=amount_out))
+        amount = amount_out
+    return sequence
+
+def calculate_profit(sequence: List[Dict[str, any]]) -> float:
+    """
+    Returns the compounded profit of a trade sequence, in percent.
+    """
+    if not sequence:
+        return 0.0
+    return (sequence[-1]["amount_out"] / sequence[0]["amount_in"] - 1) * 100
+
 def find_arbitrage_sequence() -> List[Dict[str, any]]:
     """
     Find the best sequence of trades for an arbitrage opportunity
-    :return: a list of dictionaries representing the sequence of trades, or an empty list if no opportunity is found
+    :return: a list of dictionaries representing the sequence of trades, or an empty list if no opportunity is found.
+        Each trade names the wallet it was assigned to, whose collateral stays reserved in WALLET_ALLOCATOR until the
+        sequence is passed to fire_arbitrage_sequence or drop_arbitrage_sequence.
     """
     # Check network conditions before proceeding
     if not check_network_conditions():
         print("Network conditions are not favorable. Waiting for improvement...")
         return []
 
-    # Get the balances of our base tokens
-    base_token_balances = {}
-    for base_token in BASE_TOKENS:
-        balance = get_token_balance(base_token['address'], WALLET_ADDRESS)
-        base_token_balances[base_token['address']] = balance
+    # Find all possible arbitrage opportunities, most profitable first
+    opportunities = find_arbitrage_opportunities(MIN_PROFIT_PERCENT)
+    if not opportunities:
+        return []
 
-    # Find all possible arbitrage opportunities
-    opportunities = find_arbitrage_opportunities(MIN_PROFIT_PERCENT, MAX_GAS_PRICE)
+    # Load our balances once if the balance table is not refreshing yet; the allocator keeps them current from then on
+    if BALANCE_TABLE.snapshot is None:
+        BALANCE_TABLE.refresh()
 
-    # Find the most profitable arbitrage opportunity
-    best_opportunity = None
-    best_profit = 0
-    for opportunity in opportunities:
-        # Check if the opportunity is profitable
-        if opportunity['profit_percent'] > best_profit:
-            # Check if we have sufficient collateral for each base token
-            has_sufficient_collateral = True
-            for base_token in BASE_TOKENS:
-                if base_token_balances[base_token['address']] < opportunity['collateral'][base_token['address']]:
-                    has_sufficient_collateral = False
-                    break
-                if not has_sufficient_collateral:
-continue
-# Find the sequence of trades for this opportunity
-        sequence = find_trade_sequence(opportunity)
-
-        # Calculate the total profit for this sequence
-        total_profit = calculate_profit(sequence)
-
-        # Update the best opportunity if this one is more profitable
-        if total_profit > best_profit:
-            best_opportunity = sequence
-            best_profit = total_profit
-
-# Return the best opportunity, or an empty list if none were found
-return best_opportunity if best_opportunity else []
+    # Check every opportunity's collateral against every wallet at once, then take the most profitable one we can fund
+    fundable = WALLET_ALLOCATOR.fundable([opportunity['collateral'] for opportunity in opportunities]).any(axis=1)
+    for index in np.flatnonzero(fundable):
+        opportunity = opportunities[index]
+        wallet = WALLET_ALLOCATOR.assign(opportunity['collateral'])
+        if wallet is None:
+            continue
+
+        # Find the sequence of trades for this opportunity, executed from the assigned wallet
+        sequence = [dict(trade, wallet=wallet) for trade in find_trade_sequence(opportunity)]
+        print(f"Arbitrage sequence found: {' -> '.join(opportunity['path'])}, expected profit of {calculate_profit(sequence):.2f}%")
+        return sequence
+
+    # Return an empty list if no opportunity could be funded
+    return []
+
+def sequence_collateral(sequence: List[Dict[str, any]]) -> Dict[str, float]:
+    """
+    Returns the collateral {token address: amount} a sequence from find_arbitrage_sequence reserved.
+    """
+    return {TOKEN_CONTRACTS[sequence[0]["from_token"]]: sequence[0]["amount_in"]}
+
+def drop_arbitrage_sequence(sequence: List[Dict[str, any]]):
+    """
+    Frees the collateral reserved for a sequence that will not be fired.
+    """
+    if sequence:
+        WALLET_ALLOCATOR.release(sequence[0]["wallet"], sequence_collateral(sequence))
+
+def fire_arbitrage_sequence(sequence: List[Dict[str, any]], route: List[SwapCall], amount_in: int, min_amounts_out: List[int]) -> Optional[Submission]:
+    """
+    Fires a sequence from find_arbitrage_sequence as route, from the wallet it was assigned to.
+    Its expected profit is recorded as a fill right away and its collateral stays reserved until the
+    transaction is included or dropped. A failed submission frees the collateral and returns None.
+    """
+    wallet = sequence[0]["wallet"]
+    collateral = sequence_collateral(sequence)
+    try:
+        submission = get_executor(wallet).fire(route, amount_in, min_amounts_out)
+    except Exception as e:
+        WALLET_ALLOCATOR.release(wallet, collateral)
+        print(f"Failed to fire arbitrage sequence from {wallet}: {e}")
+        return None
+
+    start_address = next(iter(collateral))
+    deltas = {start_address: sequence[-1]["amount_out"] - sequence[0]["amount_in"]}
+    WALLET_ALLOCATOR.track(wallet, collateral, submission.transaction_hashes[0], deltas, submission.inclusion)
+    return submission
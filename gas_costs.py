@@ -0,0 +1,167 @@
+import json
+import os
+import statistics
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from gas_oracle import current_gas_price
+from simulation import SimulationResult
+
+# Define where the measured gas table is stored
+GAS_TABLE_PATH = os.environ.get("GAS_TABLE_PATH", "gas_table.json")
+
+# Define the fixed gas of any transaction, paid once per route
+TX_BASE_GAS = 21000
+
+# Define the number of recent measurements kept per entry; the entry's gas is their median
+GAS_SAMPLE_WINDOW = 50
+
+# Define the gas used per hop before any measurement, by venue and swap type (excluding TX_BASE_GAS)
+DEFAULT_GAS_TABLE = {
+    "paraswap": {"swap": 200000},
+    "oneinch": {"swap": 180000},
+    "onchain": {"swap": 100000, "v2": 90000, "v3": 130000},
+    "aave": {"flash_loan": 120000}
+}
+
+# Define the venue and swap type of the Aave flash loan that funds a route
+FLASH_LOAN = ("aave", "flash_loan")
+
+# Define the contract addresses for the decentralized exchanges
+PARASWAP_EXCHANGE_ADDRESS = "0x90249ed4d69D70E709fFCd8beE2c5bD8d4D0c0Be"
+ONEINCH_EXCHANGE_ADDRESS = "0x11111112542d85b3ef69ae05771c2dccff4faa26"
+
+# Define the gas table venue of each exchange contract, keyed by lowercase address (any other contract is an onchain pool)
+EXCHANGE_VENUES = {
+    PARASWAP_EXCHANGE_ADDRESS.lower(): "paraswap",
+    ONEINCH_EXCHANGE_ADDRESS.lower(): "oneinch"
+}
+
+class GasTable:
+    """
+    Gas used per hop, keyed by venue and swap type. Measurements replace the defaults as they come in,
+    and lookups read a precomputed value so a route's gas is a plain table sum.
+    """
+
+    def __init__(self, defaults: Dict[str, Dict[str, int]] = DEFAULT_GAS_TABLE, window: int = GAS_SAMPLE_WINDOW):
+        self.window = window
+        self.samples: Dict[Tuple[str, str], List[int]] = {}
+        self.gas: Dict[Tuple[str, str], int] = {
+            (venue, swap_type): gas
+            for venue, swap_types in defaults.items()
+            for swap_type, gas in swap_types.items()
+        }
+        self._lock = threading.Lock()
+
+    def record_measurement(self, venue: str, swap_type: str, gas_used: int):
+        """
+        Adds a measured gas usage for one hop, excluding TX_BASE_GAS.
+        """
+        key = (venue, swap_type)
+        with self._lock:
+            samples = self.samples.setdefault(key, [])
+            samples.append(int(gas_used))
+            del samples[:-self.window]
+            self.gas[key] = int(statistics.median(samples))
+
+    def hop_gas(self, venue: str, swap_type: str = "swap") -> int:
+        """
+        Returns the gas of one hop, falling back to the venue's generic swap when the swap type is unknown.
+        """
+        gas = self.gas.get((venue, swap_type))
+        if gas is None:
+            gas = self.gas.get((venue, "swap"))
+        if gas is None:
+            raise KeyError(f"No gas entry for {venue} {swap_type}")
+        return gas
+
+    def route_gas(self, hops: Iterable[Tuple[str, str]], flash_loan: bool = False) -> int:
+        """
+        Returns the total gas of a route given as (venue, swap_type) hops, including TX_BASE_GAS
+        and, with flash_loan, the flash loan that funds it.
+        """
+        gas = TX_BASE_GAS + sum(self.hop_gas(venue, swap_type) for venue, swap_type in hops)
+        if flash_loan:
+            gas += self.hop_gas(*FLASH_LOAN)
+        return gas
+
+    def save(self, path: str = GAS_TABLE_PATH):
+        """
+        Writes the measurements to a JSON file as {venue: {swap_type: [gas, ...]}}.
+        """
+        table = {}
+        with self._lock:
+            for (venue, swap_type), samples in self.samples.items():
+                table.setdefault(venue, {})[swap_type] = list(samples)
+        with open(path, "w") as f:
+            json.dump(table, f, indent=2)
+
+    def load(self, path: str = GAS_TABLE_PATH) -> "GasTable":
+        """
+        Replays the measurements stored by save(). A missing file leaves the defaults in place.
+        """
+        if not os.path.exists(path):
+            return self
+        with open(path) as f:
+            table = json.load(f)
+        for venue, swap_types in table.items():
+            for swap_type, samples in swap_types.items():
+                for gas_used in samples:
+                    self.record_measurement(venue, swap_type, gas_used)
+        return self
+
+# Define the shared gas table, seeded with the measurements stored on disk
+GAS_TABLE = GasTable().load()
+
+def record_simulations(simulations: Sequence[Tuple[Sequence[str], SimulationResult]], table: GasTable = GAS_TABLE, path: str = GAS_TABLE_PATH) -> int:
+    """
+    Records the gas of every hop of each successful (exchanges called, simulation result) under the hop's
+    venue, and what the transaction used beyond TX_BASE_GAS and its hops as the flash loan, then saves the table.
+    Returns the number of simulations recorded.
+    """
+    recorded = 0
+    for exchanges, result in simulations:
+        if not result.success or not result.hop_gas or len(result.hop_gas) != len(exchanges):
+            continue
+        for (venue, swap_type), gas_used in zip(swap_hops(exchanges), result.hop_gas):
+            table.record_measurement(venue, swap_type, gas_used)
+        overhead = result.gas_used - TX_BASE_GAS - sum(result.hop_gas)
+        if overhead > 0:
+            table.record_measurement(*FLASH_LOAN, overhead)
+        recorded += 1
+
+    if recorded:
+        table.save(path)
+    return recorded
+
+def trade_hops(trades: Iterable[Dict[str, object]]) -> List[Tuple[str, str]]:
+    """
+    Maps trades from a TokenGraph to (venue, swap_type) hops. Pool sources ("onchain:<address>") are onchain hops.
+    """
+    return [(trade["source"].split(":")[0], trade.get("swap_type", "swap")) for trade in trades]
+
+def swap_hops(exchanges: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Maps the exchange contracts a route calls, in order, to (venue, swap_type) hops.
+    """
+    return [(EXCHANGE_VENUES.get(exchange.lower(), "onchain"), "swap") for exchange in exchanges]
+
+def route_gas_cost(hops: Iterable[Tuple[str, str]], native_price: float = 1.0, gas_price: int = None, flash_loan: bool = False, table: GasTable = GAS_TABLE) -> float:
+    """
+    Returns the cost of executing a route, in the unit native_price is quoted in (native tokens by default).
+    Uses the gas oracle's current price unless gas_price (in wei) is given.
+    """
+    if gas_price is None:
+        gas_price = current_gas_price()
+    return table.route_gas(hops, flash_loan) * gas_price / 10 ** 18 * native_price
+
+def route_gas_costs(routes: Sequence[Iterable[Tuple[str, str]]], native_price: float = 1.0, gas_price: int = None, flash_loan: bool = False, table: GasTable = GAS_TABLE) -> np.ndarray:
+    """
+    Returns route_gas_cost for many routes at once, as an array aligned with routes.
+    """
+    if gas_price is None:
+        gas_price = current_gas_price()
+    gas = np.array([table.route_gas(hops, flash_loan) for hops in routes], dtype=np.float64)
+    return gas * gas_price / 10 ** 18 * native_price
@@ -1,16 +1,22 @@
-import requests
+from typing import Dict, List
+from fetch_engine import FetchRequest, run_fetches
+from http_pool import get
+from prices import POLYGON_BASE_TOKENS, TOKEN_CONTRACTS
+from request_scheduler import SCHEDULER
+
+# Define the API endpoints for the gas price sources
+PARASWAP_GAS_ENDPOINT = "https://apiv4.paraswap.io/v2/networks/1/gas-prices"
+ONEINCH_GAS_ENDPOINT = "https://api.1inch.io/v5.0/1/gasPrice"
 
 def get_paraswap_gas_fee(asset: str) -> float:
     """
     Fetches the gas fee for a given asset from the Paraswap API.
     """
-    url = f"https://apiv4.paraswap.io/v2/networks/1/gas-prices/{asset}"
-    response = requests.get(url)
+    url = f"{PARASWAP_GAS_ENDPOINT}/{asset}"
+    response = get(url)
 
     if response.status_code == 200:
-        data = response.json()
-        gas_fee = data["gasPrices"]["fast"]
-        return gas_fee
+        return parse_paraswap_gas_fee(response.json())
     else:
         print(f"Error fetching Paraswap gas fee data for {asset}. Status code: {response.status_code}")
 
@@ -18,15 +24,58 @@ def get_oneinch_gas_fee(asset: str) -> float:
     """
     Fetches the gas fee for a given asset from the 1inch API.
     """
-    url = f"https://api.1inch.io/v5.0/1/gasPrice?tokenAddress={asset}"
-    response = requests.get(url)
+    url = f"{ONEINCH_GAS_ENDPOINT}?tokenAddress={asset}"
+    response = get(url)
 
     if response.status_code == 200:
-        data = response.json()
-        gas_fee = data["fast"] / 10 ** 9
-        return gas_fee
+        return parse_oneinch_gas_fee(response.json())
     else:
         print(f"Error fetching 1inch gas fee data for {asset}. Status code: {response.status_code}")
 
-paraswap_gas_fees = {}
-oneinch_gas_fees = {}
\ No newline at end of file
+def parse_paraswap_gas_fee(data: dict) -> float:
+    """
+    Reads the fast gas price from a Paraswap gas price response.
+    """
+    return data["gasPrices"]["fast"]
+
+def parse_oneinch_gas_fee(data: dict) -> float:
+    """
+    Reads the fast gas price from a 1inch gas price response, in gwei.
+    """
+    return data["fast"] / 10 ** 9
+
+# Define the latest gas fees per base token, filled by fetch_gas_fees
+paraswap_gas_fees: Dict[str, float] = {}
+oneinch_gas_fees: Dict[str, float] = {}
+
+def fetch_gas_fees(assets: List[str] = POLYGON_BASE_TOKENS) -> Dict[str, Dict[str, float]]:
+    """
+    Fetches the Paraswap and 1inch gas fees for every asset concurrently, within each API's quota, and
+    stores them in paraswap_gas_fees and oneinch_gas_fees.
+    Assets whose request fails or is deferred keep their previous value.
+    Returns both dictionaries keyed by source.
+    """
+    requests = []
+    for asset in assets:
+        address = TOKEN_CONTRACTS.get(asset, asset)
+        requests.append(FetchRequest(("paraswap", asset), f"{PARASWAP_GAS_ENDPOINT}/{address}"))
+        requests.append(FetchRequest(("oneinch", asset), f"{ONEINCH_GAS_ENDPOINT}?tokenAddress={address}"))
+
+    # Gas fee requests share the price requests' quota on the same APIs
+    requests = SCHEDULER.schedule(requests)
+    results = run_fetches(requests)
+    SCHEDULER.record(results)
+
+    parsers = {"paraswap": (parse_paraswap_gas_fee, paraswap_gas_fees, "Paraswap"), "oneinch": (parse_oneinch_gas_fee, oneinch_gas_fees, "1inch")}
+    for result in results:
+        source, asset = result.key
+        parse, gas_fees, name = parsers[source]
+        if result.error:
+            print(f"Error fetching {name} gas fee data for {asset}. {result.error}")
+            continue
+        try:
+            gas_fees[asset] = parse(result.data)
+        except (KeyError, TypeError):
+            print(f"Error parsing {name} gas fee data for {asset}")
+
+    return {"paraswap": paraswap_gas_fees, "oneinch": oneinch_gas_fees}
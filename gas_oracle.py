@@ -0,0 +1,188 @@
+import os
+import statistics
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Sequence
+
+from web3 import Web3
+
+from gas_fees import fetch_gas_fees
+from web3_provider import PROVIDER_ENDPOINT, get_web3
+
+# Define how often the oracle polls the node for a new block (in seconds); new block headers wake it earlier
+GAS_REFRESH_INTERVAL = float(os.environ.get("GAS_REFRESH_INTERVAL", 2.0))
+
+# Define how often the Paraswap and 1inch gas APIs are refreshed (in seconds), as they are rate limited
+GAS_API_REFRESH_INTERVAL = float(os.environ.get("GAS_API_REFRESH_INTERVAL", 30.0))
+
+# Define the number of recent blocks summarized by eth_feeHistory
+FEE_HISTORY_BLOCKS = 20
+
+# Define the priority fee percentiles requested from eth_feeHistory
+PRIORITY_FEE_PERCENTILES = (10, 50, 90)
+
+# Define the gas price used until the oracle has its first estimate
+DEFAULT_GAS_PRICE = Web3.toWei("50", "gwei")
+
+# Define the EIP-1559 base fee update parameters
+BASE_FEE_MAX_CHANGE_DENOMINATOR = 8
+ELASTICITY_MULTIPLIER = 2
+
+class GasEstimate(NamedTuple):
+    """
+    Fee data for the latest block, all in wei. priority_fees maps each percentile to the median
+    of that percentile's reward over the recent non-empty blocks.
+    """
+    block_number: int
+    base_fee: int
+    next_base_fee: int
+    priority_fees: Dict[int, int]
+    updated_at: float
+
+def predict_base_fee(base_fee: int, gas_used_ratio: float) -> int:
+    """
+    Applies the EIP-1559 update rule: the base fee moves by up to 1/8 depending on how far the
+    block's gas used was from the target (half the gas limit).
+    """
+    return max(0, base_fee + int(base_fee * (gas_used_ratio * ELASTICITY_MULTIPLIER - 1) / BASE_FEE_MAX_CHANGE_DENOMINATOR))
+
+def parse_fee_history(history: dict, percentiles: Sequence[int] = PRIORITY_FEE_PERCENTILES) -> GasEstimate:
+    """
+    Builds a GasEstimate from an eth_feeHistory result. The node reports the base fee of the block
+    after the range as the last baseFeePerGas entry; if it is missing it is predicted from the last block.
+    """
+    gas_used_ratios = history["gasUsedRatio"]
+    base_fees = [int(base_fee, 16) for base_fee in history["baseFeePerGas"]]
+    block_count = len(gas_used_ratios)
+
+    base_fee = base_fees[block_count - 1]
+    if len(base_fees) > block_count:
+        next_base_fee = base_fees[block_count]
+    else:
+        next_base_fee = predict_base_fee(base_fee, gas_used_ratios[-1])
+
+    # Empty blocks report zero rewards, which would drag every percentile down
+    rewards = [
+        reward for reward, gas_used_ratio in zip(history.get("reward") or [], gas_used_ratios)
+        if gas_used_ratio > 0
+    ]
+    priority_fees = {
+        percentile: int(statistics.median(int(reward[i], 16) for reward in rewards)) if rewards else 0
+        for i, percentile in enumerate(percentiles)
+    }
+
+    return GasEstimate(
+        block_number=int(history["oldestBlock"], 16) + block_count - 1,
+        base_fee=base_fee,
+        next_base_fee=next_base_fee,
+        priority_fees=priority_fees,
+        updated_at=time.time()
+    )
+
+class GasOracle:
+    """
+    Keeps a fee estimate for the latest block, refreshed on a background thread from eth_feeHistory
+    and from the Paraswap and 1inch gas APIs. Readers only take the latest estimate, so they never
+    wait on the network.
+    """
+
+    def __init__(self, endpoint: str = PROVIDER_ENDPOINT, interval: float = GAS_REFRESH_INTERVAL, api_interval: float = GAS_API_REFRESH_INTERVAL, percentiles: Sequence[int] = PRIORITY_FEE_PERCENTILES):
+        self.endpoint = endpoint
+        self.interval = interval
+        self.api_interval = api_interval
+        self.percentiles = tuple(percentiles)
+        self.estimate: Optional[GasEstimate] = None
+        self.api_updated_at = 0.0
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def refresh(self) -> Optional[GasEstimate]:
+        """
+        Fetches fee history if a new block has been produced since the last estimate, and the API
+        gas fees if they are older than api_interval. Blocks; meant for the background thread.
+        """
+        web3 = get_web3(self.endpoint)
+        block_number = web3.eth.block_number
+        if self.estimate is None or block_number != self.estimate.block_number:
+            response = web3.provider.make_request("eth_feeHistory", [hex(FEE_HISTORY_BLOCKS), hex(block_number), list(self.percentiles)])
+            if "error" in response:
+                print(f"Error fetching fee history at block {block_number}: {response['error']}")
+            else:
+                self.estimate = parse_fee_history(response["result"], self.percentiles)
+
+        if time.monotonic() - self.api_updated_at >= self.api_interval:
+            fetch_gas_fees()
+            self.api_updated_at = time.monotonic()
+
+        return self.estimate
+
+    def on_new_block(self, block_number: int):
+        """
+        Wakes the refresher for a new block header, e.g. from a BlockStream.
+        """
+        if self.estimate is None or block_number > self.estimate.block_number:
+            self._wake.set()
+
+    def run(self):
+        """
+        Refreshes until stop() is called.
+        """
+        while not self._stopping:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing gas estimate: {e!r}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self) -> "GasOracle":
+        """
+        Runs the refresher on a background thread.
+        """
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name="gas-oracle", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the refresher after its current refresh.
+        """
+        self._stopping = True
+        self._wake.set()
+
+    def priority_fee(self, percentile: int = 50) -> Optional[int]:
+        """
+        Returns the priority fee at the tracked percentile closest to the one asked for, or None without an estimate.
+        """
+        estimate = self.estimate
+        if estimate is None or not estimate.priority_fees:
+            return None
+        closest = min(estimate.priority_fees, key=lambda tracked: abs(tracked - percentile))
+        return estimate.priority_fees[closest]
+
+    def gas_price(self, percentile: int = 50, fallback: Optional[int] = DEFAULT_GAS_PRICE) -> Optional[int]:
+        """
+        Returns the predicted next-block base fee plus the priority fee at percentile, in wei,
+        or fallback until the first estimate arrives.
+        """
+        estimate = self.estimate
+        if estimate is None:
+            return fallback
+        return estimate.next_base_fee + (self.priority_fee(percentile) or 0)
+
+# Define the shared gas oracle
+GAS_ORACLE = GasOracle()
+
+def current_gas_price(percentile: int = 50) -> int:
+    """
+    Returns GAS_ORACLE's gas price, falling back to DEFAULT_GAS_PRICE before its first refresh.
+    """
+    return GAS_ORACLE.gas_price(percentile)
+
+def start_gas_oracle() -> GasOracle:
+    """
+    Starts refreshing GAS_ORACLE in the background.
+    """
+    return GAS_ORACLE.start()
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Define the default connection pool limits for each host
+POOL_MAX_CONNECTIONS = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", 16))
+POOL_MAX_KEEPALIVE = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", 16))
+
+# Define how long an idle keep-alive connection is held open (in seconds)
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", 60.0))
+
+# Define the default timeout for pooled requests (in seconds)
+POOL_TIMEOUT = float(os.environ.get("HTTP_POOL_TIMEOUT", 10.0))
+
+# Define whether to negotiate HTTP/2 with hosts that offer it
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "1") != "0" and HTTP2_AVAILABLE
+
+# Define per-host overrides of (max_connections, max_keepalive)
+HOST_POOL_LIMITS: Dict[str, Tuple[int, int]] = {}
+
+_lock = threading.Lock()
+_clients: Dict[str, httpx.Client] = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+def configure_pool(host: str, max_connections: int, max_keepalive: Optional[int] = None):
+    """
+    Overrides the pool limits for a host. Takes effect for clients created afterwards.
+    """
+    HOST_POOL_LIMITS[host] = (max_connections, max_keepalive if max_keepalive is not None else max_connections)
+
+def _limits(host: str) -> httpx.Limits:
+    max_connections, max_keepalive = HOST_POOL_LIMITS.get(host, (POOL_MAX_CONNECTIONS, POOL_MAX_KEEPALIVE))
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+    )
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+def get_client(url: str) -> httpx.Client:
+    """
+    Returns the shared keep-alive client for the host of the given URL.
+    """
+    host = _host(url)
+    client = _clients.get(host)
+    if client is None:
+        with _lock:
+            client = _clients.get(host)
+            if client is None:
+                client = httpx.Client(http2=HTTP2_ENABLED, limits=_limits(host), timeout=POOL_TIMEOUT)
+                _clients[host] = client
+    return client
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """
+    Returns the shared keep-alive async client for the host of the given URL.
+    Async clients are bound to the running event loop, so one pool is kept per loop.
+    """
+    loop = asyncio.get_running_loop()
+    host = _host(url)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(host)
+        if client is None:
+            client = httpx.AsyncClient(http2=HTTP2_ENABLED, limits=_limits(host), timeout=POOL_TIMEOUT)
+            clients[host] = client
+    return client
+
+def get(url: str, headers: Optional[Dict[str, str]] = None, timeout: Optional[float] = None) -> httpx.Response:
+    """
+    Sends a GET request over the pooled connection for the URL's host.
+    """
+    return get_client(url).get(url, headers=headers, timeout=timeout if timeout is not None else POOL_TIMEOUT)
+
+def close_all():
+    """
+    Closes every pooled synchronous client.
+    """
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
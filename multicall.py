@@ -0,0 +1,96 @@
+import os
+from typing import Any, List, Optional, Sequence, Tuple
+
+from eth_abi.exceptions import DecodingError
+from web3 import Web3
+
+from web3_provider import PROVIDER_ENDPOINT, get_contract, get_web3
+
+# Define the Multicall3 contract address (deployed at the same address on Polygon, mainnet and most forks)
+MULTICALL3_ADDRESS = os.environ.get("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+
+# Define the largest number of calls packed into one aggregate3 request
+MULTICALL_BATCH_SIZE = int(os.environ.get("MULTICALL_BATCH_SIZE", 500))
+
+# Define the contract ABI for Multicall3.aggregate3
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+def _abi_type(output: dict) -> str:
+    if output["type"].startswith("tuple"):
+        return "(" + ",".join(_abi_type(component) for component in output["components"]) + ")" + output["type"][len("tuple"):]
+    return output["type"]
+
+def output_types(contract, fn_name: str) -> List[str]:
+    """
+    Returns the ABI types of a contract function's outputs, for decoding raw return data.
+    """
+    return [_abi_type(output) for output in contract.get_function_by_name(fn_name).abi["outputs"]]
+
+def encode_call(contract, fn_name: str, args: Sequence[Any]) -> bytes:
+    """
+    Returns the calldata for a contract function call.
+    """
+    return Web3.toBytes(hexstr=contract.encodeABI(fn_name=fn_name, args=list(args)))
+
+def aggregate(calls: Sequence[Tuple[str, bytes]], endpoint: str = PROVIDER_ENDPOINT, block_identifier="latest") -> List[Tuple[bool, bytes]]:
+    """
+    Executes (target, calldata) calls through Multicall3.aggregate3, allowing individual calls to fail.
+    Returns one (success, return data) pair per call, issuing one RPC per MULTICALL_BATCH_SIZE calls.
+    """
+    multicall_contract = get_contract(MULTICALL3_ADDRESS, MULTICALL3_ABI, endpoint)
+    results = []
+    for offset in range(0, len(calls), MULTICALL_BATCH_SIZE):
+        batch = [(Web3.toChecksumAddress(target), True, data) for target, data in calls[offset:offset + MULTICALL_BATCH_SIZE]]
+        results.extend(
+            (success, bytes(data))
+            for success, data in multicall_contract.functions.aggregate3(batch).call(block_identifier=block_identifier)
+        )
+    return results
+
+def multicall(requests: Sequence[Tuple[object, str, Sequence[Any]]], endpoint: str = PROVIDER_ENDPOINT, block_identifier="latest") -> List[Optional[tuple]]:
+    """
+    Executes (contract, function name, args) view calls in a single aggregate3 call and decodes each result.
+    Returns the decoded outputs per request, or None where the call reverted or returned nothing.
+    """
+    calls = [(contract.address, encode_call(contract, fn_name, args)) for contract, fn_name, args in requests]
+    codec = get_web3(endpoint).codec
+
+    decoded = []
+    for (contract, fn_name, _), (success, data) in zip(requests, aggregate(calls, endpoint, block_identifier)):
+        if not success or not data:
+            decoded.append(None)
+            continue
+        try:
+            decoded.append(tuple(codec.decode_abi(output_types(contract, fn_name), data)))
+        except DecodingError:
+            decoded.append(None)
+    return decoded
@@ -0,0 +1,252 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from web3 import Web3
+
+from web3_provider import PROVIDER_ENDPOINT, get_web3
+
+# Define the file pending transactions are persisted to, so they survive restarts
+NONCE_STATE_PATH = os.environ.get("NONCE_STATE_PATH", "nonce_state.json")
+
+# Define the minimum fee increase for a replacement transaction (nodes reject replacements below +10%)
+REPLACEMENT_FEE_BUMP = 1.125
+
+# Define how long a transaction can stay pending before it is considered stuck (in seconds)
+STUCK_TRANSACTION_SECONDS = float(os.environ.get("STUCK_TRANSACTION_SECONDS", 30))
+
+class PendingTransaction(NamedTuple):
+    """
+    A transaction we sent that has not been seen mined yet, with the fields needed to replace it.
+    Addresses, calldata and hashes are hex strings so the record can be stored as JSON.
+    """
+    nonce: int
+    transaction_hash: str
+    to: str
+    data: str
+    gas_limit: int
+    max_priority_fee: int
+    max_fee: int
+    sent_at: float
+
+def bumped_fees(transaction: PendingTransaction, max_priority_fee: int = 0, max_fee: int = 0, bump: float = REPLACEMENT_FEE_BUMP) -> Tuple[int, int]:
+    """
+    Returns (max priority fee, max fee) for replacing a pending transaction: the requested fees,
+    raised to at least bump times the fees of the transaction being replaced.
+    """
+    max_priority_fee = max(max_priority_fee, math.ceil(transaction.max_priority_fee * bump))
+    max_fee = max(max_fee, math.ceil(transaction.max_fee * bump), max_priority_fee)
+    return max_priority_fee, max_fee
+
+class NonceManager:
+    """
+    Hands out nonces from memory so sending never waits on eth_getTransactionCount.
+    Each wallet has its own lock, so wallets never wait on each other, and a nonce handed out is
+    reserved until it is either recorded as sent or released, so concurrent senders never share one.
+    The chain is only asked on the first use of a wallet and on resync(), which drops mined
+    transactions and rewinds to the lowest nonce left unused by a failed or dropped transaction.
+    Changes are persisted by a background flusher, so sending never waits on the state file.
+    """
+
+    def __init__(self, path: str = NONCE_STATE_PATH, endpoint: str = PROVIDER_ENDPOINT):
+        self.path = path
+        self.endpoint = endpoint
+        self._wallets: Dict[str, dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def _wallet(self, wallet: str) -> Tuple[dict, threading.Lock]:
+        wallet = Web3.toChecksumAddress(wallet)
+        with self._locks_lock:
+            if wallet not in self._wallets:
+                self._wallets[wallet] = {"next_nonce": None, "synced": False, "reserved": set(), "pending": {}}
+                self._locks[wallet] = threading.Lock()
+            return self._wallets[wallet], self._locks[wallet]
+
+    def next_nonce(self, wallet: str) -> int:
+        """
+        Reserves and returns the lowest nonce not already pending or reserved.
+        The wallet is resynced with the chain on first use.
+        """
+        state, lock = self._wallet(wallet)
+        if not state["synced"]:
+            self.resync(wallet)
+        with lock:
+            nonce = state["next_nonce"]
+            while nonce in state["pending"] or nonce in state["reserved"]:
+                nonce += 1
+            state["reserved"].add(nonce)
+            state["next_nonce"] = nonce + 1
+            return nonce
+
+    def release(self, wallet: str, nonce: int):
+        """
+        Gives back a reserved nonce whose transaction was never sent, so the next send fills it.
+        """
+        state, lock = self._wallet(wallet)
+        with lock:
+            state["reserved"].discard(nonce)
+            if nonce not in state["pending"] and state["next_nonce"] is not None:
+                state["next_nonce"] = min(state["next_nonce"], nonce)
+
+    def record_sent(self, wallet: str, transaction: PendingTransaction):
+        """
+        Records a transaction accepted by the node, replacing any earlier one at the same nonce.
+        The state is persisted in the background.
+        """
+        state, lock = self._wallet(wallet)
+        with lock:
+            state["reserved"].discard(transaction.nonce)
+            state["pending"][transaction.nonce] = transaction
+        self._changed()
+
+    def pending(self, wallet: str) -> List[PendingTransaction]:
+        """
+        Returns the wallet's pending transactions, lowest nonce first.
+        """
+        state, lock = self._wallet(wallet)
+        with lock:
+            return [state["pending"][nonce] for nonce in sorted(state["pending"])]
+
+    def in_flight(self, wallet: str) -> int:
+        """
+        Returns how many of the wallet's nonces are pending or reserved, i.e. its send queue depth.
+        """
+        state, lock = self._wallet(wallet)
+        with lock:
+            return len(state["pending"]) + len(state["reserved"])
+
+    def pending_transaction(self, wallet: str, nonce: int) -> Optional[PendingTransaction]:
+        """
+        Returns the pending transaction at nonce, if any.
+        """
+        state, lock = self._wallet(wallet)
+        with lock:
+            return state["pending"].get(nonce)
+
+    def stuck(self, wallet: str, max_age: float = STUCK_TRANSACTION_SECONDS) -> List[PendingTransaction]:
+        """
+        Returns the pending transactions sent more than max_age seconds ago.
+        """
+        now = time.time()
+        return [transaction for transaction in self.pending(wallet) if now - transaction.sent_at > max_age]
+
+    def resync(self, wallet: str) -> List[int]:
+        """
+        Reconciles the wallet with the chain: forgets transactions mined (or replaced) below the confirmed
+        nonce, forgets transactions the node no longer knows, and moves the next nonce back to the first gap.
+        Returns the gaps, i.e. free nonces below a pending transaction, which hold back everything above them.
+        """
+        state, lock = self._wallet(wallet)
+        web3 = get_web3(self.endpoint)
+        address = Web3.toChecksumAddress(wallet)
+        confirmed = web3.eth.get_transaction_count(address, "latest")
+        pending_count = web3.eth.get_transaction_count(address, "pending")
+
+        with lock:
+            pending = state["pending"]
+            for nonce in [nonce for nonce in pending if nonce < confirmed]:
+                del pending[nonce]
+
+            # Nonces below the pending count are taken by transactions the node holds; above it, ours may have been dropped
+            for nonce in [nonce for nonce in pending if nonce >= pending_count]:
+                if web3.provider.make_request("eth_getTransactionByHash", [pending[nonce].transaction_hash]).get("result") is None:
+                    print(f"Transaction {pending[nonce].transaction_hash} at nonce {nonce} of {address} was dropped")
+                    del pending[nonce]
+
+            highest = max(list(pending) + list(state["reserved"]) + [pending_count - 1])
+            gaps = [nonce for nonce in range(pending_count, highest) if nonce not in pending and nonce not in state["reserved"]]
+            state["next_nonce"] = gaps[0] if gaps else max(highest + 1, confirmed)
+            state["synced"] = True
+
+        self._changed()
+        return gaps
+
+    def save(self):
+        """
+        Writes every wallet's next nonce and pending transactions to the state file, copying one wallet at a time
+        under its own lock. The file is replaced atomically, so a crash mid-write keeps the previous state.
+        """
+        with self._save_lock:
+            with self._locks_lock:
+                wallets = list(self._wallets.items())
+            state = {}
+            for wallet, wallet_state in wallets:
+                with self._locks[wallet]:
+                    state[wallet] = {
+                        "next_nonce": wallet_state["next_nonce"],
+                        "pending": [transaction._asdict() for transaction in wallet_state["pending"].values()]
+                    }
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w") as f:
+                json.dump(state, f, indent=2)
+            os.replace(temporary_path, self.path)
+
+    def _changed(self):
+        # Wake the flusher, starting it on the first change
+        if self._thread is None:
+            with self._locks_lock:
+                if self._thread is None:
+                    self.start()
+        self._dirty.set()
+
+    def run(self):
+        """
+        Saves the state whenever it changed, until stop() is called.
+        """
+        while not self._stopping:
+            self._dirty.wait()
+            self._dirty.clear()
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Error saving nonce state: {e!r}")
+
+    def start(self) -> "NonceManager":
+        """
+        Runs the flusher on a background thread, and flushes once more at exit.
+        """
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run, name="nonce-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """
+        Stops the flusher and writes the latest state.
+        """
+        self._stopping = True
+        self._dirty.set()
+        atexit.unregister(self.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save()
+
+    def load(self) -> "NonceManager":
+        """
+        Restores the state written by save(). Restored wallets are still resynced on first use.
+        A missing file starts from the chain.
+        """
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            stored = json.load(f)
+        for wallet, wallet_state in stored.items():
+            state, lock = self._wallet(wallet)
+            with lock:
+                state["next_nonce"] = wallet_state["next_nonce"]
+                state["pending"] = {transaction["nonce"]: PendingTransaction(**transaction) for transaction in wallet_state["pending"]}
+        return self
+
+# Define the nonce manager shared by every executor, restored from the state file
+NONCE_MANAGER = NonceManager().load()
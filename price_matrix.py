@@ -0,0 +1,109 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from price_snapshot import PriceSnapshot
+from prices import PRICE_SOURCES, TOKEN_CONTRACTS, token_symbol
+
+class PriceMatrix:
+    """
+    Dense float64 prices with shape (sources, tokens, tokens), with missing quotes stored as NaN.
+    values[s, i, j] is the price of tokens[i] in tokens[j] as reported by sources[s].
+    """
+
+    def __init__(self, sources: Iterable[str] = None, tokens: Iterable[str] = None, values: np.ndarray = None, version: int = 0):
+        self.sources = tuple(sources if sources is not None else PRICE_SOURCES)
+        self.tokens = tuple(tokens if tokens is not None else TOKEN_CONTRACTS)
+        self.source_index = {source: i for i, source in enumerate(self.sources)}
+        self.token_index = {token: i for i, token in enumerate(self.tokens)}
+        self.version = version
+
+        shape = (len(self.sources), len(self.tokens), len(self.tokens))
+        if values is None:
+            values = np.full(shape, np.nan, dtype=np.float64)
+        elif values.shape != shape:
+            raise ValueError(f"Expected price array of shape {shape}, got {values.shape}")
+        self.values = values
+
+    @classmethod
+    def from_snapshot(cls, snapshot: PriceSnapshot, sources: Iterable[str] = None, tokens: Iterable[str] = None) -> "PriceMatrix":
+        """
+        Builds a matrix from a price snapshot. Entries for unknown sources or tokens are skipped.
+        """
+        if sources is None:
+            sources = list(dict.fromkeys(list(PRICE_SOURCES) + list(snapshot.sources())))
+        matrix = cls(sources, tokens, version=snapshot.version)
+
+        for (source, base_asset, quote_asset), price in snapshot.prices.items():
+            s = matrix.source_index.get(source)
+            i = matrix.token_index.get(base_asset)
+            j = matrix.token_index.get(quote_asset)
+            if s is not None and i is not None and j is not None:
+                matrix.values[s, i, j] = price
+
+        return matrix
+
+    def get(self, source: str, base_asset: str, quote_asset: str) -> float:
+        """
+        Returns a single price, NaN if it is not quoted.
+        """
+        return self.values[self.source_index[source], self.token_index[base_asset], self.token_index[quote_asset]]
+
+    def set(self, source: str, base_asset: str, quote_asset: str, price: float):
+        """
+        Stores a single price.
+        """
+        self.values[self.source_index[source], self.token_index[base_asset], self.token_index[quote_asset]] = price
+
+    def pair_indices(self, pairs: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Maps "BASE/QUOTE" pair names to arrays of base and quote token indices, -1 for unknown tokens.
+        Aliases such as ETH resolve to the token they stand for.
+        """
+        base_indices: List[int] = []
+        quote_indices: List[int] = []
+        for pair in pairs:
+            base_asset, quote_asset = pair.split("/")
+            base_indices.append(self.token_index.get(token_symbol(base_asset), -1))
+            quote_indices.append(self.token_index.get(token_symbol(quote_asset), -1))
+        return np.array(base_indices, dtype=np.intp), np.array(quote_indices, dtype=np.intp)
+
+    def pair_prices(self, pairs: Iterable[str]) -> np.ndarray:
+        """
+        Returns an array of shape (sources, pairs) with the price of each pair from each source.
+        """
+        base_indices, quote_indices = self.pair_indices(pairs)
+        known = (base_indices >= 0) & (quote_indices >= 0)
+        result = np.full((len(self.sources), len(base_indices)), np.nan, dtype=np.float64)
+        result[:, known] = self.values[:, base_indices[known], quote_indices[known]]
+        return result
+
+    def spread(self, buy_source: str, sell_source: str) -> np.ndarray:
+        """
+        Returns the relative spread sell/buy - 1 for every token pair, shape (tokens, tokens).
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.values[self.source_index[sell_source]] / self.values[self.source_index[buy_source]] - 1
+
+    def divergence(self) -> np.ndarray:
+        """
+        Returns the cross-source divergence (max - min) / min for every token pair, shape (tokens, tokens).
+        Pairs quoted by no source are NaN.
+        """
+        highest = np.fmax.reduce(self.values, axis=0)
+        lowest = np.fmin.reduce(self.values, axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (highest - lowest) / lowest
+
+    def expected_profit(self, slippage: float, first_source: str = "paraswap", second_source: str = "oneinch", reference_source: str = "coinmarketcap") -> np.ndarray:
+        """
+        Returns the expected arbitrage profit between two venues for every token pair, shape (tokens, tokens).
+        Uses the same formula as arbitrage.check_arbitrage, valued at the reference source price.
+        """
+        first = self.values[self.source_index[first_source]]
+        second = self.values[self.source_index[second_source]]
+        reference = self.values[self.source_index[reference_source]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            first_profit = first / second * reference * (1 - slippage) - reference * (1 + slippage)
+            second_profit = second / first * reference * (1 - slippage) - reference * (1 + slippage)
+        return np.fmax(first_profit, second_profit)
@@ -0,0 +1,79 @@
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+# Define the key of a snapshot entry: (source, base asset, quote asset)
+PriceKey = Tuple[str, str, str]
+
+class PriceSnapshot(NamedTuple):
+    """
+    An immutable view of every known price, tagged with a monotonic version number.
+    """
+    version: int
+    timestamp: float
+    prices: Mapping[PriceKey, float]
+
+    def get(self, source: str, base_asset: str, quote_asset: str) -> Optional[float]:
+        """
+        Returns the price of base_asset in quote_asset reported by source, or None if unknown.
+        """
+        return self.prices.get((source, base_asset, quote_asset))
+
+    def quotes(self, base_asset: str, quote_asset: str) -> Dict[str, float]:
+        """
+        Returns the price of base_asset in quote_asset from every source that reported it.
+        """
+        return {
+            source: price
+            for (source, base, quote), price in self.prices.items()
+            if base == base_asset and quote == quote_asset
+        }
+
+    def sources(self) -> Tuple[str, ...]:
+        """
+        Returns the sources present in this snapshot, in first-seen order.
+        """
+        return tuple(dict.fromkeys(source for source, _, _ in self.prices))
+
+_EMPTY = PriceSnapshot(0, 0.0, MappingProxyType({}))
+
+_current = _EMPTY
+_write_lock = threading.Lock()
+_subscribers: List[Callable[[PriceSnapshot], None]] = []
+
+def current_snapshot() -> PriceSnapshot:
+    """
+    Returns the latest published snapshot. Readers never block and never see a partial update.
+    """
+    return _current
+
+def subscribe(callback: Callable[[PriceSnapshot], None]):
+    """
+    Registers a callback run with every newly published snapshot, in publish order.
+    Callbacks run under the write lock, so they should be quick.
+    """
+    _subscribers.append(callback)
+
+def publish(entries: Mapping[PriceKey, float], replace_sources: Optional[Iterable[str]] = None) -> PriceSnapshot:
+    """
+    Publishes a new snapshot made of the current prices overlaid with entries.
+    Entries from any source listed in replace_sources are dropped first, so a full refresh of
+    a source does not keep quotes that source no longer reports.
+    """
+    global _current
+
+    with _write_lock:
+        dropped = set(replace_sources or ())
+        merged = {key: price for key, price in _current.prices.items() if key[0] not in dropped}
+        merged.update(entries)
+        snapshot = PriceSnapshot(_current.version + 1, time.time(), MappingProxyType(merged))
+        _current = snapshot
+
+        for callback in _subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"Error in snapshot subscriber for version {snapshot.version}: {e!r}")
+
+    return snapshot
@@ -1,5 +1,8 @@
 import os
-import requests
+from typing import Dict, List, Optional, Tuple
+from fetch_engine import FetchRequest, run_fetches
+from price_snapshot import PriceSnapshot, current_snapshot, publish
+from request_scheduler import SCHEDULER
 
 # Define the base tokens from Polygon network
 POLYGON_BASE_TOKENS = ["USDT", "MATIC", "USDC", "TETHER", "WETH", "WBTC", "DAI"]
@@ -21,122 +24,245 @@ TOKEN_CONTRACTS = {
     "DAI": "0x8f3Cf7ad23Cd3CaDbD9735AFf958023239c6A063"
 }
 
-# Define CoinMarketCap and Coinlib API keys
-CMC_API_KEY = os.environ.get("CMC_API_KEY")
-COINLIB_API_KEY = os.environ.get("COINLIB_API_KEY")
+# Define the symbols traded under another token's contract, e.g. ETH is held as WETH on Polygon
+TOKEN_ALIASES = {
+    "ETH": "WETH"
+}
 
-# Define a dictionary to store the fetched prices
-prices = {}
+def token_symbol(asset: str) -> str:
+    """
+    Returns the symbol quotes and pools list a token under, resolving aliases such as ETH to WETH.
+    """
+    return TOKEN_ALIASES.get(asset, asset)
 
-def fetch_paraswap_prices():
+def token_address(asset: str) -> Optional[str]:
     """
-    Fetches the latest prices for supported trading pairs from the Paraswap API.
+    Returns the contract address of a token symbol (or alias), the asset itself if it is already an address,
+    or None if it cannot be resolved.
     """
-    global prices
+    if asset.startswith("0x") and len(asset) == 42:
+        return asset
+    return TOKEN_CONTRACTS.get(token_symbol(asset))
 
-    for base_asset in POLYGON_BASE_TOKENS:
-        url = f"{PARASWAP_API_ENDPOINT}/{TOKEN_CONTRACTS[base_asset]}"
-        response = requests.get(url)
+# Define CoinMarketCap and Coinlib API keys
+CMC_API_KEY = os.environ.get("CMC_API_KEY")
+COINLIB_API_KEY = os.environ.get("COINLIB_API_KEY")
 
-        if response.status_code == 200:
-            data = response.json()
-            prices[base_asset] = {}
+# Define the per-host concurrency cap and per-request deadline (in seconds) for price requests
+MAX_REQUESTS_PER_HOST = int(os.environ.get("PRICE_MAX_REQUESTS_PER_HOST", 8))
+REQUEST_TIMEOUT = float(os.environ.get("PRICE_REQUEST_TIMEOUT", 5.0))
 
-            for quote_asset, quote_data in data.items():
-                if quote_asset != "error":
-                    prices[base_asset][quote_asset] = float(quote_data["price"])
-        else:
-            print(f"Error fetching prices from Paraswap API for {base_asset}. Status code: {response.status_code}")
+def paraswap_requests() -> List[FetchRequest]:
+    """
+    Builds the Paraswap price requests, one per base asset.
+    """
+    return [
+        FetchRequest(("paraswap", base_asset, None), f"{PARASWAP_API_ENDPOINT}/{TOKEN_CONTRACTS[base_asset]}")
+        for base_asset in POLYGON_BASE_TOKENS
+    ]
 
-def fetch_oneinch_prices():
+def oneinch_requests() -> List[FetchRequest]:
     """
-    Fetches the latest prices for supported trading pairs from the 1inch API.
+    Builds the 1inch quote requests, one per ordered pair of base tokens.
     """
-    global prices
+    return [
+        FetchRequest(
+            ("oneinch", base_asset, quote_asset),
+            f"{ONEINCH_API_ENDPOINT}?fromTokenAddress={TOKEN_CONTRACTS[base_asset]}&toTokenAddress={TOKEN_CONTRACTS[quote_asset]}&amount=1000000000000000000"
+        )
+        for base_asset in POLYGON_BASE_TOKENS
+        for quote_asset in POLYGON_BASE_TOKENS
+        if base_asset != quote_asset
+    ]
 
-    for base_asset in POLYGON_BASE_TOKENS:
-        prices[base_asset] = {}
+def coinmarketcap_requests() -> List[FetchRequest]:
+    """
+    Builds the CoinMarketCap quote requests, one per quote asset, each covering every base token at once.
+    None are built without an API key. The key is read on every call, as the environment may be loaded after import.
+    """
+    api_key = CMC_API_KEY or os.environ.get("CMC_API_KEY")
+    if not api_key:
+        return []
 
-        for quote_asset in POLYGON_BASE_TOKENS:
-            if base_asset != quote_asset:
-                url = f"{ONEINCH_API_ENDPOINT}?fromTokenAddress={TOKEN_CONTRACTS[base_asset]}&toTokenAddress={TOKEN_CONTRACTS[quote_asset]}&amount=1000000000000000000"
-                response = requests.get(url)
+    headers = {
+        "Accepts": "application/json",
+        "X-CMC_PRO_API_KEY": api_key
+    }
 
-                if response.status_code == 200:
-                    data = response.json()
-                    prices[base_asset][quote_asset] = float(data["toTokenAmount"]) / float(data["fromTokenAmount"])
-                else:
-                    print(f"Error fetching prices from 1inch API for {base_asset}/{quote_asset}. Status code: {response.status_code}")
+    symbols = ",".join(POLYGON_BASE_TOKENS)
+    return [
+        FetchRequest(
+            ("coinmarketcap", None, quote_asset),
+            f"{COINMARKETCAP_API_ENDPOINT}?symbol={symbols}&convert={quote_asset}&skip_invalid=true",
+            headers
+        )
+        for quote_asset in POLYGON_BASE_TOKENS
+    ]
 
-def fetch_coinmarketcap_prices():
+def coinlib_requests() -> List[FetchRequest]:
     """
-    Fetches the latest prices for supported trading pairs from the CoinMarketCap API.
+    Builds the Coinlib price requests, one per ordered pair of base tokens.
+    None are built without an API key. The key is read on every call, as the environment may be loaded after import.
     """
-    global prices
+    api_key = COINLIB_API_KEY or os.environ.get("COINLIB_API_KEY")
+    if not api_key:
+        return []
 
     headers = {
         "Accepts": "application/json",
-        "X-CMC_PRO_API_KEY": CMC_API_KEY
+        "user-agent": "arbitrage-bot"
     }
 
-    for base_asset in POLYGON_BASE_TOKENS:
-        prices[base_asset] = {}
+    return [
+        FetchRequest(
+            ("coinlib", base_asset, quote_asset),
+            f"{COINLIB_API_ENDPOINT}?symbol={base_asset}_{quote_asset}&pref=USD&key={api_key}",
+            headers
+        )
+        for base_asset in POLYGON_BASE_TOKENS
+        for quote_asset in POLYGON_BASE_TOKENS
+        if base_asset != quote_asset
+    ]
 
-        for quote_asset in POLYGON_BASE_TOKENS:
-            if base_asset != quote_asset:
-                response = requests.get(f"{COINMARKETCAP_API_ENDPOINT}?symbol={base_asset}&convert={quote_asset}", headers=headers)
-
-                if response.status_code == 200:
-                    data = response.json()
-                    prices[base_asset][quote_asset] = data["data"][base_asset]["quote"][quote_asset]["price"]
-                else:
-                    print(f"Error fetching prices from CoinMarketCap API for {base_asset}/{quote_asset}. Status code: {response.status_code}")
+def parse_paraswap_response(base_asset: str, quote_asset: str, data: dict) -> Dict[Tuple[str, str], float]:
+    """
+    Extracts quote asset prices from a Paraswap price response.
+    """
+    return {
+        (base_asset, quote_asset): float(quote_data["price"])
+        for quote_asset, quote_data in data.items()
+        if quote_asset != "error"
+    }
 
-def fetch_coinlib_prices():
+def parse_oneinch_response(base_asset: str, quote_asset: str, data: dict) -> Dict[Tuple[str, str], float]:
     """
-    Fetches the latest prices for supported trading pairs from the Coinlib API.
+    Extracts the quoted price from a 1inch quote response.
     """
-    global prices
+    return {(base_asset, quote_asset): float(data["toTokenAmount"]) / float(data["fromTokenAmount"])}
 
-    headers = {
-        "Accepts": "application/json",
-        "user-agent": "arbitrage-bot"
+def parse_coinmarketcap_response(base_asset: str, quote_asset: str, data: dict) -> Dict[Tuple[str, str], float]:
+    """
+    Extracts the quoted prices of every base asset in a CoinMarketCap quotes response.
+    """
+    return {
+        (symbol, quote_asset): quote_data["quote"][quote_asset]["price"]
+        for symbol, quote_data in data["data"].items()
+        if symbol != quote_asset
     }
 
-    for base_asset in POLYGON_BASE_TOKENS:
-        prices[base_asset] = {}
+def parse_coinlib_response(base_asset: str, quote_asset: str, data: dict) -> Dict[Tuple[str, str], float]:
+    """
+    Extracts the quoted price from a Coinlib coin response.
+    """
+    return {(base_asset, quote_asset): float(data["price"])}
+
+# Define the request builder, response parser and display name for each price source
+# (request keys are (source, base asset, quote asset), with None for an asset a request covers in bulk)
+PRICE_SOURCES = {
+    "paraswap": (paraswap_requests, parse_paraswap_response, "Paraswap"),
+    "oneinch": (oneinch_requests, parse_oneinch_response, "1inch"),
+    "coinmarketcap": (coinmarketcap_requests, parse_coinmarketcap_response, "CoinMarketCap"),
+    "coinlib": (coinlib_requests, parse_coinlib_response, "Coinlib")
+}
+
+def fetch_sources(sources: List[str]) -> PriceSnapshot:
+    """
+    Fetches the latest prices from the given sources, sending concurrently whichever of their requests
+    fit in each provider's quota, hot pairs and stalest quotes first.
+    Publishes and returns a new snapshot. Sources whose requests were all sent are fully replaced;
+    the others keep their earlier quotes for the pairs deferred to a later round.
+    """
+    requests = []
+    for source in sources:
+        build_requests, _, _ = PRICE_SOURCES[source]
+        requests.extend(build_requests())
+
+    scheduled = SCHEDULER.schedule(requests)
+    results = run_fetches(scheduled, max_per_host=MAX_REQUESTS_PER_HOST, timeout=REQUEST_TIMEOUT)
+    SCHEDULER.record(results)
+
+    entries = {}
+    for result in results:
+        source, base_asset, quote_asset = result.key
+        _, parse_response, source_name = PRICE_SOURCES[source]
+        pair = "/".join(asset or "*" for asset in (base_asset, quote_asset)) if quote_asset else base_asset
+
+        if result.error:
+            print(f"Error fetching prices from {source_name} API for {pair}. {result.error}")
+            continue
+
+        try:
+            quotes = parse_response(base_asset, quote_asset, result.data)
+        except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+            print(f"Error parsing prices from {source_name} API for {pair}: {e!r}")
+            continue
+
+        for (base, quote), price in quotes.items():
+            entries[(source, base, quote)] = price
+
+    # Requests over quota were not sent, so only sources sent in full can drop their old quotes
+    scheduled_keys = {request.key for request in scheduled}
+    deferred = {request.key[0] for request in requests if request.key not in scheduled_keys}
+    return publish(entries, replace_sources=[source for source in sources if source not in deferred])
+
+def fetch_paraswap_prices():
+    """
+    Fetches the latest prices for supported trading pairs from the Paraswap API.
+    """
+    fetch_sources(["paraswap"])
+
+def fetch_oneinch_prices():
+    """
+    Fetches the latest prices for supported trading pairs from the 1inch API.
+    """
+    fetch_sources(["oneinch"])
 
-        for quote_asset in POLYGON_BASE_TOKENS:
-            if base_asset != quote_asset:
-                response = requests.get(f"{COINLIB_API_ENDPOINT}?symbol={base_asset}_{quote_asset}&pref=USD&key={COINLIB_API_KEY}", headers=headers)
+def fetch_coinmarketcap_prices():
+    """
+    Fetches the latest prices for supported trading pairs from the CoinMarketCap API.
+    """
+    fetch_sources(["coinmarketcap"])
 
-                if response.status_code == 200:
-                    data = response.json()
-                    prices[base_asset][quote_asset] = float(data["price"])
-                else:
-                    print(f"Error fetching prices from Coinlib API for {base_asset}/{quote_asset}. Status code: {response.status_code}")
+def fetch_coinlib_prices():
+    """
+    Fetches the latest prices for supported trading pairs from the Coinlib API.
+    """
+    fetch_sources(["coinlib"])
 
 def fetch_prices():
     """
-    Fetches the latest prices for supported trading pairs from all sources.
+    Fetches the latest prices for supported trading pairs from all sources in a single concurrent round.
     """
-    fetch_paraswap_prices()
-    fetch_oneinch_prices()
-    fetch_coinmarketcap_prices()
-    fetch_coinlib_prices()
+    return fetch_sources(list(PRICE_SOURCES))
 
-def get_price(base_asset: str, quote_asset: str) -> float:
+def get_price(base_asset: str, quote_asset: str, source: str = None, snapshot: PriceSnapshot = None) -> float:
     """
     Returns the current price of a base asset against a quote asset.
+    Reads from the given source, or from the first source in PRICE_SOURCES order that quotes the pair.
     """
-    global prices
+    if snapshot is None:
+        snapshot = current_snapshot()
 
-    if base_asset not in prices:
-        print(f"Error: {base_asset} is not a supported base asset.")
-        return None
-
-    if quote_asset not in prices[base_asset]:
+    quotes = snapshot.quotes(base_asset, quote_asset)
+    if not quotes:
         print(f"Error: {base_asset}/{quote_asset} is not a supported trading pair.")
         return None
 
-    return prices[base_asset][quote_asset]
\ No newline at end of file
+    if source is not None:
+        if source not in quotes:
+            print(f"Error: no {source} price for {base_asset}/{quote_asset}.")
+            return None
+        return quotes[source]
+
+    for candidate in list(PRICE_SOURCES) + list(quotes):
+        if candidate in quotes:
+            return quotes[candidate]
+
+def get_prices(base_asset: str, quote_asset: str, snapshot: PriceSnapshot = None) -> Dict[str, float]:
+    """
+    Returns the current price of a base asset against a quote asset from every source, side by side.
+    """
+    if snapshot is None:
+        snapshot = current_snapshot()
+
+    return snapshot.quotes(base_asset, quote_asset)
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_utils import keccak
+from web3 import Web3
+
+from fetch_engine import run_coroutine
+from http_pool import get_async_client
+from web3_provider import PROVIDER_ENDPOINT
+
+# Define the endpoints signed transactions are submitted to, as comma-separated "kind=url" entries where kind is rpc or bundle.
+# There is no default: sending through the public provider broadcasts every route to the mempool, so it must be listed explicitly
+RELAY_ENDPOINTS = os.environ.get("RELAY_ENDPOINTS", "")
+
+# Define the key that signs bundle relay requests (X-Flashbots-Signature), if the relays require one
+RELAY_AUTH_KEY = os.environ.get("RELAY_AUTH_KEY")
+
+# Define how many relays each submission fans out to, fastest first (0 means all of them)
+RELAY_FANOUT = int(os.environ.get("RELAY_FANOUT", 0))
+
+# Define the deadline for a relay to acknowledge a submission (in seconds)
+RELAY_TIMEOUT = 2.0
+
+# Define how many consecutive blocks a bundle is offered for
+BUNDLE_TARGET_BLOCKS = 3
+
+# Define how often inclusion is polled, and how long before a submission counts as never included (in seconds)
+INCLUSION_POLL_INTERVAL = 0.5
+INCLUSION_TIMEOUT = 60.0
+
+# Define the weight of the newest sample in each relay's latency moving average
+LATENCY_EMA_ALPHA = 0.2
+
+class Submission(NamedTuple):
+    """
+    A fan-out of signed transactions: the relays that acknowledged it (with their acknowledgement
+    latency), the ones that rejected it, and a future resolving to (first relay to include it,
+    block number), or None if it was not seen included before INCLUSION_TIMEOUT.
+    """
+    transaction_hashes: List[str]
+    sent_at: float
+    accepted: Dict[str, float]
+    errors: Dict[str, str]
+    inclusion: Future
+
+class Relay:
+    """
+    A submission backend. send() delivers signed raw transactions, as one atomic bundle where the
+    backend supports it, and raises RuntimeError if they are rejected. inclusion() returns the block a
+    transaction was included in, or None if it is not included yet or the backend cannot tell.
+    """
+    reports_inclusion = False
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def send(self, raw_transactions: Sequence[bytes], block_number: Optional[int]):
+        raise NotImplementedError
+
+    async def inclusion(self, transaction_hash: str) -> Optional[int]:
+        return None
+
+class RpcRelay(Relay):
+    """
+    A JSON-RPC endpoint, e.g. a node or a private transaction RPC. Transactions are sent with
+    eth_sendRawTransaction in a single batch request, and inclusion is read from the endpoint's receipts.
+    """
+    reports_inclusion = True
+
+    def __init__(self, name: str, url: str):
+        super().__init__(name)
+        self.url = url
+
+    async def _call(self, payload, headers: Dict[str, str] = None):
+        body = json.dumps(payload)
+        response = await get_async_client(self.url).post(self.url, content=body, headers=dict(headers or {}, **{"Content-Type": "application/json"}))
+        if response.status_code != 200:
+            raise RuntimeError(f"{self.name} answered with status code {response.status_code}")
+        return response.json()
+
+    def _headers(self, body: str) -> Dict[str, str]:
+        return {}
+
+    async def _batch(self, calls: List[Tuple[str, list]]) -> list:
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+        replies = await self._call(payload, self._headers(json.dumps(payload)))
+        if isinstance(replies, dict):
+            replies = [replies]
+        errors = [reply["error"] for reply in replies if "error" in reply]
+        if errors:
+            raise RuntimeError(f"{self.name} returned an error: {errors[0]}")
+        return [reply.get("result") for reply in sorted(replies, key=lambda reply: reply.get("id", 0))]
+
+    async def send(self, raw_transactions: Sequence[bytes], block_number: Optional[int]):
+        await self._batch([("eth_sendRawTransaction", ["0x" + raw.hex()]) for raw in raw_transactions])
+
+    async def inclusion(self, transaction_hash: str) -> Optional[int]:
+        receipt = (await self._batch([("eth_getTransactionReceipt", [transaction_hash])]))[0]
+        return int(receipt["blockNumber"], 16) if receipt else None
+
+    async def block_number(self) -> int:
+        return int((await self._batch([("eth_blockNumber", [])]))[0], 16)
+
+class BundleRelay(RpcRelay):
+    """
+    A private bundle relay. The transactions are offered as one bundle with eth_sendBundle for each of
+    the next BUNDLE_TARGET_BLOCKS blocks, so they are never visible in the public mempool and land
+    together or not at all. Requests are signed with auth_key when given. Relays do not serve receipts,
+    so inclusion is observed through the router's watcher.
+    """
+    reports_inclusion = False
+
+    def __init__(self, name: str, url: str, auth_key: Optional[str] = RELAY_AUTH_KEY, target_blocks: int = BUNDLE_TARGET_BLOCKS):
+        super().__init__(name, url)
+        self.auth_account = Account.from_key(auth_key) if auth_key else None
+        self.target_blocks = target_blocks
+
+    def _headers(self, body: str) -> Dict[str, str]:
+        if self.auth_account is None:
+            return {}
+        signature = self.auth_account.sign_message(encode_defunct(text=Web3.keccak(text=body).hex())).signature.hex()
+        return {"X-Flashbots-Signature": f"{self.auth_account.address}:{signature}"}
+
+    async def send(self, raw_transactions: Sequence[bytes], block_number: Optional[int]):
+        if block_number is None:
+            raise ValueError(f"{self.name} needs the current block number to target a bundle")
+        transactions = ["0x" + raw.hex() for raw in raw_transactions]
+        await self._batch([
+            ("eth_sendBundle", [{"txs": transactions, "blockNumber": hex(block_number + offset)}])
+            for offset in range(1, self.target_blocks + 1)
+        ])
+
+    async def inclusion(self, transaction_hash: str) -> Optional[int]:
+        return None
+
+class MockRelay(Relay):
+    """
+    An in-memory relay for dry runs and tests: acknowledges after ack_delay, or rejects with error,
+    and reports every transaction it received as included inclusion_delay seconds after receiving it.
+    """
+    reports_inclusion = True
+
+    def __init__(self, name: str, ack_delay: float = 0.0, inclusion_delay: Optional[float] = 0.0, error: Optional[str] = None, block_number: int = 0):
+        super().__init__(name)
+        self.ack_delay = ack_delay
+        self.inclusion_delay = inclusion_delay
+        self.error = error
+        self.block_number = block_number
+        self.received: Dict[str, float] = {}
+
+    async def send(self, raw_transactions: Sequence[bytes], block_number: Optional[int]):
+        await asyncio.sleep(self.ack_delay)
+        if self.error is not None:
+            raise RuntimeError(f"{self.name} rejected the submission: {self.error}")
+        for raw in raw_transactions:
+            self.received["0x" + keccak(raw).hex()] = time.monotonic()
+
+    async def inclusion(self, transaction_hash: str) -> Optional[int]:
+        received_at = self.received.get(transaction_hash)
+        if received_at is None or self.inclusion_delay is None or time.monotonic() - received_at < self.inclusion_delay:
+            return None
+        return self.block_number
+
+def relays_from_config(config: str = RELAY_ENDPOINTS) -> List[Relay]:
+    """
+    Builds the relays listed in a RELAY_ENDPOINTS string, named after their host (numbered if a host repeats).
+    Warns when the public provider is listed, since it broadcasts transactions to the public mempool.
+    """
+    relays = []
+    for i, entry in enumerate(filter(None, (entry.strip() for entry in config.split(",")))):
+        kind, url = entry.split("=", 1) if "=" in entry else ("rpc", entry)
+        relay_class = {"rpc": RpcRelay, "bundle": BundleRelay}.get(kind)
+        if relay_class is None:
+            raise ValueError(f"Unknown relay kind {kind!r} in {entry!r}, expected rpc or bundle")
+        name = httpx.URL(url).host or url
+        if any(relay.name == name for relay in relays):
+            name = f"{name}#{i}"
+        relays.append(relay_class(name, url))
+
+    public = [relay.name for relay in relays if type(relay) is RpcRelay and relay.url.rstrip("/") == PROVIDER_ENDPOINT.rstrip("/")]
+    if public and len(public) == len(relays):
+        print("WARNING: RELAY_ENDPOINTS only lists the public provider; every route will be front-runnable. Add a private or bundle relay.")
+    elif public:
+        print(f"WARNING: relay {public[0]} is the public provider; transactions sent through it are visible in the public mempool")
+    return relays
+
+class RelayRouter:
+    """
+    Fans signed transactions out to several relays at once over the shared async HTTP pool, then
+    watches for inclusion in the background. Each relay keeps a moving average of the time from
+    submission to seeing the transaction included, and submissions go to the fastest relays first.
+    Relays that cannot report inclusion are timed by the watcher, a plain RPC endpoint.
+    A relay that rejects a submission or never sees it included is scored at INCLUSION_TIMEOUT.
+    """
+
+    def __init__(self, relays: Sequence[Relay], watcher: Optional[RpcRelay] = None, fanout: int = RELAY_FANOUT, alpha: float = LATENCY_EMA_ALPHA):
+        self.relays = list(relays)
+        self.watcher = watcher if watcher is not None else RpcRelay("watcher", PROVIDER_ENDPOINT)
+        self.fanout = fanout
+        self.alpha = alpha
+        self.stats = {relay.name: {"latency": None, "ack_latency": None, "submitted": 0, "accepted": 0, "included_first": 0} for relay in self.relays}
+        self._lock = threading.Lock()
+
+    def _record(self, name: str, key: str, value: float):
+        stats = self.stats[name]
+        stats[key] = value if stats[key] is None else self.alpha * value + (1 - self.alpha) * stats[key]
+
+    def ranked(self) -> List[Relay]:
+        """
+        Returns the relays, fastest inclusion first. Relays not measured yet go first so they get measured.
+        """
+        with self._lock:
+            return sorted(self.relays, key=lambda relay: self.stats[relay.name]["latency"] if self.stats[relay.name]["latency"] is not None else -1.0)
+
+    async def _send(self, relay: Relay, raw_transactions: Sequence[bytes], block_number: Optional[int], started: float) -> Tuple[Relay, Optional[float], Optional[str]]:
+        try:
+            await asyncio.wait_for(relay.send(raw_transactions, block_number), RELAY_TIMEOUT)
+            return relay, time.monotonic() - started, None
+        except asyncio.TimeoutError:
+            return relay, None, f"Timed out after {RELAY_TIMEOUT}s"
+        except (RuntimeError, ValueError, httpx.HTTPError) as e:
+            return relay, None, str(e)
+
+    async def _inclusion(self, relay: Relay, transaction_hash: str) -> Optional[int]:
+        try:
+            return await asyncio.wait_for(relay.inclusion(transaction_hash), RELAY_TIMEOUT)
+        except (asyncio.TimeoutError, RuntimeError, httpx.HTTPError, ValueError):
+            return None
+
+    def _observer(self, relay: Relay) -> str:
+        return relay.name if relay.reports_inclusion else self.watcher.name
+
+    async def _track(self, transaction_hash: str, accepted: List[Relay], ack_latencies: Dict[str, float], started: float) -> Optional[Tuple[str, int]]:
+        """
+        Polls the accepting relays (and the watcher, for relays that cannot report) until every one has seen
+        the transaction included or INCLUSION_TIMEOUT passes, then scores them.
+        """
+        reporters = [relay for relay in accepted if relay.reports_inclusion]
+        if len(reporters) < len(accepted):
+            reporters.append(self.watcher)
+        included_at: Dict[str, float] = {}
+        included_in: Dict[str, int] = {}
+        winner = None
+
+        while len(included_at) < len(reporters) and time.monotonic() - started < INCLUSION_TIMEOUT:
+            waiting = [relay for relay in reporters if relay.name not in included_at]
+            blocks = await asyncio.gather(*(self._inclusion(relay, transaction_hash) for relay in waiting))
+            now = time.monotonic()
+            for relay, block_number in zip(waiting, blocks):
+                if block_number is not None:
+                    included_at[relay.name] = now - started
+                    included_in[relay.name] = block_number
+            candidates = [relay for relay in accepted if self._observer(relay) in included_at]
+            if winner is None and candidates:
+                # Relays timed by the watcher share its observation; the earliest acknowledgement breaks ties
+                winner = min(candidates, key=lambda relay: (included_at[self._observer(relay)], ack_latencies[relay.name]))
+            if len(included_at) < len(reporters):
+                await asyncio.sleep(INCLUSION_POLL_INTERVAL)
+
+        with self._lock:
+            for relay in accepted:
+                self._record(relay.name, "latency", included_at.get(self._observer(relay), INCLUSION_TIMEOUT))
+            if winner is not None:
+                self.stats[winner.name]["included_first"] += 1
+        return (winner.name, included_in[self._observer(winner)]) if winner is not None else None
+
+    async def _submit(self, raw_transactions: Sequence[bytes], block_number: Optional[int]) -> Tuple[List[Relay], Dict[str, float], Dict[str, str]]:
+        relays = self.ranked()
+        if self.fanout > 0:
+            relays = relays[:self.fanout]
+        if block_number is None and any(isinstance(relay, BundleRelay) for relay in relays):
+            block_number = await self.watcher.block_number()
+
+        started = time.monotonic()
+        results = await asyncio.gather(*(self._send(relay, raw_transactions, block_number, started) for relay in relays))
+        accepted, errors = {}, {}
+        with self._lock:
+            for relay, ack_latency, error in results:
+                self.stats[relay.name]["submitted"] += 1
+                if error is None:
+                    accepted[relay.name] = ack_latency
+                    self.stats[relay.name]["accepted"] += 1
+                    self._record(relay.name, "ack_latency", ack_latency)
+                else:
+                    errors[relay.name] = error
+                    self._record(relay.name, "latency", INCLUSION_TIMEOUT)
+        return [relay for relay in relays if relay.name in accepted], accepted, errors
+
+    def submit(self, raw_transactions: Sequence[bytes], block_number: int = None) -> Submission:
+        """
+        Sends signed transactions to every routed relay in parallel and waits only for their acknowledgements.
+        Inclusion is tracked in the background; the returned submission's inclusion future resolves once
+        every accepting relay has been scored. Raises RuntimeError if no relay is configured or none accepted.
+        block_number is the current block, used to target bundles; it is fetched when a bundle relay needs it.
+        """
+        if not self.relays:
+            raise RuntimeError("No relays configured: set RELAY_ENDPOINTS to the rpc or bundle relays to submit through")
+        sent_at = time.time()
+        started = time.monotonic()
+        relays, accepted, errors = run_coroutine(self._submit(raw_transactions, block_number)).result()
+        if not relays:
+            raise RuntimeError(f"No relay accepted the submission: {errors}")
+
+        transaction_hashes = ["0x" + keccak(raw).hex() for raw in raw_transactions]
+        # A bundle lands atomically, so its last transaction stands for all of them
+        inclusion = run_coroutine(self._track(transaction_hashes[-1], relays, accepted, started))
+        return Submission(transaction_hashes, sent_at, accepted, errors, inclusion)
+
+# Define the relays every executor submits through
+RELAY_ROUTER = RelayRouter(relays_from_config())
+
+if __name__ == "__main__":
+    # Self-check against mock relays: the fastest relay to include gets the first-inclusion credit and moves to the front
+    fast = MockRelay("fast", ack_delay=0.05, inclusion_delay=0.0, block_number=100)
+    slow = MockRelay("slow", ack_delay=0.0, inclusion_delay=1.0, block_number=101)
+    failing = MockRelay("failing", error="nonce too low")
+    router = RelayRouter([slow, failing, fast])
+    submission = router.submit([b"\x02mock transaction"])
+    assert set(submission.accepted) == {"fast", "slow"} and "failing" in submission.errors
+    assert submission.inclusion.result() == ("fast", 100)
+    assert router.stats["fast"]["included_first"] == 1 and router.stats["slow"]["included_first"] == 0
+    assert [relay.name for relay in router.ranked()] == ["fast", "slow", "failing"]
+    print({name: (round(stats["latency"], 2), stats["included_first"]) for name, stats in router.stats.items()})
@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+from fetch_engine import FetchRequest, FetchResult
+
+# Define the sustained request rate (per second) and burst size allowed for each provider
+PROVIDER_LIMITS = {
+    "paraswap": (float(os.environ.get("PARASWAP_RATE_LIMIT", 5.0)), 10),
+    "oneinch": (float(os.environ.get("ONEINCH_RATE_LIMIT", 1.0)), 5),
+    "coinmarketcap": (float(os.environ.get("CMC_RATE_LIMIT", 0.5)), 5),
+    "coinlib": (float(os.environ.get("COINLIB_RATE_LIMIT", 0.05)), 3)
+}
+
+# Define the pause applied to a provider that answers 429 (in seconds)
+THROTTLE_BACKOFF = 30.0
+
+# Define the priority lanes, lowest dispatched first
+LANE_HOT = 0
+LANE_NORMAL = 1
+
+# Define the pairs whose requests go in the hot lane, as "BASE/QUOTE"
+HOT_PAIRS = [pair for pair in os.environ.get("HOT_PAIRS", "").split(",") if pair]
+
+class TokenBucket:
+    """
+    Allows rate requests per second on average, with bursts of up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self) -> int:
+        """
+        Returns how many requests can be sent right now.
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return 0
+        self._refill(now)
+        return int(self.tokens)
+
+    def take(self, count: int = 1) -> bool:
+        """
+        Spends count tokens if they are all available, without waiting.
+        """
+        if self.available() < count:
+            return False
+        self.tokens -= count
+        return True
+
+    def pause(self, seconds: float):
+        """
+        Stops handing out tokens for a while and empties the bucket, e.g. after the provider throttled us.
+        """
+        self.paused_until = time.monotonic() + seconds
+        self.updated_at = self.paused_until
+        self.tokens = 0
+
+class RequestScheduler:
+    """
+    Decides which requests of a round fit in each provider's quota. A request's provider is the first
+    element of its key. Requests for hot pairs go first, then the ones whose data is oldest, so a quota
+    too small for every request each round still refreshes everything in turn.
+    Requests that do not fit are left for a later round rather than waited on.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = PROVIDER_LIMITS, hot_pairs: Iterable[str] = HOT_PAIRS):
+        self.buckets = {provider: TokenBucket(rate, capacity) for provider, (rate, capacity) in limits.items()}
+        self.last_fetched: Dict[Hashable, float] = {}
+        self.deferred = 0
+        self.set_hot_pairs(hot_pairs)
+        self._lock = threading.Lock()
+
+    def set_hot_pairs(self, pairs: Iterable[str]):
+        """
+        Replaces the pairs that go in the hot lane.
+        """
+        self.hot_pairs = {tuple(pair.split("/")) for pair in pairs}
+
+    def lane(self, key: tuple) -> int:
+        """
+        Returns the lane of a request key (provider, base, quote). A base or quote of None matches any
+        token, so a request covering many pairs is hot if any of them is.
+        """
+        base_asset, quote_asset = (tuple(key[1:3]) + (None, None))[:2]
+        for hot_base, hot_quote in self.hot_pairs:
+            if base_asset in (None, hot_base) and quote_asset in (None, hot_quote):
+                return LANE_HOT
+        return LANE_NORMAL
+
+    def schedule(self, requests: List[FetchRequest]) -> List[FetchRequest]:
+        """
+        Returns the requests to send now, spending one token per request from its provider's bucket.
+        Providers without a configured limit are not limited.
+        """
+        by_provider: Dict[str, List[FetchRequest]] = {}
+        for request in requests:
+            by_provider.setdefault(request.key[0], []).append(request)
+
+        scheduled = []
+        with self._lock:
+            for provider, provider_requests in by_provider.items():
+                bucket = self.buckets.get(provider)
+                if bucket is None:
+                    scheduled.extend(provider_requests)
+                    continue
+
+                provider_requests.sort(key=lambda request: (self.lane(request.key), self.last_fetched.get(request.key, 0.0)))
+                allowed = min(bucket.available(), len(provider_requests))
+                bucket.take(allowed)
+                scheduled.extend(provider_requests[:allowed])
+                self.deferred += len(provider_requests) - allowed
+
+        return scheduled
+
+    def record(self, results: Iterable[FetchResult]):
+        """
+        Marks successful requests as fresh and pauses any provider that answered 429.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for result in results:
+                if result.status_code == 429:
+                    bucket = self.buckets.get(result.key[0])
+                    if bucket is not None and bucket.paused_until <= now:
+                        print(f"Throttled by {result.key[0]}, pausing its requests")
+                        bucket.pause(THROTTLE_BACKOFF)
+                elif result.error is None:
+                    self.last_fetched[result.key] = now
+
+# Define the scheduler shared by every price and gas fee fetch
+SCHEDULER = RequestScheduler()
@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Dict, Hashable, Tuple
+
+# Define how long a block number is trusted without a new header before polling the node (in seconds)
+BLOCK_TTL = 2.0
+
+# Define the value returned by BlockCache.get on a miss
+MISSING = object()
+
+class BlockCache:
+    """
+    Caches values keyed by (pool, asset, block number), such as lending reserve data and rates.
+    Entries from older blocks are dropped as soon as a newer block header is reported.
+    """
+
+    def __init__(self, block_ttl: float = BLOCK_TTL):
+        self.block_ttl = block_ttl
+        self.block_number = None
+        self.block_seen_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[Hashable, Hashable, int], object] = {}
+        self._lock = threading.Lock()
+
+    def on_new_block(self, block_number: int):
+        """
+        Records a new block header and invalidates entries from earlier blocks.
+        """
+        with self._lock:
+            self.block_seen_at = time.monotonic()
+            if self.block_number is not None and block_number <= self.block_number:
+                return
+            self.block_number = block_number
+            self._entries = {key: value for key, value in self._entries.items() if key[2] >= block_number}
+
+    def current_block(self, web3=None) -> int:
+        """
+        Returns the latest known block number. Polls web3 for it only when no header has been
+        reported within block_ttl seconds.
+        """
+        if self.block_number is not None and time.monotonic() - self.block_seen_at < self.block_ttl:
+            return self.block_number
+        if web3 is None:
+            return self.block_number
+        self.on_new_block(web3.eth.block_number)
+        return self.block_number
+
+    def get(self, pool: Hashable, asset: Hashable, block_number: int):
+        """
+        Returns the cached value for (pool, asset) at block_number, or MISSING.
+        """
+        value = self._entries.get((pool, asset, block_number), MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, pool: Hashable, asset: Hashable, block_number: int, value):
+        """
+        Stores a value for (pool, asset) at block_number, unless that block is already superseded.
+        """
+        with self._lock:
+            if self.block_number is None or block_number >= self.block_number:
+                self._entries[(pool, asset, block_number)] = value
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit and miss counters and the number of cached entries.
+        """
+        return {
+            "block_number": self.block_number,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries)
+        }
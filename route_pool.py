@@ -0,0 +1,153 @@
+import heapq
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from arbitrage_graph import TRADE_SLIPPAGE, TokenGraph
+from price_matrix import PriceMatrix
+
+# Define the number of worker processes scoring routes
+ROUTE_POOL_WORKERS = int(os.environ.get("ROUTE_POOL_WORKERS", os.cpu_count() or 1))
+
+# Define the number of batches submitted per worker on each call, so faster workers pick up the slack
+BATCHES_PER_WORKER = 4
+
+# Define the matrix segments attached in this worker, and the values derived from each matrix version
+_attached: Dict[str, Tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+_derived: Dict[Tuple[str, int, str], object] = {}
+_tick: Tuple[str, int] = None
+
+def _attach(name: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Returns a zero-copy view of the parent's price segment, attaching to it on first use.
+    """
+    attached = _attached.get(name)
+    if attached is None:
+        # Workers share the parent's resource tracker, so the segment is still unlinked only by the parent
+        segment = shared_memory.SharedMemory(name=name)
+        for old_name in list(_attached):
+            _attached.pop(old_name)[0].close()
+        attached = _attached[name] = (segment, np.ndarray(shape, dtype=np.float64, buffer=segment.buf))
+    return attached[1]
+
+def _cached(matrix: PriceMatrix, key: str, build: Callable[[], object]):
+    """
+    Computes a value once per RoutePool.score call in this worker, e.g. the token graph shared by every batch.
+    Scorers called outside a worker compute it every time.
+    """
+    if _tick is None:
+        return build()
+    cache_key = _tick + (key,)
+    if cache_key not in _derived:
+        _derived.clear()
+        _derived[cache_key] = build()
+    return _derived[cache_key]
+
+def score_pairs(matrix: PriceMatrix, pairs: Sequence[str], slippage: float = TRADE_SLIPPAGE) -> List[Tuple[float, str]]:
+    """
+    Scores "BASE/QUOTE" pairs by the expected Paraswap/1inch arbitrage profit, valued at the CoinMarketCap price.
+    """
+    expected_profit = _cached(matrix, f"expected_profit:{slippage}", lambda: matrix.expected_profit(slippage))
+    base_indices, quote_indices = matrix.pair_indices(pairs)
+    known = (base_indices >= 0) & (quote_indices >= 0)
+    profits = np.full(len(pairs), np.nan)
+    profits[known] = expected_profit[base_indices[known], quote_indices[known]]
+    return [(float(profit), pair) for profit, pair in zip(profits, pairs)]
+
+def score_cycles(matrix: PriceMatrix, paths: Sequence[Sequence[str]], slippage: float = TRADE_SLIPPAGE) -> List[Tuple[float, tuple]]:
+    """
+    Scores token paths, such as ("USDC", "WETH", "DAI", "USDC"), by their compounded profit in percent,
+    trading each hop on its best venue after fees and slippage.
+    """
+    graph = _cached(matrix, f"graph:{slippage}", lambda: TokenGraph.from_matrix(matrix, slippage=slippage))
+    profits = np.full(len(paths), np.nan)
+
+    # Paths of the same length are priced together with one gather over the rate matrix
+    by_length: Dict[int, List[int]] = {}
+    for i, path in enumerate(paths):
+        by_length.setdefault(len(path), []).append(i)
+    for positions in by_length.values():
+        indices = np.array([[graph.token_index.get(token, -1) for token in paths[i]] for i in positions], dtype=np.intp)
+        known = (indices >= 0).all(axis=1)
+        rates = np.prod(graph.rates[indices[known, :-1], indices[known, 1:]], axis=1)
+        profits[np.array(positions)[known]] = (rates - 1) * 100
+
+    return [(float(profit), tuple(path)) for profit, path in zip(profits, paths)]
+
+# Define the scorers workers can run, by name
+SCORERS = {
+    "pairs": score_pairs,
+    "cycles": score_cycles
+}
+
+def _score_batch(name: str, tick: int, shape: Tuple[int, ...], sources: Tuple[str, ...], tokens: Tuple[str, ...], version: int, scorer: str, batch: list, kwargs: dict) -> list:
+    global _tick
+
+    _tick = (name, tick)
+    matrix = PriceMatrix(sources, tokens, _attach(name, shape), version)
+    scores = [score for score in SCORERS[scorer](matrix, batch, **kwargs) if not np.isnan(score[0])]
+    scores.sort(key=lambda score: score[0], reverse=True)
+    return scores
+
+class RoutePool:
+    """
+    Scores batches of routes in worker processes. The price matrix is written once per call into a
+    shared memory segment that workers map without copying; results are merged by expected profit.
+    The scan loop does not use it: find_arbitrage_sequence takes its cycles from the IncrementalTokenGraph
+    and check_arbitrage_matrix prices a handful of pairs in one vectorized pass, both cheaper in-process.
+    Use it for offline sweeps over route sets large enough to outweigh dispatching them to workers.
+    """
+
+    def __init__(self, max_workers: int = ROUTE_POOL_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._segment = None
+        self._values = None
+        self._ticks = 0
+
+    def _publish(self, matrix: PriceMatrix) -> str:
+        """
+        Copies the matrix into the shared segment, replacing the segment when the shape changes.
+        """
+        if self._values is None or self._values.shape != matrix.values.shape:
+            self._release()
+            self._segment = shared_memory.SharedMemory(create=True, size=max(matrix.values.nbytes, 1))
+            self._values = np.ndarray(matrix.values.shape, dtype=np.float64, buffer=self._segment.buf)
+        np.copyto(self._values, matrix.values)
+        return self._segment.name
+
+    def score(self, matrix: PriceMatrix, routes: Sequence, scorer: str = "cycles", batch_size: int = None, **kwargs) -> List[Tuple[float, object]]:
+        """
+        Scores every route with the named scorer across the workers.
+        Returns (expected_profit, route) for each route that could be priced, most profitable first.
+        """
+        if not routes:
+            return []
+        if batch_size is None:
+            batch_size = max(1, -(-len(routes) // (self.max_workers * BATCHES_PER_WORKER)))
+
+        name = self._publish(matrix)
+        self._ticks += 1
+        futures = [
+            self._executor.submit(_score_batch, name, self._ticks, matrix.values.shape, matrix.sources, matrix.tokens, matrix.version, scorer, list(routes[start:start + batch_size]), kwargs)
+            for start in range(0, len(routes), batch_size)
+        ]
+        return list(heapq.merge(*(future.result() for future in futures), key=lambda score: score[0], reverse=True))
+
+    def _release(self):
+        if self._segment is not None:
+            self._values = None
+            self._segment.close()
+            self._segment.unlink()
+            self._segment = None
+
+    def close(self):
+        """
+        Shuts the workers down and frees the shared segment.
+        """
+        self._executor.shutdown()
+        self._release()
@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from types import MappingProxyType
+from typing import Optional, Tuple
+
+import numpy as np
+
+from price_matrix import PriceMatrix
+from price_snapshot import PriceSnapshot, current_snapshot, subscribe
+
+# Define the name of the shared memory segment prices are published into
+SHARED_PRICES_NAME = os.environ.get("SHARED_PRICES_NAME", "arbflashbot_prices")
+
+# Define the capacity of the segment: sources, tokens, and bytes of JSON for their names
+SHARED_MAX_SOURCES = int(os.environ.get("SHARED_MAX_SOURCES", 16))
+SHARED_MAX_TOKENS = int(os.environ.get("SHARED_MAX_TOKENS", 64))
+SHARED_NAMES_CAPACITY = 8192
+
+# Define how many times a reader retries a read torn by a concurrent write before giving up
+MAX_READ_RETRIES = 100
+
+# Define the header slots (int64) at the start of the segment; the timestamp is stored in nanoseconds
+HEADER_SEQUENCE = 0
+HEADER_VERSION = 1
+HEADER_TIMESTAMP = 2
+HEADER_SOURCES = 3
+HEADER_TOKENS = 4
+HEADER_NAMES_VERSION = 5
+HEADER_NAMES_LENGTH = 6
+HEADER_MAX_SOURCES = 7
+HEADER_MAX_TOKENS = 8
+HEADER_SLOTS = 16
+
+# Define the segments created by this process
+_created = set()
+
+class SharedPrices:
+    """
+    A price matrix in a shared memory segment, written by one process and read by any number of others.
+    The header's sequence number is a seqlock: the writer makes it odd before changing anything and even
+    again afterwards, so a reader that sees the same even number before and after its copy knows the copy
+    is consistent, and retries otherwise. Readers never take a lock or block the writer.
+    """
+
+    def __init__(self, segment: shared_memory.SharedMemory, owner: bool):
+        self.segment = segment
+        self.owner = owner
+        self.torn_reads = 0
+        self._header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        max_sources = int(self._header[HEADER_MAX_SOURCES])
+        max_tokens = int(self._header[HEADER_MAX_TOKENS])
+        names_offset = HEADER_SLOTS * 8
+        payload_offset = names_offset + SHARED_NAMES_CAPACITY
+        self._names = segment.buf[names_offset:payload_offset]
+        self._payload = np.ndarray((max_sources * max_tokens * max_tokens,), dtype=np.float64, buffer=segment.buf, offset=payload_offset)
+        self._written_names = None
+        self._read_names = (None, None)
+
+    @classmethod
+    def create(cls, name: str = SHARED_PRICES_NAME, max_sources: int = SHARED_MAX_SOURCES, max_tokens: int = SHARED_MAX_TOKENS) -> "SharedPrices":
+        """
+        Creates the segment as its writer, replacing a segment left behind by a previous writer.
+        """
+        size = HEADER_SLOTS * 8 + SHARED_NAMES_CAPACITY + max_sources * max_tokens * max_tokens * 8
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created.add(name)
+
+        header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        header[:] = 0
+        header[HEADER_MAX_SOURCES] = max_sources
+        header[HEADER_MAX_TOKENS] = max_tokens
+        del header
+        return cls(segment, owner=True)
+
+    @classmethod
+    def attach(cls, name: str = SHARED_PRICES_NAME) -> "SharedPrices":
+        """
+        Attaches to an existing segment as a reader.
+        """
+        segment = shared_memory.SharedMemory(name=name)
+        if name not in _created:
+            # Keep this process's resource tracker from unlinking the writer's segment when the reader exits
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return cls(segment, owner=False)
+
+    def write(self, matrix: PriceMatrix, timestamp: float = None):
+        """
+        Publishes a matrix. Must only be called from the one writing process, one call at a time.
+        """
+        sources, tokens = len(matrix.sources), len(matrix.tokens)
+        if sources > self._header[HEADER_MAX_SOURCES] or tokens > self._header[HEADER_MAX_TOKENS]:
+            raise ValueError(f"Matrix of {sources} sources and {tokens} tokens exceeds the shared segment capacity")
+
+        names = (matrix.sources, matrix.tokens)
+        encoded_names = None
+        if names != self._written_names:
+            encoded_names = json.dumps(names).encode()
+            if len(encoded_names) > SHARED_NAMES_CAPACITY:
+                raise ValueError(f"Source and token names need {len(encoded_names)} bytes, more than {SHARED_NAMES_CAPACITY}")
+
+        self._header[HEADER_SEQUENCE] += 1
+        self._header[HEADER_VERSION] = matrix.version
+        self._header[HEADER_TIMESTAMP] = round((time.time() if timestamp is None else timestamp) * 1e9)
+        self._header[HEADER_SOURCES] = sources
+        self._header[HEADER_TOKENS] = tokens
+        if encoded_names is not None:
+            self._names[:len(encoded_names)] = encoded_names
+            self._header[HEADER_NAMES_LENGTH] = len(encoded_names)
+            self._header[HEADER_NAMES_VERSION] += 1
+            self._written_names = names
+        self._payload[:matrix.values.size] = matrix.values.ravel()
+        self._header[HEADER_SEQUENCE] += 1
+
+    def write_snapshot(self, snapshot: PriceSnapshot):
+        """
+        Publishes a price snapshot, laid out as a PriceMatrix.
+        """
+        self.write(PriceMatrix.from_snapshot(snapshot), snapshot.timestamp)
+
+    def version(self) -> int:
+        """
+        Returns the version of the last published matrix, so readers can skip copying unchanged prices.
+        """
+        return int(self._header[HEADER_VERSION])
+
+    def read(self) -> Tuple[PriceMatrix, float]:
+        """
+        Copies out the latest matrix and its timestamp, retrying reads torn by a concurrent write.
+        Raises RuntimeError if every retry was torn.
+        """
+        for _ in range(MAX_READ_RETRIES):
+            sequence = int(self._header[HEADER_SEQUENCE])
+            if sequence % 2:
+                self.torn_reads += 1
+                time.sleep(0)
+                continue
+
+            version = int(self._header[HEADER_VERSION])
+            timestamp = int(self._header[HEADER_TIMESTAMP]) / 1e9
+            sources = int(self._header[HEADER_SOURCES])
+            tokens = int(self._header[HEADER_TOKENS])
+            names_version = int(self._header[HEADER_NAMES_VERSION])
+            names = self._read_names[1]
+            if names_version != self._read_names[0]:
+                try:
+                    names = json.loads(bytes(self._names[:int(self._header[HEADER_NAMES_LENGTH])]))
+                except ValueError:
+                    names = None
+            values = self._payload[:sources * tokens * tokens].copy()
+
+            if int(self._header[HEADER_SEQUENCE]) != sequence or names is None:
+                self.torn_reads += 1
+                continue
+
+            self._read_names = (names_version, names)
+            return PriceMatrix(names[0], names[1], values.reshape(sources, tokens, tokens), version), timestamp
+
+        raise RuntimeError(f"Gave up reading shared prices after {MAX_READ_RETRIES} torn reads")
+
+    def read_snapshot(self) -> PriceSnapshot:
+        """
+        Returns the latest prices as a PriceSnapshot.
+        """
+        matrix, timestamp = self.read()
+        s, i, j = np.nonzero(~np.isnan(matrix.values))
+        prices = {
+            (matrix.sources[source], matrix.tokens[base], matrix.tokens[quote]): float(price)
+            for source, base, quote, price in zip(s, i, j, matrix.values[s, i, j])
+        }
+        return PriceSnapshot(matrix.version, timestamp, MappingProxyType(prices))
+
+    def close(self):
+        """
+        Detaches from the segment, and removes it if this is the writer.
+        """
+        self._header = self._payload = None
+        self._names.release()
+        self.segment.close()
+        if self.owner:
+            self.segment.unlink()
+
+_reader: Optional[SharedPrices] = None
+
+class SharedPublisher:
+    """
+    Mirrors published price snapshots into a shared segment from its own thread. The subscriber callback
+    only wakes the writer, so publish() never waits on building the matrix or writing shared memory, and
+    snapshots published while a write is in progress are coalesced into one write of the newest.
+    """
+
+    def __init__(self, writer: SharedPrices):
+        self.writer = writer
+        self.written_version = None
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def on_snapshot(self, snapshot: PriceSnapshot):
+        """
+        Wakes the writer for a newly published snapshot; meant for price_snapshot.subscribe.
+        """
+        self._wake.set()
+
+    def run(self):
+        """
+        Writes the newest snapshot whenever one was published since the last write, until stop() is called.
+        """
+        while not self._stopping:
+            self._wake.wait()
+            self._wake.clear()
+            snapshot = current_snapshot()
+            if snapshot.version == self.written_version:
+                continue
+            try:
+                self.writer.write_snapshot(snapshot)
+                self.written_version = snapshot.version
+            except Exception as e:
+                print(f"Error writing shared prices for version {snapshot.version}: {e!r}")
+
+    def start(self) -> "SharedPublisher":
+        """
+        Runs the writer on a background thread, after writing the current snapshot.
+        """
+        self._stopping = False
+        self._wake.set()
+        self._thread = threading.Thread(target=self.run, name="shared-prices", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the writer after its current write.
+        """
+        self._stopping = True
+        self._wake.set()
+
+def start_shared_publisher(name: str = SHARED_PRICES_NAME) -> SharedPublisher:
+    """
+    Creates the shared segment and mirrors every published price snapshot into it from a writer thread.
+    Call this in the one process that fetches prices.
+    """
+    publisher = SharedPublisher(SharedPrices.create(name))
+    subscribe(publisher.on_snapshot)
+    return publisher.start()
+
+def shared_snapshot(name: str = SHARED_PRICES_NAME) -> PriceSnapshot:
+    """
+    Returns the latest snapshot published by the fetching process, attaching to its segment on first use.
+    Use this instead of prices.fetch_prices in processes that only read prices.
+    """
+    global _reader
+
+    if _reader is None:
+        _reader = SharedPrices.attach(name)
+    return _reader.read_snapshot()
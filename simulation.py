@@ -0,0 +1,258 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from eth_abi import decode_abi
+from web3 import Web3
+
+from web3_provider import PROVIDER_ENDPOINT, get_web3
+
+# Define the local forks the simulation workers run against, one worker per fork (e.g. anvil --port 8545)
+SIMULATION_FORK_ENDPOINTS = os.environ.get("SIMULATION_FORK_ENDPOINTS", "http://127.0.0.1:8545").split(",")
+
+# Define the upstream node the forks are reset onto
+FORK_UPSTREAM_ENDPOINT = os.environ.get("FORK_UPSTREAM_ENDPOINT", PROVIDER_ENDPOINT)
+
+# Define the native balance given to the simulating wallet so gas never limits a simulation (in wei)
+SIMULATION_BALANCE = Web3.toWei(1000, "ether")
+
+# Define the gas limit used for simulated transactions that do not bring their own, and the deadline patched into them
+SIMULATION_GAS_LIMIT = 3000000
+SIMULATION_DEADLINE = 2 ** 32 - 1
+
+# Define the selectors of the Solidity Error(string) and Panic(uint256) revert payloads
+ERROR_SELECTOR = "0x08c379a0"
+PANIC_SELECTOR = "0x4e487b71"
+
+# Define the contract ABI for the decentralized exchanges
+EXCHANGE_ABI = [
+    {
+        "inputs": [
+            {
+                "internalType": "address",
+                "name": "tokenIn",
+                "type": "address"
+            },
+            {
+                "internalType": "address",
+                "name": "tokenOut",
+                "type": "address"
+            },
+            {
+                "internalType": "uint256",
+                "name": "amountIn",
+                "type": "uint256"
+            },
+            {
+                "internalType": "uint256",
+                "name": "amountOutMin",
+                "type": "uint256"
+            },
+            {
+                "internalType": "address[]",
+                "name": "path",
+                "type": "address[]"
+            },
+            {
+                "internalType": "address",
+                "name": "to",
+                "type": "address"
+            },
+            {
+                "internalType": "uint256",
+                "name": "deadline",
+                "type": "uint256"
+            }
+        ],
+        "name": "swap",
+        "outputs": [
+            {
+                "internalType": "uint256",
+                "name": "amountOut",
+                "type": "uint256"
+            }
+        ],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+class SwapCall(NamedTuple):
+    """
+    One hop of a route: a swap call on an exchange, in raw token units.
+    amount_in of None takes the previous hop's output.
+    """
+    exchange: str
+    token_in: str
+    token_out: str
+    amount_in: Optional[int] = None
+    amount_out_min: int = 0
+    path: Optional[List[str]] = None
+
+# Define the selector of the exchanges' swap function, to find the hops of a route in a call trace
+SWAP_SELECTOR = Web3.toHex(Web3.keccak(text="swap(address,address,uint256,uint256,address[],address,uint256)")[:4])
+
+class RouteTransaction(NamedTuple):
+    """
+    A route's transaction exactly as the executor fires it: the contract called (the flash loan pool),
+    the calldata filled from the route's template, its gas limit, and the exchanges its hops call, in order.
+    """
+    to: str
+    data: bytes
+    exchanges: List[str]
+    gas_limit: int = SIMULATION_GAS_LIMIT
+
+class SimulationResult(NamedTuple):
+    """
+    The outcome of simulating a route: the output and gas of every hop that ran, the total gas used,
+    and the revert reason if the transaction failed.
+    """
+    success: bool
+    amounts_out: List[int]
+    gas_used: int
+    revert_reason: Optional[str]
+    block_number: int
+    hop_gas: Optional[List[int]] = None
+
+# Define the fork state of each endpoint in this process: {"block_number", "snapshot", "wallets"}
+_forks: Dict[str, dict] = {}
+_worker_endpoint = None
+
+def _rpc(web3: Web3, method: str, params: list):
+    response = web3.provider.make_request(method, params)
+    if "error" in response:
+        raise RuntimeError(f"{method} failed: {response['error']}")
+    return response.get("result")
+
+def decode_revert(error: dict) -> str:
+    """
+    Turns a JSON-RPC execution error into a readable revert reason, decoding Error(string) and Panic(uint256) payloads.
+    """
+    data = error.get("data")
+    if isinstance(data, dict):
+        data = data.get("data")
+    if isinstance(data, str) and len(data) >= 10:
+        payload = bytes.fromhex(data[10:])
+        try:
+            if data[:10] == ERROR_SELECTOR:
+                return decode_abi(["string"], payload)[0]
+            if data[:10] == PANIC_SELECTOR:
+                return f"Panic({decode_abi(['uint256'], payload)[0]:#x})"
+        except Exception:
+            pass
+        return data
+    return error.get("message", "execution reverted")
+
+def prepare_fork(endpoint: str, block_number: int, wallet: str) -> Web3:
+    """
+    Brings the fork at endpoint to a clean copy of block_number. The first route of a block resets the
+    fork onto the upstream node and snapshots it; later routes in the same block only revert to that snapshot.
+    """
+    web3 = get_web3(endpoint)
+    state = _forks.get(endpoint)
+    if state is None or state["block_number"] != block_number:
+        _rpc(web3, "anvil_reset", [{"forking": {"jsonRpcUrl": FORK_UPSTREAM_ENDPOINT, "blockNumber": block_number}}])
+        state = {"block_number": block_number, "snapshot": None, "wallets": set()}
+        _forks[endpoint] = state
+    elif state["snapshot"] is not None:
+        # A revert consumes the snapshot, so a fresh one is taken below
+        _rpc(web3, "evm_revert", [state["snapshot"]])
+
+    if wallet not in state["wallets"]:
+        _rpc(web3, "anvil_impersonateAccount", [wallet])
+        _rpc(web3, "anvil_setBalance", [wallet, hex(SIMULATION_BALANCE)])
+        state["wallets"].add(wallet)
+
+    state["snapshot"] = _rpc(web3, "evm_snapshot", [])
+    return web3
+
+def trace_hops(trace: dict, exchanges: Sequence[str]) -> List[dict]:
+    """
+    Returns the swap calls to the route's exchanges in a callTracer trace, in execution order.
+    """
+    exchanges = {exchange.lower() for exchange in exchanges}
+    hops = []
+    calls = [trace]
+    while calls:
+        call = calls.pop(0)
+        if (call.get("to") or "").lower() in exchanges and (call.get("input") or "")[:10] == SWAP_SELECTOR:
+            hops.append(call)
+        calls[:0] = call.get("calls") or []
+    return hops
+
+def simulate_transaction(transaction: RouteTransaction, block_number: int, wallet: str, endpoint: str = SIMULATION_FORK_ENDPOINTS[0]) -> SimulationResult:
+    """
+    Sends a route's transaction from wallet on a fork of block_number, so the simulation runs the same
+    flash loan and executor contract calls as the transaction that is fired. It is eth_call'ed first for
+    its revert reason, then sent and traced for the output and gas of each hop.
+    """
+    wallet = Web3.toChecksumAddress(wallet)
+    web3 = prepare_fork(endpoint, block_number, wallet)
+    call = {
+        "from": wallet,
+        "to": Web3.toChecksumAddress(transaction.to),
+        "data": "0x" + bytes(transaction.data).hex(),
+        "gas": hex(transaction.gas_limit)
+    }
+
+    response = web3.provider.make_request("eth_call", [call, "latest"])
+    if "error" in response:
+        return SimulationResult(False, [], 0, decode_revert(response["error"]), block_number)
+
+    transaction_hash = _rpc(web3, "eth_sendTransaction", [call])
+    receipt = _rpc(web3, "eth_getTransactionReceipt", [transaction_hash])
+    gas_used = int(receipt["gasUsed"], 16)
+    if int(receipt["status"], 16) != 1:
+        return SimulationResult(False, [], gas_used, "transaction reverted", block_number)
+
+    hops = trace_hops(_rpc(web3, "debug_traceTransaction", [transaction_hash, {"tracer": "callTracer"}]), transaction.exchanges)
+    amounts_out = [int(hop["output"], 16) if hop.get("output") not in (None, "0x") else 0 for hop in hops]
+    hop_gas = [int(hop["gasUsed"], 16) for hop in hops]
+    return SimulationResult(True, amounts_out, gas_used, None, block_number, hop_gas)
+
+def _init_worker(endpoints: List[str], counter):
+    global _worker_endpoint
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    _worker_endpoint = endpoints[index % len(endpoints)]
+
+def _simulate_in_worker(transaction: RouteTransaction, block_number: int, wallet: str) -> SimulationResult:
+    try:
+        return simulate_transaction(transaction, block_number, wallet, _worker_endpoint)
+    except Exception as e:
+        return SimulationResult(False, [], 0, f"simulation failed: {e!r}", block_number)
+
+class RouteSimulator:
+    """
+    Simulates route transactions in a pool of worker processes, each pinned to its own fork so they run
+    in parallel. Transactions of the same block reuse each fork's snapshot of that block.
+    """
+
+    def __init__(self, endpoints: List[str] = SIMULATION_FORK_ENDPOINTS):
+        self.endpoints = list(endpoints)
+        context = multiprocessing.get_context("spawn")
+        self._executor = ProcessPoolExecutor(
+            max_workers=len(self.endpoints),
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.endpoints, context.Value("i", 0))
+        )
+
+    def simulate(self, transactions: Sequence[RouteTransaction], wallet: str, block_number: int = None) -> List[SimulationResult]:
+        """
+        Simulates every transaction from wallet on a fork of block_number, the upstream node's latest block by default.
+        Returns one SimulationResult per transaction, in order.
+        """
+        if block_number is None:
+            block_number = get_web3(FORK_UPSTREAM_ENDPOINT).eth.block_number
+        futures = [self._executor.submit(_simulate_in_worker, transaction, block_number, wallet) for transaction in transactions]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Shuts the worker processes down.
+        """
+        self._executor.shutdown()
@@ -1,13 +1,90 @@
-def get_slippage(base_asset: str, trading_pair: str) -> float:
+from typing import List, Tuple
+
+import numpy as np
+
+from amm_pools import POOL_STATE, Pool, find_pools, mid_price, quote
+from prices import token_symbol
+
+# Define the slippage assumed for pairs with no known pool (as a fraction of the traded amount)
+DEFAULT_SLIPPAGE = 0.005
+
+def pool_rate(pool: Pool, token_in: str, state: dict = None) -> float:
+    """
+    Returns the marginal rate of token_in in the other token of the pool, before fees.
+    """
+    price = mid_price(pool, state)
+    if not price:
+        return None
+    return price if token_in == pool.token0 else 1 / price
+
+def price_impact(pool: Pool, token_in: str, sizes, state: dict = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the output and the price impact of selling each size (in whole tokens of token_in) into pool.
+    Impact is the shortfall of the execution rate against the marginal rate, net of the pool fee,
+    so a size small enough not to move the price has zero impact.
+    Returns (amounts_out, impacts), both with the shape of sizes.
+    """
+    if state is None:
+        state = POOL_STATE[pool.address]
+
+    sizes = np.asarray(sizes, dtype=np.float64)
+    amounts_out = quote(pool, token_in, sizes, state)
+    rate = pool_rate(pool, token_in, state)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        impacts = 1 - amounts_out / (sizes * rate * (1 - pool.fee))
+    impacts = np.where(sizes > 0, impacts, 0.0)
+    return amounts_out, impacts
+
+def size_grid(max_size: float, points: int = 64, min_size: float = None) -> np.ndarray:
+    """
+    Returns a geometric grid of trade sizes up to max_size, dense at the small end where impact changes fastest.
     """
-    Estimates the slippage for a given trading pair on a DEX aggregator.
+    if min_size is None:
+        min_size = max_size / 10 ** 4
+    return np.geomspace(min_size, max_size, points)
+
+def slippage_curve(base_asset: str, quote_asset: str, sizes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the best output and the matching impact for selling each size of base_asset for quote_asset,
+    across every pool with loaded state that trades the pair. Aliases such as ETH resolve to the token they stand for.
+    Sizes that no pool can fill come back as zero output with full impact.
+    """
+    base_asset, quote_asset = token_symbol(base_asset), token_symbol(quote_asset)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    best_out = np.zeros(sizes.shape)
+    best_impact = np.ones(sizes.shape)
+
+    for pool in find_pools(base_asset, quote_asset):
+        state = POOL_STATE.get(pool.address)
+        if not state or not pool_rate(pool, base_asset, state):
+            continue
+        amounts_out, impacts = price_impact(pool, base_asset, sizes, state)
+        better = amounts_out > best_out
+        best_out = np.where(better, amounts_out, best_out)
+        best_impact = np.where(better, impacts, best_impact)
+
+    return best_out, best_impact
+
+def best_size(sizes, net_profits) -> Tuple[float, float]:
     """
-    if trading_pair in paraswap_prices[base_asset]:
-        price = paraswap_prices[base_asset][trading_pair]
-        gas_fee = gas_fees[base_asset]["paraswap"] + gas_fees[trading_pair]["paraswap"]
-    else:
-        price = oneinch_prices[base_asset][trading_pair]
-        gas_fee = gas_fees[base_asset]["1inch"] + gas_fees[trading_pair]["1inch"]
+    Picks the size with the highest net profit from a grid. Returns (size, net_profit).
+    """
+    net_profits = np.asarray(net_profits, dtype=np.float64)
+    index = int(np.nanargmax(net_profits))
+    return float(np.asarray(sizes)[index]), float(net_profits[index])
+
+def get_slippage(base_asset: str, trading_pair: str, amount: float = 1.0) -> float:
+    """
+    Estimates the slippage of selling amount of base_asset for the trading_pair token, from pool reserves and ticks.
+    Falls back to DEFAULT_SLIPPAGE when no pool with loaded state trades the pair.
+    """
+    amounts_out, impacts = slippage_curve(base_asset, trading_pair, [amount])
+    if amounts_out[0] <= 0:
+        return DEFAULT_SLIPPAGE
+    return float(impacts[0])
 
-    slippage = gas_fee / (price * (1 - SLIPPAGE_THRESHOLD)) if price > 0 else 1
-    return slippage
\ No newline at end of file
+def get_slippages(pairs: List[str], amount: float = 1.0) -> np.ndarray:
+    """
+    Returns get_slippage for every "BASE/QUOTE" pair, as an array aligned with pairs.
+    """
+    return np.array([get_slippage(*pair.split("/"), amount) for pair in pairs], dtype=np.float64)
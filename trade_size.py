@@ -0,0 +1,160 @@
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from amm_pools import POOL_STATE, Pool, find_pools, quote
+from slippage import pool_rate
+
+# Define the number of sizes evaluated per round, and the number of rounds, in the bracketed search
+SEARCH_POINTS = 32
+SEARCH_ROUNDS = 3
+
+# Define the smallest size searched, as a fraction of the upper bound
+SEARCH_FLOOR = 1e-6
+
+class V2Hop(NamedTuple):
+    """
+    A constant-product hop, with both reserves in whole tokens.
+    """
+    reserve_in: float
+    reserve_out: float
+    fee: float
+
+# A hop is either a constant-product pool or a function mapping input amounts (array-like) to output amounts
+Hop = Union[V2Hop, Callable[[np.ndarray], np.ndarray]]
+
+def hop_output(hop: Hop, amount_in):
+    """
+    Returns the output of a single hop, element-wise for arrays of input amounts.
+    """
+    if isinstance(hop, V2Hop):
+        amount_in_after_fee = np.asarray(amount_in, dtype=np.float64) * (1 - hop.fee)
+        return amount_in_after_fee * hop.reserve_out / (hop.reserve_in + amount_in_after_fee)
+    return hop(amount_in)
+
+def route_output(route: Sequence[Hop], amount_in):
+    """
+    Returns the output of a route, element-wise for arrays of input amounts.
+    """
+    amount = amount_in
+    for hop in route:
+        amount = hop_output(hop, amount)
+    return amount
+
+def compose_v2(route: Sequence[V2Hop]) -> Tuple[float, float, float]:
+    """
+    Folds a route of constant-product hops into one equivalent curve out = a * x / (b + c * x).
+    A single hop is (reserve_out * g, reserve_in, g) with g = 1 - fee, and chaining two such curves
+    gives another one: (a1 * a2, b1 * b2, b2 * c1 + c2 * a1).
+    """
+    a, b, c = 1.0, 1.0, 0.0
+    for hop in route:
+        g = 1 - hop.fee
+        a, b, c = a * hop.reserve_out * g, b * hop.reserve_in, hop.reserve_in * c + g * a
+    return a, b, c
+
+def optimal_v2_input(route: Sequence[V2Hop]) -> Tuple[float, float]:
+    """
+    Closed-form profit-maximizing input for a cyclic route of constant-product hops.
+    Profit a * x / (b + c * x) - x peaks where (b + c * x) ** 2 = a * b, i.e. x = (sqrt(a * b) - b) / c.
+    Returns (amount_in, profit), or (0.0, 0.0) if the route is not profitable at any size.
+    """
+    a, b, c = compose_v2(route)
+    if a <= b or c <= 0:
+        return 0.0, 0.0
+    amount_in = (np.sqrt(a * b) - b) / c
+    return float(amount_in), float(a * amount_in / (b + c * amount_in) - amount_in)
+
+def _bracketed_search(profit: Callable[[np.ndarray], np.ndarray], upper: float) -> Tuple[float, float]:
+    """
+    Maximizes a concave profit curve on (0, upper]. Each round evaluates the whole grid in one vectorized
+    call, keeps the bracket around the best point and refines it on a finer grid.
+    """
+    grid = np.geomspace(upper * SEARCH_FLOOR, upper, SEARCH_POINTS)
+    for _ in range(SEARCH_ROUNDS):
+        values = profit(grid)
+        best = int(np.nanargmax(values))
+        lower_bound = grid[best - 1] if best > 0 else 0.0
+        upper_bound = grid[min(best + 1, len(grid) - 1)]
+        grid = np.linspace(lower_bound, upper_bound, SEARCH_POINTS)
+
+    values = profit(grid)
+    best = int(np.nanargmax(values))
+    return float(grid[best]), float(values[best])
+
+def optimal_trade_size(route: Sequence[Hop], max_amount: float = None) -> Tuple[float, float]:
+    """
+    Finds the input amount that maximizes route_output(route, x) - x for a cyclic route.
+    Uses the closed form when every hop is constant-product, and a bracketed search on (0, max_amount]
+    otherwise. max_amount also caps the closed-form answer, and defaults to the first hop's input reserve.
+    Returns (amount_in, profit), or (0.0, 0.0) if no size is profitable.
+    """
+    if max_amount is None:
+        if not isinstance(route[0], V2Hop):
+            raise ValueError("max_amount is required when the first hop is not a constant-product pool")
+        max_amount = route[0].reserve_in
+
+    if all(isinstance(hop, V2Hop) for hop in route):
+        amount_in, profit = optimal_v2_input(route)
+        if amount_in <= max_amount:
+            return amount_in, profit
+        return max_amount, float(route_output(route, max_amount) - max_amount)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amount_in, profit = _bracketed_search(lambda x: route_output(route, x) - x, max_amount)
+    if not profit > 0:
+        return 0.0, 0.0
+    return amount_in, profit
+
+def pool_hop(pool: Pool, token_in: str, state: dict = None) -> Hop:
+    """
+    Turns a pool with loaded state into a hop selling token_in, in whole-token units.
+    """
+    if state is None:
+        state = POOL_STATE[pool.address]
+
+    if pool.kind == "v2":
+        if token_in == pool.token0:
+            return V2Hop(state["reserve0"] / 10 ** pool.decimals0, state["reserve1"] / 10 ** pool.decimals1, pool.fee)
+        return V2Hop(state["reserve1"] / 10 ** pool.decimals1, state["reserve0"] / 10 ** pool.decimals0, pool.fee)
+    return lambda amount_in: quote(pool, token_in, amount_in, state)
+
+def input_capacity(pool: Pool, token_in: str, state: dict = None) -> float:
+    """
+    Returns the pool's depth on the input side, in whole tokens: the reserve for V2 pools and the
+    virtual reserve of the current liquidity for V3 pools. Used as the search bound.
+    """
+    if state is None:
+        state = POOL_STATE[pool.address]
+
+    if pool.kind == "v2":
+        return state["reserve0"] / 10 ** pool.decimals0 if token_in == pool.token0 else state["reserve1"] / 10 ** pool.decimals1
+    sqrt_price = state["sqrt_price_x96"] / 2 ** 96
+    if token_in == pool.token0:
+        return state["liquidity"] / sqrt_price / 10 ** pool.decimals0
+    return state["liquidity"] * sqrt_price / 10 ** pool.decimals1
+
+def route_from_path(path: Sequence[str], pool_addresses: Sequence[str] = None) -> Optional[Tuple[List[Hop], float]]:
+    """
+    Builds a route through the loaded pools for a token path, using the given pool address for each hop,
+    or else the pool with the best marginal rate after fees. Returns (route, max_amount), or None if some
+    hop has no loaded pool.
+    """
+    route = []
+    max_amount = None
+    for hop, (token_in, token_out) in enumerate(zip(path, path[1:])):
+        pools = find_pools(token_in, token_out)
+        if pool_addresses is not None:
+            pools = [pool for pool in pools if pool.address.lower() == pool_addresses[hop].lower()]
+        candidates = [
+            (pool_rate(pool, token_in, POOL_STATE[pool.address]) * (1 - pool.fee), pool)
+            for pool in pools
+            if POOL_STATE.get(pool.address) and pool_rate(pool, token_in, POOL_STATE[pool.address])
+        ]
+        if not candidates:
+            return None
+        _, pool = max(candidates, key=lambda candidate: candidate[0])
+        route.append(pool_hop(pool, token_in))
+        if max_amount is None:
+            max_amount = input_capacity(pool, token_in)
+    return route, max_amount
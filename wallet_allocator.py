@@ -0,0 +1,198 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from web3 import Web3
+
+from balances import BALANCE_TABLE, BalanceSnapshot, BalanceTable
+from nonce_manager import NONCE_MANAGER, NonceManager
+
+# Define how long capital assigned to an opportunity stays reserved unless released first (in seconds)
+RESERVATION_TTL = 30.0
+
+# Define how long a recorded fill's expected balance change is kept without seeing its Transfer logs (in seconds)
+FILL_TTL = 60.0
+
+# Define the event topic of ERC-20 Transfer logs
+TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)").hex()
+
+def _topic_address(address: str) -> str:
+    return "0x" + "0" * 24 + address[2:].lower()
+
+class WalletAllocator:
+    """
+    Decides which wallet executes each opportunity without asking the node for balances.
+    Balances start from the BalanceTable's latest snapshot and are kept current between snapshots from
+    our own fills and from the Transfer logs of the tracked tokens. A fill's expected balance change is
+    applied as soon as it is recorded and swapped for the actual transfers once its logs arrive; transfers
+    in blocks the snapshot already covers are skipped.
+    Capital assigned to an opportunity is reserved until it is released or RESERVATION_TTL passes.
+    Balances are (wallets, tokens) arrays in whole tokens, laid out like the table's.
+    """
+
+    def __init__(self, table: BalanceTable = BALANCE_TABLE, nonces: NonceManager = NONCE_MANAGER):
+        self.table = table
+        self.wallets = table.wallets
+        self.nonces = nonces
+        shape = (len(table.wallets), len(table.tokens))
+        self.block_number: Optional[int] = None
+        self.balances = np.zeros(shape)
+        self.allowances = np.zeros(shape)
+        self.reservations: List[Tuple[float, int, np.ndarray]] = []
+        self.fills: Dict[str, Tuple[int, np.ndarray, float]] = {}
+        self.transfers: List[Tuple[int, int, int, float]] = []
+        self._topics = {_topic_address(wallet): i for i, wallet in enumerate(self.wallets)}
+        self._lock = threading.Lock()
+        table.subscribe(self.load)
+        if table.snapshot is not None:
+            self.load(table.snapshot)
+
+    def load(self, snapshot: BalanceSnapshot):
+        """
+        Replaces the balances with a table snapshot, then replays the fills and transfers it does not cover yet.
+        Fills older than FILL_TTL are dropped: they either reverted or are already in the snapshot.
+        """
+        now = time.time()
+        with self._lock:
+            if self.block_number is not None and snapshot.block_number < self.block_number:
+                return
+            self.block_number = snapshot.block_number
+            self.balances = snapshot.balances.copy()
+            self.allowances = snapshot.allowances
+            self.transfers = [transfer for transfer in self.transfers if transfer[0] > snapshot.block_number]
+            for _, wallet, token, amount in self.transfers:
+                self.balances[wallet, token] += amount
+            self.fills = {transaction_hash: fill for transaction_hash, fill in self.fills.items() if now - fill[2] < FILL_TTL}
+            for wallet, deltas, _ in self.fills.values():
+                self.balances[wallet] += deltas
+
+    def _spendable(self, now: float) -> np.ndarray:
+        self.reservations = [reservation for reservation in self.reservations if reservation[0] > now]
+        spendable = np.minimum(self.balances, self.allowances)
+        for _, wallet, required in self.reservations:
+            spendable[wallet] -= required
+        return spendable
+
+    def spendable(self) -> np.ndarray:
+        """
+        Returns what each wallet can still put up of each token, net of reserved capital, as a (wallets, tokens) array.
+        """
+        with self._lock:
+            return self._spendable(time.time())
+
+    def available(self, wallet: str, token: str) -> float:
+        """
+        Returns the wallet's spendable amount of a token less the capital reserved for opportunities in flight.
+        """
+        return float(self.spendable()[self.table.wallet_index[Web3.toChecksumAddress(wallet)], self.table.token_index[token.lower()]])
+
+    def fundable(self, collaterals: List[Dict[str, float]]) -> np.ndarray:
+        """
+        Returns a (collaterals, wallets) boolean array of which wallet could fund which {token address: amount}
+        requirement right now, in a single array comparison.
+        """
+        return self.table.fundable(self.table.collateral_matrix(collaterals), self.spendable())
+
+    def assign(self, collateral: Dict[str, float], ttl: float = RESERVATION_TTL) -> Optional[str]:
+        """
+        Picks the wallet to execute an opportunity needing collateral {token address: amount} and reserves it.
+        Among the wallets with enough free capital, the one with the fewest transactions in flight wins,
+        then the one with the most capital to spare. Returns None if no wallet can fund it.
+        """
+        required = self.table.collateral_matrix([collateral])[0]
+        in_flight = np.array([self.nonces.in_flight(wallet) for wallet in self.wallets])
+        needed = required > 0
+        now = time.time()
+
+        with self._lock:
+            spendable = self._spendable(now)
+            funded = (spendable >= required).all(axis=1)
+            if not funded.any():
+                return None
+            headroom = (spendable[:, needed] / required[needed]).min(axis=1) if needed.any() else np.zeros(len(self.wallets))
+            wallet = min(np.flatnonzero(funded), key=lambda i: (in_flight[i], -headroom[i]))
+            self.reservations.append((now + ttl, wallet, required))
+            return self.wallets[wallet]
+
+    def release(self, wallet: str, collateral: Dict[str, float]):
+        """
+        Frees capital reserved by assign(), e.g. once the opportunity was executed or dropped.
+        """
+        wallet = self.table.wallet_index[Web3.toChecksumAddress(wallet)]
+        required = self.table.collateral_matrix([collateral])[0]
+        with self._lock:
+            for i, (_, reserved_wallet, reserved) in enumerate(self.reservations):
+                if reserved_wallet == wallet and np.array_equal(reserved, required):
+                    del self.reservations[i]
+                    return
+
+    def record_fill(self, wallet: str, transaction_hash: str, deltas: Dict[str, float]):
+        """
+        Applies the expected balance changes {token address: whole tokens} of a transaction we sent,
+        until its Transfer logs replace them with the actual amounts.
+        """
+        wallet = self.table.wallet_index[Web3.toChecksumAddress(wallet)]
+        vector = np.zeros(len(self.table.tokens))
+        for token, delta in deltas.items():
+            token = self.table.token_index.get(token.lower())
+            if token is not None:
+                vector[token] += delta
+        with self._lock:
+            self.fills[transaction_hash.lower()] = (wallet, vector, time.time())
+            self.balances[wallet] += vector
+
+    def track(self, wallet: str, collateral: Dict[str, float], transaction_hash: str, deltas: Dict[str, float], inclusion: Future):
+        """
+        Records the fill of an opportunity that was just sent, and frees its reserved collateral once the
+        inclusion future resolves, whether the transaction was included or dropped.
+        """
+        self.record_fill(wallet, transaction_hash, deltas)
+        inclusion.add_done_callback(lambda _: self.release(wallet, collateral))
+
+    def on_transfer_logs(self, logs: List[dict]):
+        """
+        Updates balances from Transfer logs, e.g. from a BlockStream. Logs removed by a reorg are undone.
+        """
+        decimals = self.table.decimals
+        with self._lock:
+            for log in logs:
+                topics = log.get("topics") or []
+                token = self.table.token_index.get(log.get("address", "").lower())
+                if len(topics) < 3 or topics[0] != TRANSFER_TOPIC or token is None or decimals is None:
+                    continue
+
+                fill = self.fills.pop((log.get("transactionHash") or "").lower(), None)
+                if fill is not None:
+                    self.balances[fill[0]] -= fill[1]
+
+                block_number = int(log["blockNumber"], 16) if log.get("blockNumber") else None
+                if block_number is not None and self.block_number is not None and block_number <= self.block_number:
+                    continue
+                value = int(log["data"], 16) / 10 ** decimals[token] if log.get("data") not in (None, "0x") else 0.0
+                if log.get("removed"):
+                    value = -value
+
+                for topic, sign in ((topics[1], -1), (topics[2], 1)):
+                    wallet = self._topics.get(topic.lower())
+                    if wallet is not None:
+                        self.balances[wallet, token] += sign * value
+                        self.transfers.append((block_number or 0, wallet, token, sign * value))
+
+    def _on_incoming_logs(self, logs: List[dict]):
+        # Transfers between our own wallets also match the outgoing filter, which already applied them
+        self.on_transfer_logs([log for log in logs if len(log.get("topics") or []) < 3 or log["topics"][1].lower() not in self._topics])
+
+    def log_handlers(self) -> List[Tuple[dict, Callable[[List[dict]], None]]]:
+        """
+        Returns the (log filter, callback) pairs for a BlockStream: transfers of the tracked tokens out of and into our wallets.
+        """
+        if not self.wallets or not self.table.tokens:
+            return []
+        addresses = [Web3.toChecksumAddress(token) for token in self.table.tokens]
+        wallet_topics = list(self._topics)
+        return [
+            ({"address": addresses, "topics": [TRANSFER_TOPIC, wallet_topics]}, self.on_transfer_logs),
+            ({"address": addresses, "topics": [TRANSFER_TOPIC, None, wallet_topics]}, self._on_incoming_logs)
+        ]
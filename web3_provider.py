@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+
+# Define the Ethereum network provider endpoint
+PROVIDER_ENDPOINT = os.environ.get("PROVIDER_ENDPOINT", "https://rpc-mainnet.maticvigil.com")
+
+# Define the connection pool limits for HTTP RPC sessions
+RPC_POOL_CONNECTIONS = int(os.environ.get("RPC_POOL_CONNECTIONS", 4))
+RPC_POOL_MAXSIZE = int(os.environ.get("RPC_POOL_MAXSIZE", 32))
+
+# Define the timeout for RPC requests (in seconds)
+RPC_TIMEOUT = int(os.environ.get("RPC_TIMEOUT", 10))
+
+_lock = threading.Lock()
+_providers: Dict[str, Web3] = {}
+_contracts: Dict[Tuple[str, str, str], object] = {}
+_abi_hashes: Dict[int, Tuple[List[dict], str]] = {}
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=RPC_POOL_CONNECTIONS, pool_maxsize=RPC_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_web3(endpoint: str = PROVIDER_ENDPOINT) -> Web3:
+    """
+    Returns the process-wide Web3 instance for an endpoint, creating it on first use.
+    HTTP endpoints share a pooled keep-alive session; ws:// and wss:// endpoints keep one open socket.
+    """
+    web3 = _providers.get(endpoint)
+    if web3 is None:
+        with _lock:
+            web3 = _providers.get(endpoint)
+            if web3 is None:
+                if endpoint.startswith(("ws://", "wss://")):
+                    provider = Web3.WebsocketProvider(endpoint, websocket_timeout=RPC_TIMEOUT)
+                else:
+                    provider = Web3.HTTPProvider(endpoint, request_kwargs={"timeout": RPC_TIMEOUT}, session=_make_session())
+                web3 = Web3(provider)
+                _providers[endpoint] = web3
+    return web3
+
+def abi_hash(abi: List[dict]) -> str:
+    """
+    Returns a stable hash of an ABI. Hashes are memoized per ABI object, so module-level ABIs are only serialized once.
+    """
+    cached = _abi_hashes.get(id(abi))
+    if cached is not None and cached[0] is abi:
+        return cached[1]
+
+    digest = hashlib.sha256(json.dumps(abi, sort_keys=True).encode()).hexdigest()
+    _abi_hashes[id(abi)] = (abi, digest)
+    return digest
+
+def get_contract(address: str, abi: List[dict], endpoint: str = PROVIDER_ENDPOINT):
+    """
+    Returns the cached contract object for (address, ABI hash) on an endpoint, creating it on first use.
+    """
+    address = Web3.toChecksumAddress(address)
+    key = (endpoint, address, abi_hash(abi))
+    contract = _contracts.get(key)
+    if contract is None:
+        contract = get_web3(endpoint).eth.contract(address=address, abi=abi)
+        with _lock:
+            contract = _contracts.setdefault(key, contract)
+    return contract